@@ -5,11 +5,31 @@ import logging
 from logging.config import dictConfig as _dictConfig
 from os import path
 
-import yaml
-
 __author__ = "Samuel Marks"
 __version__ = "0.0.12-beta"
 
+_logging_configured = False
+
+
+def _load_logging_config():
+    """
+    Parse logging.yml, memoized on disk so that YAML needn't be imported on every invocation
+
+    :return: dictConfig compatible logging configuration
+    :rtype: ```dict```
+    """
+    from nginxctl.cache import file_key, memoize
+
+    logging_yml = path.join(path.dirname(__file__), "_data", "logging.yml")
+
+    def parse_logging_yml():
+        import yaml
+
+        with open(logging_yml, "rt") as f:
+            return yaml.load(f, Loader=yaml.SafeLoader)
+
+    return memoize("logging", file_key(logging_yml), parse_logging_yml)
+
 
 def get_logger(name=None):
     """
@@ -21,9 +41,10 @@ def get_logger(name=None):
     :return: instanceof Logger
     :rtype: ```Logger```
     """
-    with open(path.join(path.dirname(__file__), "_data", "logging.yml"), "rt") as f:
-        data = yaml.load(f, Loader=yaml.SafeLoader)
-    _dictConfig(data)
+    global _logging_configured
+    if not _logging_configured:
+        _dictConfig(_load_logging_config())
+        _logging_configured = True
     return logging.getLogger(name=name)
 
 
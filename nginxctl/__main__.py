@@ -1,43 +1,43 @@
 #!/usr/bin/env python
+# -*- coding: utf-8 -*-
 
 import argparse
 import os
 import sys
 from argparse import ArgumentParser
 from collections import deque
+from contextlib import contextmanager
 from enum import Enum
 from itertools import chain
 from operator import itemgetter
 from subprocess import Popen
 
-if sys.version_info[0] == 2:
-    from whichcraft import which
-    from itertools import ifilter as filter
-else:
-    from shutil import which
-
-import crossplane
-
 from nginxctl import __version__, get_logger
-from nginxctl.helpers import strings, unquoted_str, rpartial
+from nginxctl.defaults import get_nginx_defaults
+from nginxctl.helpers import unquoted_str
 
 if sys.version[0] == "2":
     from tempfile import mkdtemp as gettemp
 else:
     from nginxctl.helpers import gettemp
 
-from nginxctl.parser import cli_to_context2block, parse_cli_config
+from nginxctl.parser import iter_cli_blocks
 from nginxctl.pkg_utils import PythonPackageInfo
-from nginxctl.serve import serve
 
 logger = get_logger(sys.modules[__name__].__name__)
 
 
 class Command(Enum):
+    batch = "batch"
     dry_run = "dry_run"
     emit = "emit"
+    fleet = "fleet"
     nginx = "nginx"
+    precompress = "precompress"
+    query = "query"
+    rollback = "rollback"
     serve = "serve"
+    supervise = "supervise"
     upsert = "upsert"
 
     def __str__(self):
@@ -68,12 +68,13 @@ def _build_parser():
             "/etc/nginx/nginx.conf",
         )
     else:
-        default_nginx = which("nginx")
-        default_nginx_usage = next(
-            line for line in strings(default_nginx) if "set prefix path" in line
-        ).split()
-        default_conf = next(filter(rpartial(str.endswith, 'nginx.conf)'), default_nginx_usage))[:-1]
-        default_prefix = os.path.dirname(default_conf)
+        nginx_defaults = get_nginx_defaults()
+        if nginx_defaults is None:
+            default_nginx = default_prefix = default_conf = None
+        else:
+            default_nginx, default_prefix, default_conf = itemgetter(
+                "nginx", "prefix", "conf_path"
+            )(nginx_defaults)
 
     parser = ArgumentParser(
         prog="python -m {}".format(PythonPackageInfo().get_app_name()),
@@ -83,7 +84,7 @@ def _build_parser():
     )
     parser.add_argument(
         "command",
-        help="serve, emit, nginx, or dry_run",
+        help="serve, supervise, fleet, rollback, emit, dry_run, nginx, upsert, query, batch, or precompress",
         type=Command,
         choices=list(Command),
     )
@@ -124,6 +125,60 @@ def _build_parser():
         dest="nginx",
         default=default_nginx,
     )
+    parser.add_argument(
+        "--input",
+        help="batch—and emit and dry_run, when no blocks are given—read site definitions from this file,"
+        " defaults to stdin",
+        default="-",
+    )
+    parser.add_argument(
+        "--format",
+        help="batch input format: a definition per line, NUL separated definitions, or JSON lines of tokens",
+        choices=("lines", "nul", "jsonl"),  # `nginxctl.batch.formats`
+        default="lines",
+    )
+    parser.add_argument(
+        "--output",
+        help="batch, emit and dry_run write to this file (e.g., /dev/fd/3), defaults to stdout",
+        default="-",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="supervise writes its metrics to this file, defaults to nginxctl.metrics in the temp_dir",
+    )
+    parser.add_argument(
+        "--instances",
+        help="fleet applies the config to the nginx in each temp_dir matching this glob, e.g., '/srv/tenants/*'",
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="fleet works on at most this many instances at once",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--query",
+        help="query finds the directives in --config matching this, e.g., 'http > server > location',"
+        " 'proxy_pass', 'root=/srv' or 'server_name=example.com'",
+    )
+    parser.add_argument(
+        "--profile",
+        help="serve, supervise and fleet tune nginx.conf for this, sizing it for the CPUs, file descriptor limit"
+        " and memory of this machine; emit writes a whole config tuned for it, and dry_run reports that nginx.conf",
+        choices=("throughput", "latency", "low-memory"),  # `nginxctl.profiles.names`
+    )
+    parser.add_argument(
+        "--static",
+        help="serve, supervise, emit and dry_run add caching headers, gzip_static, open_file_cache and sendfile/aio"
+        " directives to each location with a root, suited to the files in it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--keep",
+        help="serve, supervise and fleet keep this many snapshots of the config to roll back to",
+        type=int,
+        default=10,
+    )
     parser.add_argument(
         "-b",
         "--block",
@@ -187,8 +242,203 @@ def _build_parser():
     )
 
 
+@contextmanager
+def _open_stream(filename, mode, default):
+    """Open `filename`, or yield `default` (without closing it) when it is "-"."""
+    if filename == "-":
+        yield default
+    else:
+        with open(filename, mode) as f:
+            yield f
+
+
+def _config_tokens(argv, parser, keep):
+    """
+    Drop the options argparse handles itself—and their values—from argv in one pass,
+    leaving the tokens that describe the config
+
+    :param argv: CLI arguments after the command
+    :type argv: ```Iterable[str]```
+
+    :param parser: The parser from `_build_parser`
+    :type parser: ```ArgumentParser```
+
+    :param keep: `dest`s of options that are part of the config, e.g., "block"
+    :type keep: ```FrozenSet[str]```
+
+    :return: Tokens for `iter_cli_blocks`
+    :rtype: ```Iterator[str]```
+    """
+    takes_value = {
+        option: action.nargs != 0
+        for action in parser._actions
+        if action.dest not in keep
+        for option in action.option_strings
+    }
+    skip = False
+    for token in argv:
+        if skip:
+            skip = False
+            continue
+        option, eq, _ = token.partition("=")
+        if option in takes_value:
+            skip = takes_value[option] and not eq
+            continue
+        yield token
+
+
+def _blocks(tokens):
+    """:return: The top-level blocks the CLI tokens describe"""
+    return [block for _, block in iter_cli_blocks(tokens)]
+
+
+def _config_path(known):
+    """:return: `--config`, in `--prefix` if not absolute"""
+    return (
+        known.config
+        if os.path.isabs(known.config)
+        else os.path.join(known.prefix, known.config)
+    )
+
+
+def _precompress(known, parser, nginx_command, tokens):
+    from nginxctl.precompress import precompress
+
+    # The `--root` of each location, or given alone—e.g., `precompress --root /srv`—defaulting to the cwd
+    roots = [root for option, root in zip(tokens, tokens[1:]) if option == "--root"]
+    precompress(roots or [os.getcwd()])
+
+
+def _emit(known, parser, nginx_command, tokens):
+    from nginxctl.batch import iter_records
+    from nginxctl.emit import dry_run, emit
+    from nginxctl.macros import Macros
+    from nginxctl.profiles import tune
+    from nginxctl.static import apply_static
+
+    blocks = _blocks(tokens)
+    with _open_stream(known.input, "rt", sys.stdin) as stream, _open_stream(
+        known.output, "wt", sys.stdout
+    ) as output:
+        # Without blocks on the command-line, stream them from --input
+        if not blocks:
+            macros = Macros()
+            blocks = (
+                block
+                for tokens in iter_records(stream, known.format)
+                for _, block in iter_cli_blocks(tokens, macros)
+            )
+        if known.static:
+            blocks = apply_static(blocks, get_nginx_defaults(known.nginx))
+        tuning = None if known.profile is None else tune(known.profile)
+        if known.command == Command.emit:
+            emit(blocks, output, tuning)
+        elif dry_run(blocks, output, tuning=tuning):
+            sys.exit(1)
+
+
+def _serve(known, parser, nginx_command, tokens):
+    from nginxctl.serve import serve
+
+    serve(known, nginx_command, _blocks(tokens))
+
+
+def _supervise(known, parser, nginx_command, tokens):
+    from nginxctl.supervise import supervise
+
+    sys.exit(supervise(known, nginx_command, _blocks(tokens)))
+
+
+def _fleet(known, parser, nginx_command, tokens):
+    from glob import glob
+
+    from nginxctl.fleet import fleet
+
+    if not known.instances:
+        parser.error("fleet requires --instances")
+    results = fleet(
+        known, nginx_command, _blocks(tokens), sorted(glob(known.instances))
+    )
+    if any(result["status"] in ("invalid", "failed") for result in results):
+        sys.exit(1)
+
+
+def _rollback(known, parser, nginx_command, tokens):
+    from nginxctl import control, snapshot
+
+    print("rolled back to {}".format(snapshot.rollback(known.temp_dir)))
+    pid = control.read_pid(os.path.join(known.temp_dir, control.pid_filename))
+    if pid is not None:
+        control.reload(
+            known.nginx,
+            snapshot.current_path(known.temp_dir, "nginx.conf"),
+            nginx_command,
+        )
+        print("nginx (pid {}) reloaded".format(pid))
+
+
+def _batch(known, parser, nginx_command, tokens):
+    from nginxctl.batch import batch
+
+    with _open_stream(known.input, "rt", sys.stdin) as stream, _open_stream(
+        known.output, "wt", sys.stdout
+    ) as output:
+        batch(stream, output, known.format)
+
+
+def _query(known, parser, nginx_command, tokens):
+    from nginxctl.query import query
+
+    if not known.query:
+        parser.error("query requires --query")
+    nodes = query(_config_path(known), known.query)
+    for node in nodes:
+        print(node)
+    if not nodes:
+        sys.exit(1)
+
+
+def _upsert(known, parser, nginx_command, tokens):
+    from nginxctl.upsert import upsert
+
+    for filename in upsert(("http",), _blocks(tokens), _config_path(known)):
+        print("wrote {}".format(filename))
+
+
+def _nginx(known, parser, nginx_command, tokens):
+    Popen(
+        [
+            known.nginx,
+            "-c",
+            (
+                os.path.join(known.temp_dir, "current", "nginx.conf")
+                if known.config == parser.get_default("config")
+                else known.config
+            ),
+        ]
+        + nginx_command
+    )
+
+
+# Each command's handler, called with the parsed arguments, the parser, the arguments to pass along to nginx, and
+# the tokens describing the config
+_commands = {
+    Command.batch: _batch,
+    Command.dry_run: _emit,
+    Command.emit: _emit,
+    Command.fleet: _fleet,
+    Command.nginx: _nginx,
+    Command.precompress: _precompress,
+    Command.query: _query,
+    Command.rollback: _rollback,
+    Command.serve: _serve,
+    Command.supervise: _supervise,
+    Command.upsert: _upsert,
+}
+
+
 def main():
-    omit, nginx, parser, default_conf = _build_parser()
+    omit, nginx, parser, _ = _build_parser()
     known, unknown = parser.parse_known_args()
     nginx_command = list(
         chain.from_iterable(
@@ -203,63 +453,12 @@ def main():
         if k not in omit_nginx})
     """
 
-    if known.command.value != "nginx":
-        fs = frozenset(
-            map(
-                lambda s: "--{}".format(s),
-                frozenset(
-                    map(
-                        itemgetter(0),
-                        filter(lambda cn: cn[1] is not None, known._get_kwargs()),
-                    )
-                )
-                - omit
-                | nginx,
-            )
-        )
-        cli_to_parse = tuple(
-            chain.from_iterable(
-                (k, v) for k, v in zip(*[iter(sys.argv[2:])] * 2) if k not in fs
-            )
-        ) + ((sys.argv[-1],) if len(sys.argv[2:]) & 1 == 1 else tuple())
-
-        context2block = cli_to_context2block(cli_to_parse)
-        if context2block["server"]:
-            parsed_config = parse_cli_config(context2block["server"])
-            parsed_config_str = crossplane.build([parsed_config]) + os.linesep
-        else:
-            parsed_config = parsed_config_str = None
-
-        if context2block["http"]:
-            parsed_config_http = parse_cli_config(context2block["http"])
-            parsed_config_http_str = crossplane.build([parsed_config_http]) + os.linesep
-        else:
-            parsed_config_http = parsed_config_http_str = None
-
-        if known.command.value == "serve":
-            serve(
-                known,
-                nginx_command,
-                parsed_config,
-                parsed_config_str,
-                parsed_config_http,
-                parsed_config_http_str,
-            )
-        elif known.command.value == "upsert":
-            raise NotImplementedError(known.command)
-        else:
-            raise NotImplementedError(known.command)
-    else:
-        Popen(
-            [
-                known.nginx,
-                "-c",
-                os.path.join(known.temp_dir, "nginx.conf")
-                if known.config == default_conf
-                else known.config,
-            ]
-            + nginx_command
-        )
+    _commands[known.command](
+        known,
+        parser,
+        nginx_command,
+        list(_config_tokens(sys.argv[2:], parser, keep=omit)),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compile many CLI-style site definitions, streamed from a file or stdin, in one process
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+from functools import partial
+from timeit import default_timer
+
+from nginxctl.builder import dump
+from nginxctl.macros import Macros
+from nginxctl.parser import iter_cli_blocks, iter_cli_tokens
+
+formats = "lines", "nul", "jsonl"
+
+
+def iter_records(stream, fmt="lines", chunk_size=1 << 16):
+    """
+    Read site definitions—each the CLI tokens of one or more blocks—from `stream`
+
+    - "lines": one definition per line, shell quoted, e.g., `-b server --listen 80 -}`; blank and `#` lines skipped
+    - "nul": definitions separated by NUL (so they may span lines), shell quoted, e.g., from `printf '%s\\0'`
+    - "jsonl": one JSON array of tokens per line, e.g., `["-b", "server", "--listen", "80", "-}"]`
+
+    :param stream: Text stream, e.g., `sys.stdin`
+    :type stream: ```TextIO```
+
+    :param fmt: One of `formats`
+    :type fmt: ```str```
+
+    :param chunk_size: Read size for "nul"
+    :type chunk_size: ```int```
+
+    :return: Tokens of each definition
+    :rtype: ```Iterator[List[str]]```
+    """
+    if fmt == "lines":
+        for line in stream:
+            tokens = list(iter_cli_tokens((line,)))
+            if tokens:
+                yield tokens
+    elif fmt == "nul":
+        carry = ""
+        for chunk in iter(partial(stream.read, chunk_size), ""):
+            records = (carry + chunk).split("\0")
+            carry = records.pop()
+            for record in records:
+                tokens = list(iter_cli_tokens(record.splitlines()))
+                if tokens:
+                    yield tokens
+        tokens = list(iter_cli_tokens(carry.splitlines()))
+        if tokens:
+            yield tokens
+    elif fmt == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError("fmt must be one of {!r}, got {!r}".format(formats, fmt))
+
+
+def compile_records(records):
+    """
+    :param records: Tokens of each definition, e.g., from `iter_records`
+    :type records: ```Iterable[List[str]]```
+
+    :return: All top-level blocks—in order—and how many records they came from
+    :rtype: ```Tuple[List[Directive], int]```
+    """
+    blocks, n, macros = [], 0, Macros()
+    for n, tokens in enumerate(records, 1):
+        blocks += (block for _, block in iter_cli_blocks(tokens, macros))
+    return blocks, n
+
+
+def batch(stream, output, fmt="lines"):
+    """
+    Compile every definition in `stream` and write the combined config to `output`, in buffered writes.
+    Throughput is reported on stderr.
+
+    :param stream: Text stream to read definitions from, see `iter_records`
+    :type stream: ```TextIO```
+
+    :param output: Text stream the config is written to
+    :type output: ```TextIO```
+
+    :param fmt: One of `formats`
+    :type fmt: ```str```
+
+    :return: records, blocks, and seconds taken
+    :rtype: ```dict```
+    """
+    start = default_timer()
+    blocks, n = compile_records(iter_records(stream, fmt))
+    if dump(blocks, output):
+        output.write(os.linesep)
+    output.flush()
+    stats = {"records": n, "blocks": len(blocks), "seconds": default_timer() - start}
+    print(
+        "compiled {records} records ({blocks} blocks) in {seconds:.3f}s"
+        " ({rate:.0f} records/s)".format(
+            rate=n / stats["seconds"] if stats["seconds"] else float("inf"), **stats
+        ),
+        file=sys.stderr,
+    )
+    return stats
+
+
+__all__ = ["batch", "compile_records", "formats", "iter_records"]
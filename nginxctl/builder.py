@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build nginx config text from a directive tree piece by piece, rather than as one string
+"""
+
+from crossplane.builder import EXTERNAL_BUILDERS, _enquote
+
+HEADER = (
+    "# This config was built from JSON using NGINX crossplane.\n"
+    "# If you encounter any bugs please report them here:\n"
+    "# https://github.com/nginxinc/crossplane/issues\n"
+    "\n"
+)
+
+
+def iter_build(payload, indent=4, tabs=False, header=False):
+    """
+    Like `crossplane.build(payload, …)`, but yields the config a directive at a time: joined, the pieces equal
+    `crossplane.build`'s output. `payload` is only iterated once, so it may be a generator.
+
+    :param payload: Directives, as in crossplane's payload, or `Directive`s
+    :type payload: ```Iterable[Union[dict, Directive]]```
+
+    :param indent: Spaces per level of nesting
+    :type indent: ```int```
+
+    :param tabs: Indent with a tab per level instead
+    :type tabs: ```bool```
+
+    :param header: Whether to start with crossplane's header comment
+    :type header: ```bool```
+
+    :return: Pieces of the config
+    :rtype: ```Iterator[str]```
+    """
+    if header:
+        yield HEADER
+    for piece in _iter_block(
+        payload, 0, 0, "\t" if tabs else " " * indent, indent, tabs, False
+    ):
+        yield piece
+
+
+def dump(payload, fp, indent=4, tabs=False, header=False, buffer_size=1 << 16):
+    """
+    Write the config to `fp` as it's built, in writes of about `buffer_size` characters. What's written is
+    exactly `crossplane.build(payload, …)`, but neither it nor more than a buffer of it is held in memory.
+
+    :param payload: Directives, as in crossplane's payload, or `Directive`s
+    :type payload: ```Iterable[Union[dict, Directive]]```
+
+    :param fp: Text stream
+    :type fp: ```TextIO```
+
+    :param indent: Spaces per level of nesting
+    :type indent: ```int```
+
+    :param tabs: Indent with a tab per level instead
+    :type tabs: ```bool```
+
+    :param header: Whether to start with crossplane's header comment
+    :type header: ```bool```
+
+    :param buffer_size: Characters to gather before each write
+    :type buffer_size: ```int```
+
+    :return: Number of characters written
+    :rtype: ```int```
+    """
+    buffered, size, written = [], 0, 0
+    for piece in iter_build(payload, indent, tabs, header):
+        buffered.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            fp.write("".join(buffered))
+            written += size
+            buffered, size = [], 0
+    if buffered:
+        fp.write("".join(buffered))
+        written += size
+    return written
+
+
+def _iter_block(block, depth, last_line, padding, indent, tabs, started):
+    """
+    `crossplane.build`'s `_build_block`, yielding rather than concatenating.
+    `started` is whether anything precedes this block, i.e., whether its first directive needs a newline.
+    """
+    margin = padding * depth
+    for stmt in block:
+        directive = _enquote(stmt["directive"])
+        line = stmt.get("line", 0)
+
+        if directive == "#" and line == last_line:
+            yield " #" + stmt["comment"]
+            started = True
+            continue
+        elif directive == "#":
+            built = "#" + stmt["comment"]
+        elif directive in EXTERNAL_BUILDERS:
+            built = EXTERNAL_BUILDERS[directive](stmt, padding, indent, tabs)
+        else:
+            args = [_enquote(arg) for arg in stmt["args"]]
+
+            if directive == "if":
+                built = "if (" + " ".join(args) + ")"
+            elif args:
+                built = directive + " " + " ".join(args)
+            else:
+                built = directive
+
+            if stmt.get("block") is not None:
+                yield ("\n" if started else "") + margin + built + " {"
+                for piece in _iter_block(
+                    stmt["block"], depth + 1, line, padding, indent, tabs, True
+                ):
+                    yield piece
+                yield "\n" + margin + "}"
+                started, last_line = True, line
+                continue
+            built += ";"
+
+        yield ("\n" if started else "") + margin + built
+        started, last_line = True, line
+
+
+__all__ = ["dump", "iter_build"]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+Small on-disk cache for values that are expensive to compute on every invocation
+"""
+
+import json
+import os
+
+from nginxctl.helpers import atomic_write
+
+
+def get_cache_dir():
+    """
+    Directory the cache lives in. `NGINXCTL_CACHE_DIR` overrides it; set it to the empty string to disable caching.
+
+    :return: Cache directory, or None when caching is disabled
+    :rtype: ```Optional[str]```
+    """
+    cache_dir = os.environ.get("NGINXCTL_CACHE_DIR")
+    if cache_dir is None:
+        return os.path.join(
+            os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"),
+            "nginxctl",
+        )
+    return cache_dir or None
+
+
+def file_key(filename):
+    """
+    Cache key component that changes whenever `filename` is replaced or modified
+
+    :param filename: Path to a file
+    :type filename: ```str```
+
+    :return: realpath, inode, mtime and size of the file
+    :rtype: ```List[Union[str, float, int]]```
+    """
+    st = os.stat(filename)
+    return [os.path.realpath(filename), st.st_ino, st.st_mtime, st.st_size]
+
+
+def memoize(name, key, compute):
+    """
+    Get the value stored under `name` if it was stored with the same `key`, else compute and store it
+
+    :param name: Name of the cache entry, used as its filename
+    :type name: ```str```
+
+    :param key: JSON serialisable key; package version is added to it
+    :type key: ```list```
+
+    :param compute: Produces the value (JSON serialisable) on a cache miss
+    :type compute: ```Callable[[], Any]```
+
+    :return: The cached or computed value
+    :rtype: ```Any```
+    """
+    from nginxctl import __version__
+
+    key = [__version__] + list(key)
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return compute()
+
+    cache_file = os.path.join(cache_dir, "{}.json".format(name))
+    try:
+        with open(cache_file, "rt") as f:
+            entry = json.load(f)
+        if entry["key"] == key:
+            return entry["value"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    value = compute()
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        atomic_write(cache_file, json.dumps({"key": key, "value": value}))
+    except (IOError, OSError):
+        pass  # An unwritable cache only costs speed
+    return value
+
+
+__all__ = ["file_key", "get_cache_dir", "memoize"]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Control a running nginx master: find it by its pid file, validate a config, and reload it
+"""
+
+import errno
+import os
+from subprocess import PIPE, Popen
+
+pid_filename = "nginx.pid"
+
+
+def read_pid(pid_file):
+    """
+    :param pid_file: Path to the pid file the nginx master writes
+    :type pid_file: ```str```
+
+    :return: pid of the master, if the pid file exists and that process is alive
+    :rtype: ```Optional[int]```
+    """
+    try:
+        with open(pid_file, "rt") as f:
+            pid = int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM:  # Stale pid file
+            return None
+    return pid
+
+
+def check_returncode(args, returncode, stdout, stderr):
+    """Raise EnvironmentError with nginx's output if it failed"""
+    if returncode != 0:
+        raise EnvironmentError(
+            "{} exited with {}: {}".format(
+                " ".join(args),
+                returncode,
+                (stderr or stdout).decode("utf8", "replace").strip(),
+            )
+        )
+
+
+def validate_args(nginx, nginx_conf, nginx_command=()):
+    """:return: Arguments that validate `nginx_conf`"""
+    return [nginx, "-t", "-q", "-c", nginx_conf] + list(nginx_command)
+
+
+def reload_args(nginx, nginx_conf, nginx_command=()):
+    """:return: Arguments that have the master running `nginx_conf` reload it"""
+    return [nginx, "-c", nginx_conf] + list(nginx_command) + ["-s", "reload"]
+
+
+def _run(args):
+    """Run nginx, raising EnvironmentError with its output when it fails"""
+    process = Popen(args, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = process.communicate()
+    check_returncode(args, process.returncode, stdout, stderr)
+    return stdout, stderr
+
+
+def validate(nginx, nginx_conf, nginx_command=()):
+    """
+    Validate a config with `nginx -t`
+
+    :param nginx: Path to nginx binary
+    :type nginx: ```str```
+
+    :param nginx_conf: Config to validate
+    :type nginx_conf: ```str```
+
+    :param nginx_command: Further arguments to nginx, e.g., `["-g", "…"]`
+    :type nginx_command: ```List[str]```
+
+    :raises EnvironmentError: If the config is invalid
+    """
+    _run(validate_args(nginx, nginx_conf, nginx_command))
+
+
+def reload(nginx, nginx_conf, nginx_command=()):
+    """
+    Have the master whose pid file `nginx_conf` names reload its config (SIGHUP). Workers finish their requests on
+    the old config, so no connections are dropped.
+
+    :param nginx: Path to nginx binary
+    :type nginx: ```str```
+
+    :param nginx_conf: Config of the running master
+    :type nginx_conf: ```str```
+
+    :param nginx_command: Further arguments to nginx, e.g., `["-g", "…"]`
+    :type nginx_command: ```List[str]```
+
+    :raises EnvironmentError: If the signal couldn't be sent
+    """
+    _run(reload_args(nginx, nginx_conf, nginx_command))
+
+
+def start(nginx, nginx_conf, nginx_command=()):
+    """
+    Start a master in the background
+
+    :param nginx: Path to nginx binary
+    :type nginx: ```str```
+
+    :param nginx_conf: Config to run
+    :type nginx_conf: ```str```
+
+    :param nginx_command: Further arguments to nginx, e.g., `["-g", "…"]`
+    :type nginx_command: ```List[str]```
+
+    :return: The nginx process
+    :rtype: ```Popen```
+    """
+    return Popen([nginx, "-c", nginx_conf] + list(nginx_command))
+
+
+__all__ = [
+    "check_returncode",
+    "pid_filename",
+    "read_pid",
+    "reload",
+    "reload_args",
+    "start",
+    "validate",
+    "validate_args",
+]
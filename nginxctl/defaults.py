@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Discover the build defaults—paths and compiled-in modules—of an nginx binary from `nginx -V`
+"""
+
+import os
+import shlex
+import sys
+from hashlib import sha1
+from subprocess import PIPE, Popen
+
+if sys.version_info[0] == 2:
+    from whichcraft import which
+else:
+    from shutil import which
+
+from nginxctl import get_logger
+from nginxctl.cache import file_key, memoize
+from nginxctl.pkg_utils import PythonPackageInfo
+
+logger = get_logger(
+    ":".join((PythonPackageInfo().get_app_name(), sys.modules[__name__].__name__))
+)
+
+_path_arguments = {
+    "--prefix": "prefix",
+    "--sbin-path": "sbin_path",
+    "--conf-path": "conf_path",
+    "--modules-path": "modules_path",
+    "--error-log-path": "error_log_path",
+    "--http-log-path": "http_log_path",
+    "--pid-path": "pid_path",
+}
+
+
+def _module_name(argument):
+    """
+    :param argument: A `--with-…` configure argument, without its `=value`
+    :type argument: ```str```
+
+    :return: Module name, e.g., "http_v2" for "--with-http_v2_module" and "stream" for "--with-stream"
+    :rtype: ```str```
+    """
+    name = argument[len("--with-") :]
+    return name[: -len("_module")] if name.endswith("_module") else name
+
+
+def parse_nginx_v(output):
+    """
+    Parse the output of `nginx -V`
+
+    :param output: What `nginx -V` printed (it prints to stderr)
+    :type output: ```str```
+
+    :return: version, configure_arguments, the paths nginx was built with (absolute),
+      and the modules added with `--with-…`/`--add-module=…`/`--add-dynamic-module=…`
+    :rtype: ```dict```
+    """
+    defaults = {
+        "version": None,
+        "configure_arguments": [],
+        "modules": [],
+        "without_modules": [],
+    }
+    for line in output.splitlines():
+        if line.startswith("nginx version:"):
+            defaults["version"] = line.partition("/")[2].split()[0] or None
+        elif line.startswith("configure arguments:"):
+            defaults["configure_arguments"] = shlex.split(line.partition(":")[2])
+
+    paths = {}
+    for argument in defaults["configure_arguments"]:
+        key, _, value = argument.partition("=")
+        if key in _path_arguments:
+            paths[_path_arguments[key]] = value
+        elif key.startswith("--with-") and value in ("", "dynamic"):
+            defaults["modules"].append(_module_name(key))
+        elif key.startswith("--without-"):
+            defaults["without_modules"].append(
+                _module_name("--with-" + key[len("--without-") :])
+            )
+        elif key in ("--add-module", "--add-dynamic-module"):
+            defaults["modules"].append(os.path.basename(value.rstrip("/")))
+
+    prefix = paths.get("prefix", "/usr/local/nginx")
+    for name in _path_arguments.values():
+        defaults[name] = paths.get(name)
+    defaults.update(
+        prefix=prefix,
+        conf_path=os.path.join(prefix, paths.get("conf_path", "conf/nginx.conf")),
+        modules_path=os.path.join(prefix, paths.get("modules_path", "modules")),
+    )
+    return defaults
+
+
+def probe(nginx):
+    """
+    Run `nginx -V` and parse its output
+
+    :param nginx: Path to nginx binary
+    :type nginx: ```str```
+
+    :return: See `parse_nginx_v`
+    :rtype: ```dict```
+    """
+    process = Popen([nginx, "-V"], stdout=PIPE, stderr=PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise EnvironmentError(
+            "{!r} -V exited with {}: {}".format(
+                nginx, process.returncode, stderr.decode("utf8", "replace")
+            )
+        )
+    return parse_nginx_v(
+        "\n".join(out.decode("utf8", "replace") for out in (stderr, stdout))
+    )
+
+
+def get_nginx_defaults(nginx=None):
+    """
+    Build defaults of the nginx binary, probed once and then cached until the binary changes
+
+    :param nginx: Path to nginx binary, defaults to first in PATH
+    :type nginx: ```Optional[str]```
+
+    :return: See `parse_nginx_v`, plus "nginx": the binary's path. None if no working nginx was found.
+    :rtype: ```Optional[dict]```
+    """
+    nginx = nginx or which("nginx")
+    if nginx is None or not os.path.isfile(nginx):
+        return None
+    key = file_key(nginx)
+    try:
+        defaults = memoize(
+            # One entry per binary, so alternating between binaries doesn't thrash it
+            "nginx_defaults_{}".format(sha1(key[0].encode("utf8")).hexdigest()[:16]),
+            key,
+            lambda: probe(nginx),
+        )
+    except EnvironmentError as e:
+        logger.warning("could not probe nginx: {}".format(e))
+        return None
+    defaults["nginx"] = nginx
+    return defaults
+
+
+def has_module(defaults, module):
+    """
+    :param defaults: Output of `get_nginx_defaults`
+    :type defaults: ```Optional[dict]```
+
+    :param module: Module name, e.g., "stream" or "http_v2"
+    :type module: ```str```
+
+    :return: Whether the module was compiled into the binary
+    :rtype: ```bool```
+    """
+    return defaults is not None and module in defaults["modules"]
+
+
+__all__ = ["get_nginx_defaults", "has_module", "parse_nginx_v", "probe"]
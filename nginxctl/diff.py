@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Structural diff of crossplane-shaped directive trees: directives are matched among their siblings by
+`upsert.directive_key`, and subtrees compared by digest, so identical subtrees are skipped without being walked
+"""
+
+from collections import OrderedDict, namedtuple
+
+from nginxctl.merkle import Digests, _directives
+from nginxctl.upsert import directive_key
+
+
+class Change(namedtuple("Change", ("kind", "path", "old", "new"))):
+    """
+    One difference between two trees. `kind` is "added", "removed", "changed"—a directive's args, or a directive
+    replaced by a block or vice versa—or "reordered", for a block whose children are the same but in another order.
+    `path` is the context path of the directive (of the block, when reordered), as used by `ConfigIndex`; `old` and
+    `new` are the directives, None when absent.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return "{} {}".format(
+            {"added": "+", "removed": "-", "changed": "~", "reordered": "^"}[self.kind],
+            " > ".join(map(format_key, self.path)),
+        )
+
+
+def format_key(key):
+    """
+    :param key: From `directive_key`
+    :type key: ```tuple```
+
+    :return: The key as it'd read in the config, e.g., "location /"
+    :rtype: ```str```
+    """
+    return " ".join((key[0],) + tuple(arg for part in key[1:] for arg in part))
+
+
+def _by_key(block):
+    """
+    :return: `(directive_key, occurrence)` to directive, in order; occurrence tells apart siblings sharing a key
+    :rtype: ```OrderedDict[Tuple[tuple, int], Union[dict, Directive]]```
+    """
+    seen, keyed = {}, OrderedDict()
+    for stmt in _directives(block):
+        key = directive_key(stmt)
+        seen[key] = seen.get(key, -1) + 1
+        keyed[key, seen[key]] = stmt
+    return keyed
+
+
+def diff_blocks(old, new, path=(), digests=None):
+    """
+    :param old: Directives, e.g., a file's "parsed"
+    :type old: ```Iterable[Union[dict, Directive]]```
+
+    :param new: Directives to compare them with
+    :type new: ```Iterable[Union[dict, Directive]]```
+
+    :param path: Context path of the enclosing block, prefixed to each change's
+    :type path: ```tuple```
+
+    :param digests: Memo, to share between calls on the same trees
+    :type digests: ```Optional[Digests]```
+
+    :return: What changed from `old` to `new`, in the order of `old` then of `new`; empty when the same
+    :rtype: ```List[Change]```
+    """
+    digests = Digests() if digests is None else digests
+    old, new = _by_key(old), _by_key(new)
+    changes = []
+    for key, stmt in old.items():
+        other = new.get(key)
+        if other is None:
+            changes.append(Change("removed", path + (key[0],), stmt, None))
+        elif digests(stmt) == digests(other):
+            continue
+        elif stmt.get("block") is not None and other.get("block") is not None:
+            if list(stmt.get("args") or ()) != list(other.get("args") or ()):
+                changes.append(Change("changed", path + (key[0],), stmt, other))
+            changes += diff_blocks(
+                stmt["block"], other["block"], path + (key[0],), digests
+            )
+        else:
+            changes.append(Change("changed", path + (key[0],), stmt, other))
+    changes += [
+        Change("added", path + (key[0],), None, stmt)
+        for key, stmt in new.items()
+        if key not in old
+    ]
+    if [key for key in old if key in new] != [key for key in new if key in old]:
+        changes.append(Change("reordered", path, None, None))
+    return changes
+
+
+def diff_payloads(old, new):
+    """
+    Diff two crossplane payloads file by file. A file only one of them has is diffed against an empty one.
+
+    :param old: Output of `crossplane.parse`/`loader.parse`
+    :type old: ```dict```
+
+    :param new: Output of `crossplane.parse`/`loader.parse`
+    :type new: ```dict```
+
+    :return: Filename to its changes, for each file that changed, in the order of `old` then of `new`
+    :rtype: ```OrderedDict[str, List[Change]]```
+    """
+    digests = Digests()
+    old_files, new_files = (
+        OrderedDict((config["file"], config["parsed"]) for config in payload["config"])
+        for payload in (old, new)
+    )
+    diffs = OrderedDict()
+    for filename in list(old_files) + [
+        name for name in new_files if name not in old_files
+    ]:
+        changes = diff_blocks(
+            old_files.get(filename, ()), new_files.get(filename, ()), (), digests
+        )
+        if changes:
+            diffs[filename] = changes
+    return diffs
+
+
+__all__ = ["Change", "diff_blocks", "diff_payloads", "format_key"]
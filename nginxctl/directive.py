@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact node type for directive trees, convertible to and from crossplane's JSON payload
+"""
+
+
+class Directive(object):
+    """
+    One directive. `block` is None for simple directives, else the list of child `Directive`s.
+    Optional fields—`line`, `includes`, `comment`, `file`—are None when absent from the payload.
+
+    Also readable like the payload's dicts (`d["args"]`, `d.get("block")`, `"line" in d`),
+    so code written against crossplane's payload—including `crossplane.build`—accepts it as-is.
+    """
+
+    __slots__ = ("directive", "args", "block", "line", "includes", "comment", "file")
+
+    def __init__(
+        self,
+        directive,
+        args=(),
+        block=None,
+        line=None,
+        includes=None,
+        comment=None,
+        file=None,
+    ):
+        self.directive = directive
+        self.args = tuple(args)
+        self.block = block
+        self.line = line
+        self.includes = includes
+        self.comment = comment
+        self.file = file
+
+    @classmethod
+    def from_crossplane(cls, stmt):
+        """
+        :param stmt: A directive from crossplane's payload
+        :type stmt: ```dict```
+
+        :return: The same directive, with its block converted recursively
+        :rtype: ```Directive```
+        """
+        block = stmt.get("block")
+        includes = stmt.get("includes")
+        return cls(
+            stmt["directive"],
+            stmt.get("args", ()),
+            None if block is None else list(map(cls.from_crossplane, block)),
+            stmt.get("line"),
+            None if includes is None else tuple(includes),
+            stmt.get("comment"),
+            stmt.get("file"),
+        )
+
+    def to_crossplane(self):
+        """
+        :return: This directive in crossplane's payload format; `from_crossplane` round-trips losslessly
+        :rtype: ```dict```
+        """
+        stmt = {"directive": self.directive, "args": list(self.args)}
+        for key in "line", "comment", "file":
+            value = getattr(self, key)
+            if value is not None:
+                stmt[key] = value
+        if self.includes is not None:
+            stmt["includes"] = list(self.includes)
+        if self.block is not None:
+            stmt["block"] = [child.to_crossplane() for child in self.block]
+        return stmt
+
+    def walk(self):
+        """
+        :return: This directive and all its descendants, depth-first
+        :rtype: ```Iterator[Directive]```
+        """
+        stack = [self]
+        while stack:
+            directive = stack.pop()
+            yield directive
+            if directive.block:
+                stack.extend(reversed(directive.block))
+
+    # Read-only mapping interface, mirroring crossplane's payload dicts
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None and key not in ("directive", "args"):
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def keys(self):
+        return [key for key in self.__slots__ if getattr(self, key) is not None]
+
+    def __eq__(self, other):
+        return isinstance(other, Directive) and all(
+            getattr(self, key) == getattr(other, key) for key in self.__slots__
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join(
+                "{}={!r}".format(key, getattr(self, key))
+                for key in self.__slots__
+                if getattr(self, key) is not None
+            ),
+        )
+
+
+def from_crossplane(parsed):
+    """
+    :param parsed: The "parsed" list of a crossplane payload's config entry
+    :type parsed: ```List[dict]```
+
+    :return: The same directives as `Directive`s
+    :rtype: ```List[Directive]```
+    """
+    return list(map(Directive.from_crossplane, parsed))
+
+
+def to_crossplane(directives):
+    """
+    :param directives: `Directive`s
+    :type directives: ```Iterable[Directive]```
+
+    :return: The same directives in crossplane's payload format
+    :rtype: ```List[dict]```
+    """
+    return [directive.to_crossplane() for directive in directives]
+
+
+__all__ = ["Directive", "from_crossplane", "to_crossplane"]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Render generated config without touching disk: `emit` streams it out, `dry_run` checks it
+"""
+
+from __future__ import print_function
+
+import os
+
+from crossplane.analyzer import analyze, enter_block_ctx
+from crossplane.errors import NgxParserDirectiveError
+
+from nginxctl.builder import dump, iter_build
+from nginxctl.serve import build_nginx_conf, shard
+
+# Top-level blocks that go in the main context; all others go in http
+_main_blocks = frozenset(("events", "http", "mail", "stream"))
+
+_template = os.path.join(os.path.dirname(__file__), "_config", "nginx.conf")
+
+
+def emit(blocks, output, tuning=None):
+    """
+    Write the config of `blocks` to `output` as it's built, in buffered writes; blocks are consumed one at
+    a time too, so neither the tree nor the text of all of them need be in memory at once
+
+    :param blocks: Top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :param output: Text stream, e.g., `sys.stdout`
+    :type output: ```TextIO```
+
+    :param tuning: Directives of a performance profile, from `profiles.tune`: a whole config is written instead,
+      the nginx.conf `serve` would tune with them, with the blocks in place of its include of their files. It's
+      built in memory.
+    :type tuning: ```Optional[OrderedDict[str, List[dict]]]```
+
+    :return: Number of characters written
+    :rtype: ```int```
+    """
+    if tuning is not None:
+        nginx_conf = build_nginx_conf(
+            _template, "sites-available", tuning=tuning, blocks=blocks
+        )
+        output.write(nginx_conf)
+        output.flush()
+        return len(nginx_conf)
+    written = dump(blocks, output)
+    if written:
+        output.write(os.linesep)
+        written += len(os.linesep)
+    output.flush()
+    return written
+
+
+def check(block, filename="<cli>", strict=False):
+    """
+    Check each directive of a top-level block is known, allowed in its context, and given the right number of
+    args—as `crossplane.parse` and `nginx -t` would—in memory
+
+    :param block: A top-level block, e.g., from `iter_cli_blocks`
+    :type block: ```Union[Directive, dict]```
+
+    :param filename: Where `block` came from, for error messages
+    :type filename: ```str```
+
+    :param strict: Whether unknown directives are errors
+    :type strict: ```bool```
+
+    :return: Error messages
+    :rtype: ```List[str]```
+    """
+    errors = []
+    stack = [(block, () if block["directive"] in _main_blocks else ("http",))]
+    while stack:
+        stmt, ctx = stack.pop()
+        try:
+            analyze(
+                filename,
+                stmt,
+                ";" if stmt.get("block") is None else "{",
+                ctx,
+                strict=strict,
+            )
+        except NgxParserDirectiveError as e:
+            errors.append(str(e))
+            continue
+        if stmt.get("block") is not None:
+            child_ctx = enter_block_ctx(stmt, ctx)
+            stack.extend((child, child_ctx) for child in reversed(stmt["block"]))
+    return errors
+
+
+def dry_run(blocks, output, strict=False, tuning=None):
+    """
+    Compile and check `blocks` as `serve` would, without writing any file: print each file `serve` would write
+    to sites-available, with its size, then any errors
+
+    :param blocks: Top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :param output: Text stream the report is written to, e.g., `sys.stdout`
+    :type output: ```TextIO```
+
+    :param strict: Whether unknown directives are errors
+    :type strict: ```bool```
+
+    :param tuning: Directives of a performance profile, from `profiles.tune`: the nginx.conf `serve` would tune
+      with them is reported too
+    :type tuning: ```Optional[OrderedDict[str, List[dict]]]```
+
+    :return: Error messages
+    :rtype: ```List[str]```
+    """
+    errors, files, size = [], 0, 0
+    if tuning is not None:
+        files, size = 1, len(
+            build_nginx_conf(_template, "sites-available", tuning=tuning).encode("utf8")
+        )
+        print("nginx.conf\t{}".format(size), file=output)
+    for filename, shard_blocks in shard(blocks).items():
+        shard_size = sum(
+            len(piece.encode("utf8")) for piece in iter_build(shard_blocks)
+        ) + len(os.linesep)
+        print("{}\t{}".format(filename, shard_size), file=output)
+        files, size = files + 1, size + shard_size
+        for block in shard_blocks:
+            errors += check(block, strict=strict)
+    for error in errors:
+        print("error: {}".format(error), file=output)
+    print(
+        "{} files, {} bytes: {}".format(
+            files, size, "{} errors".format(len(errors)) if errors else "ok"
+        ),
+        file=output,
+    )
+    return errors
+
+
+__all__ = ["check", "dry_run", "emit"]
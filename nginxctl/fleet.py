@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Apply a config to many local nginx instances—one per temp_dir—concurrently: most of the time goes to waiting on
+nginx, so each instance is worked on in a thread of a pool
+"""
+
+import time
+from argparse import Namespace
+from multiprocessing.pool import ThreadPool
+
+from nginxctl import control, snapshot
+from nginxctl.serve import generate
+
+
+def apply_one(
+    nginx,
+    temp_dir,
+    blocks,
+    nginx_command=(),
+    reload=True,
+    keep=10,
+    profile=None,
+    share=1,
+):
+    """
+    Generate the config for `blocks` into `temp_dir` and, if its snapshot isn't current, validate it, make it
+    current, and reload the nginx running on it
+
+    :param nginx: Path to nginx binary
+    :type nginx: ```str```
+
+    :param temp_dir: The instance's directory, as used by `serve`
+    :type temp_dir: ```str```
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```List[Union[Directive, dict]]```
+
+    :param nginx_command: Further arguments to nginx
+    :type nginx_command: ```List[str]```
+
+    :param reload: Whether to reload a running instance, else only validate and publish its config
+    :type reload: ```bool```
+
+    :param keep: Snapshots to keep, see `snapshot.gc`
+    :type keep: ```int```
+
+    :param profile: Performance profile to tune nginx.conf for, see `profiles.names`
+    :type profile: ```Optional[str]```
+
+    :param share: Instances sharing the machine, each tuned for its share of it, see `profiles.tune`
+    :type share: ```int```
+
+    :return: "temp_dir"; "status", one of "reloaded", "validated", "unchanged", "invalid" or "failed";
+      "error", if any; "pid" of the instance's master, if running; and seconds taken by each step—"compile",
+      "test", "reload"—and "total"
+    :rtype: ```dict```
+    """
+    result = {"temp_dir": temp_dir, "status": "unchanged", "error": None}
+    start = time.time()
+    steps = [start]
+
+    def timed(name):
+        steps.append(time.time())
+        result[name] = steps[-1] - steps[-2]
+
+    try:
+        manifest = generate(
+            Namespace(nginx=nginx, temp_dir=temp_dir, profile=profile, share=share),
+            blocks,
+        )
+        timed("compile")
+        snapshot_id = snapshot.snapshot_id(manifest)
+        result["pid"] = control.read_pid(manifest.path(control.pid_filename))
+        if snapshot_id != snapshot.current(temp_dir):
+            try:
+                control.validate(
+                    nginx,
+                    snapshot.snapshot_path(temp_dir, snapshot_id, "nginx.conf"),
+                    nginx_command,
+                )
+            except EnvironmentError as e:
+                result["status"], result["error"] = "invalid", str(e)
+                return result
+            finally:
+                timed("test")
+            snapshot.publish(temp_dir, snapshot_id, keep)
+            result["status"] = "validated"
+            if reload and result["pid"] is not None:
+                control.reload(
+                    nginx, snapshot.current_path(temp_dir, "nginx.conf"), nginx_command
+                )
+                timed("reload")
+                result["status"] = "reloaded"
+    except Exception as e:
+        result["status"], result["error"] = "failed", str(e)
+    finally:
+        result["total"] = time.time() - start
+    return result
+
+
+def apply(
+    nginx,
+    temp_dirs,
+    blocks,
+    nginx_command=(),
+    concurrency=8,
+    reload=True,
+    keep=10,
+    profile=None,
+):
+    """
+    `apply_one` to every instance, at most `concurrency` at a time
+
+    :param nginx: Path to nginx binary
+    :type nginx: ```str```
+
+    :param temp_dirs: The instances' directories
+    :type temp_dirs: ```Iterable[str]```
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```List[Union[Directive, dict]]```
+
+    :param nginx_command: Further arguments to nginx
+    :type nginx_command: ```List[str]```
+
+    :param concurrency: Most instances to work on at once
+    :type concurrency: ```int```
+
+    :param reload: Whether to reload running instances, else only validate and publish their configs
+    :type reload: ```bool```
+
+    :param keep: Snapshots each instance keeps, see `snapshot.gc`
+    :type keep: ```int```
+
+    :param profile: Performance profile to tune nginx.conf for, see `profiles.names`; each instance is tuned for
+      its share of the machine
+    :type profile: ```Optional[str]```
+
+    :return: Result of `apply_one` for each instance, in the order of `temp_dirs`
+    :rtype: ```List[dict]```
+    """
+    temp_dirs = list(temp_dirs)
+    if not temp_dirs:
+        return []
+    pool = ThreadPool(concurrency)
+    try:
+        return pool.map(
+            lambda temp_dir: apply_one(
+                nginx,
+                temp_dir,
+                blocks,
+                nginx_command,
+                reload,
+                keep,
+                profile,
+                len(temp_dirs),
+            ),
+            temp_dirs,
+            chunksize=1,
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+
+def summarize(results, seconds):
+    """
+    :param results: From `apply`
+    :type results: ```List[dict]```
+
+    :param seconds: Wall time `apply` took
+    :type seconds: ```float```
+
+    :return: One line per instance, then the count of each status
+    :rtype: ```str```
+    """
+    counts = {}
+    lines = []
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        lines.append(
+            "{temp_dir}\t{status}\t{total:.3f}s{error}".format(
+                error="\t{}".format(result["error"]) if result["error"] else "",
+                **{key: result[key] for key in ("temp_dir", "status", "total")}
+            )
+        )
+    lines.append(
+        "{} instances in {:.3f}s: {}".format(
+            len(results),
+            seconds,
+            ", ".join(
+                "{} {}".format(count, status)
+                for status, count in sorted(counts.items())
+            ),
+        )
+    )
+    return "\n".join(lines)
+
+
+def fleet(known, nginx_command, blocks, temp_dirs):
+    """
+    Apply `blocks` to every instance and print the results
+
+    :param known: Parsed CLI arguments, using `nginx`, `concurrency`, `keep` and `profile`
+    :type known: ```Namespace```
+
+    :param nginx_command: Further arguments to nginx
+    :type nginx_command: ```List[str]```
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```List[Union[Directive, dict]]```
+
+    :param temp_dirs: The instances' directories
+    :type temp_dirs: ```List[str]```
+
+    :return: Results of `apply`
+    :rtype: ```List[dict]```
+    """
+    start = time.time()
+    results = apply(
+        known.nginx,
+        temp_dirs,
+        blocks,
+        nginx_command,
+        known.concurrency,
+        keep=snapshot.keep_of(known),
+        profile=getattr(known, "profile", None),
+    )
+    print(summarize(results, time.time() - start))
+    return results
+
+
+__all__ = ["apply", "apply_one", "fleet", "summarize"]
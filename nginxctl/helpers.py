@@ -1,22 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
 import sys
+from contextlib import contextmanager
+from functools import partial
 from pprint import PrettyPrinter
 from string import printable
 from sys import version_info
 
-if version_info[0] == 2:
-    from codecs import open
-    from string import maketrans  # noqa: F821
+from nginxctl.directive import Directive
 
+if version_info[0] == 2:
     string_types = basestring,  # noqa: F821
 else:
-    maketrans = str.maketrans
     string_types = str,
 
 pp = PrettyPrinter(indent=4).pprint
+replace = getattr(os, "replace", os.rename)
 
 
 def unquoted_str(arg):
-    return arg.translate(maketrans(dict.fromkeys("'\"", "")))
+    # Not `str.translate`, whose deletion table differs between Python 2's `str` and `unicode` and Python 3
+    return arg.replace("'", "").replace('"', "")
 
 
 def update_d(d, arg=None, **kwargs):
@@ -64,13 +70,21 @@ def get_keys(o):
 
 
 def is_directive(obj):
-    return isinstance(obj, dict) and get_keys(obj).isdisjoint(
-        frozenset(("args", "directive", "block", "line"))
+    return isinstance(obj, Directive) or (
+        isinstance(obj, dict)
+        and "directive" in obj
+        and frozenset(get_keys(obj)).issubset(
+            frozenset(
+                ("args", "directive", "block", "line", "includes", "comment", "file")
+            )
+        )
     )
 
 
-def upsert_block():
-    raise NotImplementedError()
+def upsert_block(index, parent_path, block):
+    """Insert `block` into the block at `parent_path` of a `nginxctl.upsert.ConfigIndex`, or merge it into the
+    existing block with the same key"""
+    return index.upsert(parent_path, block)
 
 
 def replace_attr(block, attr_name, new_attr):
@@ -95,7 +109,11 @@ def replace_elem_in_attr(block, attr_name, replace, new_attr):
 
 
 def get_dict_by_key_val(obj, key, value):
-    if isinstance(obj, dict):
+    if isinstance(obj, Directive):
+        if obj.get(key) == value:
+            return obj
+        return get_dict_by_key_val(obj.block or (), key, value)
+    elif isinstance(obj, dict):
         if obj.get(key) == value:
             return obj
         for k, v in obj.items():
@@ -119,18 +137,70 @@ def rpartial(func, *args):
     return lambda *a: func(*(a + args))
 
 
-def strings(filename, minimum=4):
-    with open(filename, errors="ignore") as f:
-        result = ""
-        for c in f.read():
-            if c in printable:
-                result += c
+@contextmanager
+def atomic_writer(filename, mode="wt"):
+    """
+    Open a sibling temporary file for writing, then—if the block completes—rename it over `filename`,
+    so readers see either the old or the new content—never a partial write.
+    """
+    from tempfile import mkstemp
+
+    fd, tmp = mkstemp(
+        dir=os.path.dirname(filename) or os.curdir,
+        prefix=".{}.".format(os.path.basename(filename)),
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(tmp, 0o644)
+        replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def atomic_write(filename, content, mode="wt"):
+    """
+    Write `content` to a sibling temporary file then rename it over `filename`,
+    so readers see either the old or the new content—never a partial write.
+    """
+    with atomic_writer(filename, mode) as f:
+        f.write(content)
+
+
+_printable_bytes = printable.encode("ascii")
+
+
+def strings(filename, minimum=4, needle=None, chunk_size=1 << 16):
+    """
+    Like strings(1): yield each run of at least `minimum` printable characters in the file.
+    The file is read in `chunk_size` binary chunks; runs that span chunks are stitched back together.
+
+    With `needle`, only runs containing it are yielded, so `next(strings(fname, needle=…))`
+    stops reading at the first match.
+
+    nginxctl itself reads its defaults from `nginx -V`; this stays for binaries that can't be run here, e.g., one
+    built for another architecture, whose usage text and paths can still be found in it.
+    """
+    runs = re.compile(
+        b"[" + re.escape(_printable_bytes) + b"]{%d,}" % max(minimum, 1)
+    ).finditer
+    needle_bytes = None if needle is None else needle.encode("ascii")
+    carry = b""
+    with open(filename, "rb") as f:
+        for chunk in iter(partial(f.read, chunk_size), b""):
+            chunk = carry + chunk if carry else chunk
+            # The trailing printable run may continue in the next chunk
+            head = chunk.rstrip(_printable_bytes)
+            carry = chunk[len(head) :]
+            if needle_bytes is not None and needle_bytes not in head:
                 continue
-            if len(result) >= minimum:
-                yield result
-            result = ""
-        if len(result) >= minimum:  # catch result at EOF
-            yield result
+            for match in runs(head):
+                result = match.group()
+                if needle_bytes is None or needle_bytes in result:
+                    yield result.decode("ascii")
+    if len(carry) >= minimum and (needle_bytes is None or needle_bytes in carry):
+        yield carry.decode("ascii")  # catch result at EOF
 
 
 # From stdlib
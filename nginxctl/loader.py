@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parse an nginx config and the files it includes, parsing independent files in a process pool
+"""
+
+import glob
+import json
+import os
+import pickle
+import stat
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import sha256
+from multiprocessing import cpu_count
+from time import time
+
+import crossplane
+from crossplane.analyzer import analyze, enter_block_ctx
+from crossplane.errors import NgxParserDirectiveError
+
+from nginxctl.cache import get_cache_dir
+from nginxctl.helpers import atomic_write
+
+
+def parse_file(filename, ignore=(), comments=False):
+    """
+    Parse one file on its own—without following includes or analysing directives
+
+    :param filename: nginx config file
+    :type filename: ```str```
+
+    :param ignore: Directives to exclude from the result
+    :type ignore: ```Iterable[str]```
+
+    :param comments: Whether to include comments
+    :type comments: ```bool```
+
+    :return: The file's entry of a crossplane payload's "config"
+    :rtype: ```dict```
+    """
+    return crossplane.parse(
+        filename,
+        ignore=ignore,
+        single=True,
+        comments=comments,
+        check_ctx=False,
+        check_args=False,
+    )["config"][0]
+
+
+def _file_digest(filename):
+    h = sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _parse_name(filename, digest, options):
+    """
+    :return: Filename of the cached parse, with `options`, of `filename` when its content hashes to `digest`; the
+      parse names the file, so it's part of the name
+    """
+    return "{}.pickle".format(
+        sha256(json.dumps([filename, digest, options]).encode("utf8")).hexdigest()
+    )
+
+
+def _tuples(value):
+    """`value`, read back from JSON, with its lists—as tuples were written—made tuples again"""
+    return tuple(map(_tuples, value)) if isinstance(value, list) else value
+
+
+def _trusted(st):
+    """
+    Whether what `st` describes can only have been written by this user—owned by them, writable by no one else—so
+    it's safe to unpickle from
+    """
+    geteuid = getattr(os, "geteuid", None)  # None on Windows
+    return geteuid is None or (
+        st.st_uid == geteuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+    )
+
+
+class ParseCache(object):
+    """
+    On-disk cache of `parse_file` results, keyed per file by path and parse options, and validated by size, mtime
+    and sha256 of the content. A file whose size and mtime are unchanged is a hit without being read—unless its
+    mtime was too close to when it was cached to tell a later edit apart—otherwise it's a hit if its content
+    hashes the same.
+
+    Each parse is pickled to a file of its own, named for the path, content hash and parse options, so a save only
+    writes what's new. The index of which one each path maps to is JSON. Parses are only unpickled from a directory
+    and files that no other user can write to.
+
+    Only per-file parses are cached: includes are resolved and directives analysed afresh on every `parse`, so
+    files added to or removed from an include glob are always picked up.
+
+    Least recently used entries are evicted on `save`, until the parses kept total at most `max_bytes`.
+    """
+
+    dirname = "parse_cache"
+    index = "index.json"
+
+    def __init__(self, directory, max_bytes=64 << 20):
+        """
+        :param directory: Where the cache is stored
+        :type directory: ```str```
+
+        :param max_bytes: Most bytes of pickled parses to keep
+        :type max_bytes: ```int```
+        """
+        from nginxctl import __version__
+
+        self.directory, self.max_bytes, self.version = (
+            directory,
+            max_bytes,
+            __version__,
+        )
+        self.hits = self.misses = self.evictions = 0
+        self.dirty, self._pending, self._new = False, {}, {}
+        self.entries = OrderedDict()
+        try:
+            self.trusted = _trusted(os.stat(directory))
+        except OSError:
+            self.trusted = (
+                True  # Nothing to trust yet: `save` creates it, for this user only
+            )
+        try:
+            with open(os.path.join(directory, self.index), "rt") as f:
+                index = json.load(f)
+            if index["version"] == self.version:
+                for filename, options, entry in index["entries"]:
+                    self.entries[filename, _tuples(options)] = entry
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.entries = OrderedDict()  # Missing, truncated, or from another version
+
+    @classmethod
+    def default(cls):
+        """
+        :return: The cache in `get_cache_dir()`, or None when caching is disabled
+        :rtype: ```Optional[ParseCache]```
+        """
+        cache_dir = get_cache_dir()
+        return None if cache_dir is None else cls(os.path.join(cache_dir, cls.dirname))
+
+    def _load(self, name):
+        """:return: The parse pickled as `name`, or None if it's missing, unreadable, or not trusted"""
+        if name in self._new:
+            return pickle.loads(self._new[name])
+        if not self.trusted:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                return pickle.load(f) if _trusted(os.fstat(f.fileno())) else None
+        except Exception:  # Missing, truncated, or from another Python
+            return None
+
+    def get(self, filename, options):
+        """
+        :param filename: nginx config file
+        :type filename: ```str```
+
+        :param options: Hashable parse options the result depends on
+        :type options: ```tuple```
+
+        :return: A fresh copy of the cached parse, or None on a miss
+        :rtype: ```Optional[dict]```
+        """
+        key = filename, options
+        try:
+            st = os.stat(filename)
+        except (IOError, OSError):
+            self.misses += 1
+            return None  # Let the parse report it
+
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            size, mtime, cached_at, name, _ = entry
+            parsing = None
+            if (size, mtime) == (st.st_size, st.st_mtime) and cached_at - mtime > 1:
+                parsing = self._load(name)
+            elif size == st.st_size:
+                current = _file_digest(filename)
+                if _parse_name(filename, current, options) == name:
+                    parsing = self._load(name)
+                    entry = [size, st.st_mtime, time(), name, entry[4]]
+                    self.dirty = True
+                self._pending[key] = st, current
+            self.entries[key] = entry
+            if parsing is not None:
+                self._pending.pop(key, None)
+                self.hits += 1
+                return parsing
+
+        self.misses += 1
+        self._pending.setdefault(key, (st, None))
+        return None
+
+    def put(self, filename, options, parsing):
+        """
+        Cache a parse of `filename`, after a `get` of it missed
+
+        :param filename: nginx config file
+        :type filename: ```str```
+
+        :param options: Hashable parse options the result depends on
+        :type options: ```tuple```
+
+        :param parsing: Result of `parse_file`, before it's modified
+        :type parsing: ```dict```
+        """
+        key = filename, options
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        st, digest = pending
+        # Hashed as of the `get`, so a file changed since will mismatch next time
+        name = _parse_name(filename, digest or _file_digest(filename), options)
+        self._new[name] = blob = pickle.dumps(parsing, pickle.HIGHEST_PROTOCOL)
+        self.entries.pop(key, None)
+        self.entries[key] = [st.st_size, st.st_mtime, time(), name, len(blob)]
+        self.dirty = True
+
+    def save(self):
+        """Evict beyond `max_bytes`, then write the new parses and the index, if it changed"""
+        total = sum(size for _, _, _, _, size in self.entries.values())
+        while total > self.max_bytes:
+            total -= self.entries.popitem(last=False)[1][4]
+            self.evictions += 1
+            self.dirty = True
+        if not self.dirty:
+            return
+        kept = frozenset(name for _, _, _, name, _ in self.entries.values())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            for name, blob in self._new.items():
+                if name in kept:
+                    atomic_write(os.path.join(self.directory, name), blob, mode="wb")
+            atomic_write(
+                os.path.join(self.directory, self.index),
+                json.dumps(
+                    {
+                        "version": self.version,
+                        "entries": [
+                            [filename, options, entry]
+                            for (filename, options), entry in self.entries.items()
+                        ],
+                    }
+                ),
+            )
+            for name in os.listdir(self.directory):
+                if name.endswith(".pickle") and name not in kept:
+                    os.remove(os.path.join(self.directory, name))
+        except (IOError, OSError):
+            pass  # An unwritable cache only costs speed
+        self.dirty, self._new = False, {}
+
+    def report(self):
+        """
+        :return: Summary of the cache's effectiveness
+        :rtype: ```str```
+        """
+        return "parse cache: {} hits, {} misses, {} evicted".format(
+            self.hits, self.misses, self.evictions
+        )
+
+
+def _handle_error(payload, parsing, e):
+    """Record an error like crossplane.parse does"""
+    error = {"error": str(e), "line": getattr(e, "lineno", None)}
+    parsing["status"] = payload["status"] = "failed"
+    parsing["errors"].append(error)
+    payload["errors"].append(dict(file=parsing["file"], **error))
+
+
+class _Analysis(object):
+    """
+    Second pass over a file parsed by `parse_file`: analyse each directive in its context—as crossplane.parse
+    does in its single pass—and resolve includes, queueing newly included files
+    """
+
+    def __init__(self, payload, config_dir, includes, options):
+        self.payload, self.config_dir, self.includes = payload, config_dir, includes
+        self.included = {
+            filename: index for index, (filename, _) in enumerate(includes)
+        }
+        self.catch_errors, self.strict, self.check_ctx, self.check_args = options
+
+    def file(self, parsing, ctx):
+        try:
+            parsing["parsed"] = self.block(parsing, parsing["parsed"], ctx)
+        except Exception as e:
+            parsing["parsed"] = []
+            _handle_error(self.payload, parsing, e)
+
+    def block(self, parsing, block, ctx):
+        kept = []
+        for stmt in block:
+            if stmt["directive"] == "#":
+                kept.append(stmt)
+                continue
+            try:
+                analyze(
+                    fname=parsing["file"],
+                    stmt=stmt,
+                    term=";" if stmt.get("block") is None else "{",
+                    ctx=ctx,
+                    strict=self.strict,
+                    check_ctx=self.check_ctx,
+                    check_args=self.check_args,
+                )
+            except NgxParserDirectiveError as e:
+                if not self.catch_errors:
+                    raise
+                _handle_error(self.payload, parsing, e)
+                continue
+
+            if stmt["directive"] == "include":
+                self.include(parsing, stmt, ctx)
+            if stmt.get("block") is not None:
+                stmt["block"] = self.block(
+                    parsing, stmt["block"], enter_block_ctx(stmt, ctx)
+                )
+            kept.append(stmt)
+        return kept
+
+    def include(self, parsing, stmt, ctx):
+        pattern = stmt["args"][0]
+        if not os.path.isabs(pattern):
+            pattern = os.path.join(self.config_dir, pattern)
+
+        stmt["includes"] = []
+        if glob.has_magic(pattern):
+            filenames = sorted(glob.glob(pattern))
+        else:
+            try:
+                # nginx checks an explicitly included file can be opened
+                open(str(pattern)).close()
+                filenames = [pattern]
+            except Exception as e:
+                filenames = []
+                e.lineno = stmt["line"]
+                if not self.catch_errors:
+                    raise
+                _handle_error(self.payload, parsing, e)
+
+        for filename in filenames:
+            if filename not in self.included:
+                self.included[filename] = len(self.includes)
+                self.includes.append((filename, ctx))
+            stmt["includes"].append(self.included[filename])
+
+
+class _Pool(object):
+    """A pool of `processes` worker processes, started only once a wave has more than one file to parse"""
+
+    def __init__(self, processes=None):
+        """
+        :param processes: Size of the pool; defaults to the CPU count. With 1, no pool is used.
+        :type processes: ```Optional[int]```
+        """
+        self.processes, self.executor = processes or cpu_count(), None
+
+    def map(self, parse_one, filenames):
+        """
+        :return: `parse_one` of each of `filenames`, in order
+        :rtype: ```Iterator[dict]```
+        """
+        if self.processes == 1 or len(filenames) < 2:
+            return map(parse_one, filenames)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.processes)
+        return self.executor.map(
+            parse_one,
+            filenames,
+            chunksize=max(1, len(filenames) // (4 * self.processes)),
+        )
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def _parse_wave(filenames, parse_one, pool, cache, options):
+    """Parse `filenames`, in order, taking what it can from `cache` and the rest from `pool`"""
+    parsed = [None] * len(filenames)
+    if cache is not None:
+        parsed = [cache.get(filename, options) for filename in filenames]
+    fresh = iter(
+        pool.map(
+            parse_one,
+            [
+                filename
+                for filename, parsing in zip(filenames, parsed)
+                if parsing is None
+            ],
+        )
+    )
+    for i, parsing in enumerate(parsed):
+        if parsing is None:
+            parsed[i] = parsing = next(fresh)
+            if cache is not None:
+                cache.put(filenames[i], options, parsing)
+    return parsed
+
+
+def parse(
+    filename,
+    processes=None,
+    catch_errors=True,
+    ignore=(),
+    comments=False,
+    strict=False,
+    check_ctx=True,
+    check_args=True,
+    cache=None,
+):
+    """
+    Like `crossplane.parse(filename, …)`, with the same payload—`config[]` ordered the same way,
+    with each entry's `file`, `status`, `errors` and `parsed`—but with files parsed in a process pool.
+
+    Files are parsed in waves: the entry file, then all the files it includes, then all the files those include,
+    &etc. Within a wave files are independent, so they're parsed in parallel. After each file is parsed, its
+    directives are analysed in the context they were included from, and its includes resolved.
+
+    :param filename: nginx.conf
+    :type filename: ```str```
+
+    :param processes: Size of the process pool; defaults to the CPU count. With 1, no pool is used, nor is one
+      started unless some wave has more than one file to parse.
+    :type processes: ```Optional[int]```
+
+    :param catch_errors: If False, stop analysing a file at its first error
+    :type catch_errors: ```bool```
+
+    :param ignore: Directives to exclude from the payload
+    :type ignore: ```Iterable[str]```
+
+    :param comments: Whether to include comments in the payload
+    :type comments: ```bool```
+
+    :param strict: Whether unrecognised directives are errors
+    :type strict: ```bool```
+
+    :param check_ctx: Whether to check each directive is allowed in its context
+    :type check_ctx: ```bool```
+
+    :param check_args: Whether to check the number of args of each directive
+    :type check_args: ```bool```
+
+    :param cache: Cache of per-file parses, so only files changed since they were cached are parsed.
+      Call its `save` afterwards to persist it.
+    :type cache: ```Optional[ParseCache]```
+
+    :return: A payload that describes the parsed nginx config, as from `crossplane.parse`
+    :rtype: ```dict```
+    """
+    payload = {"status": "ok", "errors": [], "config": []}
+    includes = [(filename, ())]
+    analysis = _Analysis(
+        payload,
+        os.path.dirname(filename),
+        includes,
+        (catch_errors, strict, check_ctx, check_args),
+    )
+    options = tuple(ignore), comments
+    parse_one = partial(parse_file, ignore=options[0], comments=comments)
+
+    pool = _Pool(processes)
+    try:
+        done = 0
+        while done < len(includes):
+            wave = includes[done:]
+            parsed = _parse_wave(
+                [fname for fname, _ in wave], parse_one, pool, cache, options
+            )
+            for (_, ctx), parsing in zip(wave, parsed):
+                for error in parsing["errors"]:
+                    payload["status"] = "failed"
+                    payload["errors"].append(dict(file=parsing["file"], **error))
+                analysis.file(parsing, ctx)
+                payload["config"].append(parsing)
+            done += len(wave)
+    finally:
+        pool.shutdown()
+
+    return payload
+
+
+__all__ = ["ParseCache", "parse", "parse_file"]
@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+
+"""
+CLI macros: shorthand directives—`--proxy`, `--upstream`, and those defined in `.macro` files—that expand into the
+directives they stand for, e.g., a proxied location along with the keepalive upstream block it passes to
+"""
+
+import argparse
+import os
+import re
+from functools import partial
+
+from nginxctl.cache import file_key, memoize
+from nginxctl.directive import Directive
+from nginxctl.helpers import string_types
+from nginxctl.manifest import digest
+from nginxctl.merkle import Digests
+
+# Upstream load-balancing methods; round_robin is nginx's default, so it's left out
+methods = "round_robin", "least_conn", "ip_hash", "random"
+
+_upstream_defaults = (
+    ("method", "round_robin"),
+    ("keepalive", "32"),
+    ("keepalive_requests", "1000"),
+    ("keepalive_timeout", "60s"),
+    ("max_fails", "3"),
+    ("fail_timeout", "10s"),
+)
+
+_proxy_defaults = (
+    ("scheme", "http"),
+    ("buffering", "on"),
+    ("buffer_size", "16k"),
+    ("buffers", "8 16k"),
+    ("connect_timeout", "5s"),
+    ("send_timeout", "60s"),
+    ("read_timeout", "60s"),
+)
+
+# A backend address rather than the name of an upstream: host:port, a unix socket, an IPv6 address, or a host
+# alone—localhost, an IPv4 address or a dotted name—which nginx connects to on port 80
+_address = re.compile(r"^(unix:|\[|[^:]+:\d+$|localhost$|[^:]*\.[^:]*$)").search
+
+# Schemes of `proxy_pass` that a TARGET may be prefixed with
+_schemes = "http", "https"
+
+
+def _options(directive, defaults, positional):
+    """
+    Split a macro's args into its positional args and its `key=value` options
+
+    :param directive: The macro, e.g., `--proxy /api 127.0.0.1:9000 keepalive=64`
+    :type directive: ```Directive```
+
+    :param defaults: Option names and their default values
+    :type defaults: ```Tuple[Tuple[str, str], ...]```
+
+    :param positional: Least number of positional args
+    :type positional: ```int```
+
+    :return: Positional args, and every option's value
+    :rtype: ```Tuple[List[str], dict]```
+    """
+    args, options = [], dict(defaults)
+    for arg in directive.args:
+        key, eq, value = arg.partition("=")
+        if eq and key in options:
+            options[key] = value
+        elif eq and re.match(r"^[a-z_]+$", key):
+            raise argparse.ArgumentTypeError(
+                "--{}: unknown option {!r}, expected one of: {}".format(
+                    directive.directive, key, ", ".join(sorted(options))
+                )
+            )
+        else:
+            args.append(arg)
+    if len(args) < positional:
+        raise argparse.ArgumentTypeError(
+            "--{} expects at least {} args, got {!r}".format(
+                directive.directive, positional, list(directive.args)
+            )
+        )
+    if options.get("method", methods[0]) not in methods:
+        raise argparse.ArgumentTypeError(
+            "--{}: unknown method {!r}, expected one of: {}".format(
+                directive.directive, options["method"], ", ".join(methods)
+            )
+        )
+    return args, options
+
+
+def _targets(directive, targets, options):
+    """
+    Strip the scheme off each `--proxy` TARGET that has one
+
+    :param directive: The macro
+    :type directive: ```Directive```
+
+    :param targets: Upstream names or backend addresses, each optionally prefixed with `http://` or `https://`
+    :type targets: ```List[str]```
+
+    :param options: Every option of `--proxy`
+    :type options: ```dict```
+
+    :return: The scheme—that of the targets, else of the `scheme` option—and the targets without it
+    :rtype: ```Tuple[str, List[str]]```
+    """
+    schemes, stripped = set(), []
+    for target in targets:
+        scheme, sep, rest = target.partition("://")
+        if not sep:
+            stripped.append(target)
+            continue
+        elif scheme not in _schemes or not rest or "/" in rest:
+            raise argparse.ArgumentTypeError(
+                "--{}: expected TARGET to be an upstream name or backend address, optionally prefixed with {},"
+                " got {!r}".format(
+                    directive.directive,
+                    " or ".join("{}://".format(scheme) for scheme in _schemes),
+                    target,
+                )
+            )
+        schemes.add(scheme)
+        stripped.append(rest)
+    if any(arg.startswith("scheme=") for arg in directive.args):
+        schemes.add(options["scheme"])
+    if len(schemes) > 1:
+        raise argparse.ArgumentTypeError(
+            "--{}: conflicting schemes {}".format(
+                directive.directive, ", ".join(sorted(schemes))
+            )
+        )
+    return (schemes.pop() if schemes else options["scheme"]), stripped
+
+
+def upstream_block(name, servers, options, line=None):
+    """
+    :param name: Name of the upstream
+    :type name: ```str```
+
+    :param servers: Backend addresses, e.g., `["127.0.0.1:9000"]`
+    :type servers: ```List[str]```
+
+    :param options: Every option of `--upstream`, see `_upstream_defaults`
+    :type options: ```dict```
+
+    :param line: Line of the macro, given to each directive
+    :type line: ```Optional[int]```
+
+    :return: The upstream, pooling up to `keepalive` idle connections to its servers per worker
+    :rtype: ```Directive```
+    """
+    return Directive(
+        "upstream",
+        (name,),
+        (
+            [Directive(options["method"], (), None, line)]
+            if options["method"] != "round_robin"
+            else []
+        )
+        + [
+            Directive(
+                "server",
+                (
+                    server,
+                    "max_fails={}".format(options["max_fails"]),
+                    "fail_timeout={}".format(options["fail_timeout"]),
+                ),
+                None,
+                line,
+            )
+            for server in servers
+        ]
+        + [
+            Directive(directive, (options[directive],), None, line)
+            for directive in ("keepalive", "keepalive_requests", "keepalive_timeout")
+        ],
+        line,
+    )
+
+
+def upstream(directive):
+    """
+    `--upstream NAME SERVER… [method=…] [keepalive=…] [keepalive_requests=…] [keepalive_timeout=…] [max_fails=…]
+    [fail_timeout=…]`: an upstream block in the http context
+
+    :param directive: The macro
+    :type directive: ```Directive```
+
+    :return: Directives to put in its place—none—and the upstream
+    :rtype: ```Tuple[List[Directive], List[Directive]]```
+    """
+    args, options = _options(directive, _upstream_defaults, 2)
+    return [], [upstream_block(args[0], args[1:], options, directive.line)]
+
+
+def proxy(directive):
+    """
+    `--proxy LOCATION TARGET… [options]`: a location proxying to TARGET—the name of an upstream, or backend
+    addresses, which get an upstream of their own, either prefixed with `http://` or `https://` if wanted—over
+    HTTP/1.1 with an empty Connection header, so connections to the backend are kept alive and reused rather than
+    opened per request. Options are those of `--upstream`, for the upstream of addresses, and `scheme`,
+    `buffering`, `buffer_size`, `buffers`, `connect_timeout`, `send_timeout` and `read_timeout` (of `proxy_…`).
+
+    :param directive: The macro
+    :type directive: ```Directive```
+
+    :return: The location, and the upstream if one was made
+    :rtype: ```Tuple[List[Directive], List[Directive]]```
+    """
+    args, options = _options(directive, _upstream_defaults + _proxy_defaults, 2)
+    location = args[0]
+    scheme, targets = _targets(directive, args[1:], options)
+    upstreams = []
+    if len(targets) == 1 and not _address(targets[0]):
+        name = targets[0]
+    else:
+        # Named for what it is, so the same backends share an upstream
+        name = "backend_{}".format(
+            digest(
+                *(
+                    tuple(targets)
+                    + tuple(
+                        "{}={}".format(key, options[key])
+                        for key, _ in _upstream_defaults
+                    )
+                )
+            )[:8]
+        )
+        upstreams.append(upstream_block(name, targets, options, directive.line))
+
+    def proxy_directive(name, *args):
+        return Directive("proxy_{}".format(name), args, None, directive.line)
+
+    return [
+        Directive(
+            "location",
+            (location,),
+            [
+                proxy_directive("pass", "{}://{}".format(scheme, name)),
+                proxy_directive("http_version", "1.1"),
+                proxy_directive("set_header", "Connection", ""),
+                proxy_directive("set_header", "Host", "$host"),
+                proxy_directive("set_header", "X-Real-IP", "$remote_addr"),
+                proxy_directive(
+                    "set_header", "X-Forwarded-For", "$proxy_add_x_forwarded_for"
+                ),
+                proxy_directive("set_header", "X-Forwarded-Proto", "$scheme"),
+                proxy_directive("buffering", options["buffering"]),
+                proxy_directive("buffer_size", options["buffer_size"]),
+                proxy_directive("buffers", *options["buffers"].split()),
+                proxy_directive("connect_timeout", options["connect_timeout"]),
+                proxy_directive("send_timeout", options["send_timeout"]),
+                proxy_directive("read_timeout", options["read_timeout"]),
+            ],
+            directive.line,
+        )
+    ], upstreams
+
+
+# Macro name to its expansion: a function of the macro's `Directive` returning the directives to put in its place,
+# and top-level blocks to add to the http context
+builtin = {"proxy": proxy, "upstream": upstream}
+
+
+# A parameter in a `.macro` file, e.g., `{{location}}`
+_placeholder = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+# Macros expanding to macros: how deep before giving up, e.g., on one that expands to itself
+_max_depth = 16
+
+# file_key of each `.macro` file loaded by this process to its template
+_templates = {}
+
+
+def macro_path():
+    """
+    :return: Directories searched for `.macro` files—those of `NGINXCTL_MACRO_PATH` (separated as `PATH` is), then
+      the bundled ones; a macro in an earlier directory hides those of the same name in later ones
+    :rtype: ```List[str]```
+    """
+    return [
+        directory
+        for directory in os.environ.get("NGINXCTL_MACRO_PATH", "").split(os.pathsep)
+        if directory
+    ] + [os.path.join(os.path.dirname(__file__), "_config")]
+
+
+def compile_macro(tokens):
+    """
+    Compile a macro definition to a template: the directive tree its expansion is a copy of, with the args that
+    use parameters split into literal text and parameter positions, so expanding it is substitution into the tree
+    rather than reparsing. It's JSON serialisable, to be cached.
+
+    The definition is CLI tokens, as read by `iter_cli_tokens`. `--params NAME… [NAME=DEFAULT…]` first declares the
+    parameters, which args use as `{{NAME}}`; then come the directives put in place of the macro, and
+    `-b http … -}` for those to add to the http context, e.g., a `map`.
+
+    :param tokens: CLI tokens of the definition
+    :type tokens: ```Iterable[str]```
+
+    :return: "params": [name, default or None] of each parameter, "body" and "http": the directives, each
+      [directive, args, block or None], where an arg is a str or a list alternating literal text and parameter
+      positions
+    :rtype: ```dict```
+    """
+    from nginxctl.parser import iter_cli_blocks
+
+    ((_, macro),) = iter_cli_blocks(
+        ["-b", "macro"] + list(tokens) + ["-}"], Macros({}, ())
+    )
+    params, body, http = [], [], []
+    stmts = macro.block
+    if stmts and stmts[0].directive == "params":
+        params = [
+            [name, default if eq else None]
+            for name, eq, default in (arg.partition("=") for arg in stmts[0].args)
+        ]
+        stmts = stmts[1:]
+    positions = {name: position for position, (name, _) in enumerate(params)}
+
+    def compile_arg(arg):
+        pieces = _placeholder.split(arg)
+        if len(pieces) == 1:
+            return arg
+        for name in pieces[1::2]:
+            if name not in positions:
+                raise argparse.ArgumentTypeError(
+                    "{{{{{}}}}} isn't one of the macro's params: {}".format(
+                        name, ", ".join(positions)
+                    )
+                )
+        return [positions[piece] if i % 2 else piece for i, piece in enumerate(pieces)]
+
+    def compile_stmt(stmt):
+        return [
+            stmt.directive,
+            list(map(compile_arg, stmt.args)),
+            None if stmt.block is None else list(map(compile_stmt, stmt.block)),
+        ]
+
+    for stmt in stmts:
+        if stmt.directive == "http" and stmt.block is not None:
+            http += map(compile_stmt, stmt.block)
+        else:
+            body.append(compile_stmt(stmt))
+    return {"params": params, "body": body, "http": http}
+
+
+def load_macro(filename):
+    """
+    :param filename: A `.macro` file, see `compile_macro`
+    :type filename: ```str```
+
+    :return: Its template: compiled once per process, and cached on disk—keyed by a hash of the file—between them
+    :rtype: ```dict```
+    """
+    key = tuple(file_key(filename))
+    template = _templates.get(key)
+    if template is None:
+        with open(filename, "rt") as f:
+            definition = f.read()
+
+        def compile_file():
+            from nginxctl.parser import iter_cli_tokens
+
+            try:
+                return compile_macro(iter_cli_tokens(definition.splitlines()))
+            except argparse.ArgumentTypeError as e:
+                raise argparse.ArgumentTypeError("{}: {}".format(filename, e))
+
+        file_digest = digest(definition)
+        template = _templates[key] = memoize(
+            "macro_{}".format(file_digest[:16]), [file_digest], compile_file
+        )
+    return template
+
+
+def expand_template(template, directive):
+    """
+    Expand a macro defined by a template
+
+    :param template: From `compile_macro`
+    :type template: ```dict```
+
+    :param directive: The macro: its args are the params, in order, or as `NAME=VALUE`
+    :type directive: ```Directive```
+
+    :return: Directives to put in its place, and to add to the http context
+    :rtype: ```Tuple[List[Directive], List[Directive]]```
+    """
+    names = frozenset(name for name, _ in template["params"])
+    given, positional = {}, []
+    for arg in directive.args:
+        key, eq, value = arg.partition("=")
+        if eq and key in names:
+            given[key] = value
+        else:
+            positional.append(arg)
+    positional.reverse()
+    values = []
+    for name, default in template["params"]:
+        if name in given:
+            values.append(given[name])
+        elif positional:
+            values.append(positional.pop())
+        elif default is not None:
+            values.append(default)
+        else:
+            raise argparse.ArgumentTypeError(
+                "--{}: missing {}".format(directive.directive, name)
+            )
+    if positional:
+        raise argparse.ArgumentTypeError(
+            "--{}: unexpected args {!r}".format(directive.directive, positional[::-1])
+        )
+
+    def substitute(arg):
+        if isinstance(arg, string_types):
+            return arg
+        return "".join(values[piece] if i % 2 else piece for i, piece in enumerate(arg))
+
+    def instantiate(stmt):
+        name, args, block = stmt
+        return Directive(
+            name,
+            map(substitute, args),
+            None if block is None else list(map(instantiate, block)),
+            directive.line,
+        )
+
+    return list(map(instantiate, template["body"])), list(
+        map(instantiate, template["http"])
+    )
+
+
+class Macros(object):
+    """
+    Expands the macros in top-level blocks, remembering the blocks—e.g., upstreams—it added to the http context, so
+    blocks expanded by the same `Macros`—e.g., all those of a `batch`—share rather than redefine them
+    """
+
+    def __init__(self, macros=None, path=None):
+        """
+        :param macros: Macro name to its expansion, defaults to `builtin`
+        :type macros: ```Optional[dict]```
+
+        :param path: Directories of `.macro` files, whose macros are named for the file, e.g., `--websockets` for
+          `websockets.macro`, and loaded on first use; defaults to `macro_path()`. They don't hide `macros`.
+        :type path: ```Optional[Iterable[str]]```
+        """
+        self.macros = dict(builtin if macros is None else macros)
+        self._files = {}
+        for directory in reversed(macro_path() if path is None else list(path)):
+            if os.path.isdir(directory):
+                self._files.update(
+                    (filename[: -len(".macro")], os.path.join(directory, filename))
+                    for filename in os.listdir(directory)
+                    if filename.endswith(".macro")
+                )
+        self.added, self._digests = {}, Digests()
+
+    def _macro(self, name):
+        """
+        :return: Expansion of the macro called `name`, None if there's none
+        :rtype: ```Optional[Callable[[Directive], Tuple[List[Directive], List[Directive]]]]```
+        """
+        macro = self.macros.get(name)
+        if macro is None and name in self._files:
+            macro = self.macros[name] = partial(
+                expand_template, load_macro(self._files[name])
+            )
+        return macro
+
+    def expand(self, block):
+        """
+        :param block: A top-level block, e.g., a server; its macros—and those they expand to—are replaced in place
+        :type block: ```Directive```
+
+        :return: (context, block): "http" and each new block the macros add to the http context, then "server" (or
+          "http") and `block`
+        :rtype: ```Iterator[Tuple[str, Directive]]```
+        """
+        added = []
+        stack = [(block, 0)]  # (directive, how many macros deep it came from)
+        while stack:
+            parent, parent_depth = stack.pop()
+            if parent.block is None:
+                continue
+            expanded = []
+            pending = [(child, parent_depth) for child in reversed(parent.block)]
+            while pending:
+                child, depth = pending.pop()
+                # Macros are simple directives; a block of the same name, e.g., `upstream`, is nginx's own
+                macro = None if child.block is not None else self._macro(child.directive)
+                if macro is None:
+                    expanded.append((child, depth))
+                    continue
+                elif depth == _max_depth:
+                    raise argparse.ArgumentTypeError(
+                        "--{} expands to macros more than {} deep".format(
+                            child.directive, _max_depth
+                        )
+                    )
+                replacement, top_level = macro(child)
+                pending += ((stmt, depth + 1) for stmt in reversed(replacement))
+                added += top_level
+            parent.block = [directive for directive, _ in expanded]
+            stack += expanded
+        for top_level in added:
+            name = tuple(top_level.args)
+            key = top_level.directive, name
+            known = self.added.get(key)
+            if known is None:
+                self.added[key] = self._digests(top_level)
+                yield "http", top_level
+            elif known != self._digests(top_level):
+                raise argparse.ArgumentTypeError(
+                    "Conflicting definitions of {} {}".format(
+                        top_level.directive, " ".join(name)
+                    )
+                )
+        yield "server" if block.directive == "server" else "http", block
+
+
+__all__ = [
+    "Macros",
+    "builtin",
+    "compile_macro",
+    "expand_template",
+    "load_macro",
+    "macro_path",
+    "methods",
+    "proxy",
+    "upstream",
+    "upstream_block",
+]
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content-hash manifest of the files nginxctl generates into a directory, so unchanged outputs are neither rebuilt nor
+rewritten
+"""
+
+import json
+import os
+from hashlib import sha256
+
+from nginxctl.helpers import atomic_write, atomic_writer
+
+
+def digest(*contents):
+    """
+    :param contents: str and/or bytes to hash together
+    :type contents: ```Union[str, bytes]```
+
+    :return: Hex sha256 of the contents
+    :rtype: ```str```
+    """
+    h = sha256()
+    for content in contents:
+        h.update(content if isinstance(content, bytes) else content.encode("utf8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _file_digest(filename, chunk_size=1 << 16):
+    """:return: `digest` of the file's content, read in `chunk_size` chunks"""
+    h = sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    h.update(b"\0")
+    return h.hexdigest()
+
+
+def _mtime(st):
+    """:return: The mtime of `st`, in ns where there is one (Python 3), else in s"""
+    return getattr(st, "st_mtime_ns", st.st_mtime)
+
+
+class _HashingWriter(object):
+    """Text stream that hashes what's written to it as UTF-8—like `digest`—and passes it on to `f`, if given"""
+
+    def __init__(self, f=None):
+        self.f, self.sha256, self.size = f, sha256(), 0
+
+    def write(self, s):
+        b = s.encode("utf8")
+        self.sha256.update(b)
+        self.size += len(b)
+        if self.f is not None:
+            self.f.write(b)
+
+    def hexdigest(self):
+        h = self.sha256.copy()
+        h.update(b"\0")
+        return h.hexdigest()
+
+
+class Manifest(object):
+    """
+    Records, for each generated file, the sha256, size and mtime of what was written and a digest of the inputs it
+    was built from. Persisted to `Manifest.filename` in the directory.
+    """
+
+    filename = ".nginxctl-manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, self.filename)
+        self.reused, self.rebuilt, self.removed = [], [], []
+        try:
+            with open(self.manifest_file, "rt") as f:
+                self.files = json.load(f)["files"]
+        except (IOError, OSError, ValueError, KeyError):
+            self.files = {}
+        self._dirty = False
+
+    def path(self, relpath):
+        return os.path.join(self.directory, relpath)
+
+    def _on_disk(self, relpath):
+        """
+        Whether the file recorded for `relpath` is still there as written: of the same size and—unless it's of the
+        same mtime—content
+        """
+        entry = self.files.get(relpath)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(self.path(relpath))
+            if st.st_size != entry["size"]:
+                return False
+            elif _mtime(st) == entry.get("mtime"):
+                return True
+            elif _file_digest(self.path(relpath)) != entry["sha256"]:
+                return False
+        except (IOError, OSError):
+            return False
+        # Touched, but not changed: only hashed again once it's touched again
+        entry["mtime"] = _mtime(st)
+        self._dirty = True
+        return True
+
+    def _record(self, relpath, entry):
+        """Record `entry`—with the mtime of the file at `relpath`, as written—for `relpath`"""
+        entry["mtime"] = _mtime(os.stat(self.path(relpath)))
+        if self.files.get(relpath) != entry:
+            self.files[relpath] = entry
+            self._dirty = True
+
+    def fresh(self, relpath, inputs):
+        """
+        :param relpath: Output file, relative to the directory
+        :type relpath: ```str```
+
+        :param inputs: Digest of everything the output is built from
+        :type inputs: ```str```
+
+        :return: Whether `relpath` was last built from the same inputs and is still on disk
+        :rtype: ```bool```
+        """
+        return self._on_disk(relpath) and self.files[relpath].get("inputs") == inputs
+
+    def write(self, relpath, content, inputs=None):
+        """
+        Atomically write `content` to `relpath`, unless the file already holds exactly those bytes
+
+        :param relpath: Output file, relative to the directory
+        :type relpath: ```str```
+
+        :param content: New content of the file
+        :type content: ```Union[str, bytes]```
+
+        :param inputs: Digest of everything the output is built from, checked by `fresh` on later runs
+        :type inputs: ```Optional[str]```
+
+        :return: Whether the file was (re)written
+        :rtype: ```bool```
+        """
+        if not isinstance(content, bytes):
+            content = content.encode("utf8")
+        content_digest = digest(content)
+        entry = {"sha256": content_digest, "size": len(content), "inputs": inputs}
+        if self._on_disk(relpath) and self.files[relpath]["sha256"] == content_digest:
+            self.reused.append(relpath)
+            written = False
+        else:
+            parent = os.path.dirname(self.path(relpath))
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            atomic_write(self.path(relpath), content, "wb")
+            self.rebuilt.append(relpath)
+            written = True
+        self._record(relpath, entry)
+        return written
+
+    def dump(self, relpath, payload, inputs=None):
+        """
+        Write the config `payload` builds to—followed by a newline—to `relpath`, unless the file already holds
+        exactly that. The config is streamed, see `builder.dump`: first only to hash it, and only if it changed
+        to the file, so it's never in memory whole. When `fresh(relpath, inputs)`, it isn't even built.
+
+        :param relpath: Output file, relative to the directory
+        :type relpath: ```str```
+
+        :param payload: Directives, as in crossplane's payload, or `Directive`s; iterated up to twice
+        :type payload: ```Iterable[Union[dict, Directive]]```
+
+        :param inputs: Digest of everything the output is built from, checked by `fresh` on later runs
+        :type inputs: ```Optional[str]```
+
+        :return: Whether the file was (re)written
+        :rtype: ```bool```
+        """
+        from nginxctl.builder import dump
+
+        if inputs is not None and self.fresh(relpath, inputs):
+            self.reused.append(relpath)
+            return False
+        hashing = _HashingWriter()
+        dump(payload, hashing)
+        hashing.write(os.linesep)
+        entry = {"sha256": hashing.hexdigest(), "size": hashing.size, "inputs": inputs}
+        if self._on_disk(relpath) and self.files[relpath]["sha256"] == entry["sha256"]:
+            self.reused.append(relpath)
+            written = False
+        else:
+            parent = os.path.dirname(self.path(relpath))
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            with atomic_writer(self.path(relpath), "wb") as f:
+                dump(payload, _HashingWriter(f))
+                f.write(os.linesep.encode("utf8"))
+            self.rebuilt.append(relpath)
+            written = True
+        self._record(relpath, entry)
+        return written
+
+    def build(self, relpath, inputs, builder):
+        """
+        Write the output of `builder()` to `relpath`, skipping the build entirely when `fresh(relpath, inputs)`
+
+        :return: Whether the file was (re)written
+        :rtype: ```bool```
+        """
+        if self.fresh(relpath, inputs):
+            self.reused.append(relpath)
+            return False
+        return self.write(relpath, builder(), inputs)
+
+    def copy(self, relpath, src):
+        """
+        Copy `src` to `relpath` if its content changed
+
+        :return: Whether the file was (re)written
+        :rtype: ```bool```
+        """
+        with open(src, "rb") as f:
+            content = f.read()
+        return self.write(relpath, content, digest(content))
+
+    def prune(self, directory, keep):
+        """
+        Remove the files this manifest generated under `directory` that aren't in `keep`
+
+        :param directory: Directory, relative to the manifest's
+        :type directory: ```str```
+
+        :param keep: relpaths to keep
+        :type keep: ```Iterable[str]```
+
+        :return: relpaths removed
+        :rtype: ```List[str]```
+        """
+        keep = frozenset(keep)
+        stale = sorted(
+            relpath
+            for relpath in self.files
+            if os.path.dirname(relpath) == directory and relpath not in keep
+        )
+        for relpath in stale:
+            if os.path.isfile(self.path(relpath)):
+                os.remove(self.path(relpath))
+            del self.files[relpath]
+            self._dirty = True
+        self.removed += stale
+        return stale
+
+    def save(self):
+        if self._dirty:
+            atomic_write(
+                self.manifest_file, json.dumps({"files": self.files}, sort_keys=True)
+            )
+            self._dirty = False
+
+    def report(self):
+        """
+        :return: Human readable summary of which files were rebuilt, reused and removed
+        :rtype: ```str```
+        """
+        return "rebuilt: {}; reused: {}; removed: {}".format(
+            *(
+                ", ".join(relpaths) or "(none)"
+                for relpaths in (self.rebuilt, self.reused, self.removed)
+            )
+        )
+
+
+__all__ = ["Manifest", "digest"]
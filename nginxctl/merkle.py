@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+Structural hashes of directive subtrees—each block's built from its children's, as in a Merkle tree—so whether two
+subtrees are the same is a comparison of two memoized digests
+"""
+
+from nginxctl.manifest import digest
+
+
+class Digests(object):
+    """
+    Memoized digest of each subtree, computed bottom-up once, so a diff is linear in the size of the trees.
+    Comments, line numbers and which file a directive was parsed from don't count—only directives, args and
+    blocks.
+    """
+
+    def __init__(self):
+        self._digests = {}
+
+    def __call__(self, stmt):
+        """
+        :param stmt: A directive, as in crossplane's payload, or a `Directive`
+        :type stmt: ```Union[dict, Directive]```
+
+        :return: Digest of the directive and everything in its block
+        :rtype: ```str```
+        """
+        memoized = self._digests.get(id(stmt))
+        if memoized is not None:
+            return memoized[1]
+        args = stmt.get("args") or ()
+        block = stmt.get("block")
+        stmt_digest = digest(
+            *(
+                (stmt["directive"], str(len(args)))
+                + tuple(args)
+                + (
+                    ()
+                    if block is None
+                    else ("{", "".join(map(self, _directives(block))))
+                )
+            )
+        )
+        self._digests[id(stmt)] = (
+            stmt,
+            stmt_digest,
+        )  # Keeps the id from being reused while memoized
+        return stmt_digest
+
+    def block(self, block):
+        """
+        :param block: Directives, e.g., a file's "parsed"
+        :type block: ```Iterable[Union[dict, Directive]]```
+
+        :return: Digest of them all, in order
+        :rtype: ```str```
+        """
+        return digest("".join(map(self, _directives(block))))
+
+
+def _directives(block):
+    """`block` without its comments"""
+    return [stmt for stmt in block if stmt["directive"] != "#"]
+
+
+class MerkleIndex(Digests):
+    """
+    `Digests` of every directive of a crossplane payload, and of each of its files, kept alongside it. Each
+    directive's parent is recorded, so when one changes only it and the blocks enclosing it—up to its file—are
+    rehashed, on next use; the digests of everything else stay memoized.
+
+    Digests are per file: an include's is that of the directive, not of what it includes.
+    """
+
+    def __init__(self, payload):
+        """
+        :param payload: Output of `crossplane.parse`/`loader.parse`
+        :type payload: ```dict```
+        """
+        super(MerkleIndex, self).__init__()
+        self.payload = payload
+        self._parents, self._files = {}, {}
+        for index, config in enumerate(payload["config"]):
+            self.link(config["parsed"], index)
+
+    def link(self, block, parent):
+        """
+        Index directives added to the payload
+
+        :param block: The directives, each indexed along with its block
+        :type block: ```List[dict]```
+
+        :param parent: The directive whose block they're in, or the index of the file they're at the top of
+        :type parent: ```Union[dict, int]```
+        """
+        stack = [(block, parent)]
+        while stack:
+            block, parent = stack.pop()
+            for stmt in block:
+                self._parents[id(stmt)] = stmt, parent
+                if stmt.get("block") is not None:
+                    stack.append((stmt["block"], stmt))
+
+    def unlink(self, block):
+        """
+        Forget directives removed from the payload
+
+        :param block: The directives, each forgotten along with its block
+        :type block: ```List[dict]```
+        """
+        stack = [block]
+        while stack:
+            for stmt in stack.pop():
+                self._parents.pop(id(stmt), None)
+                self._digests.pop(id(stmt), None)
+                if stmt.get("block") is not None:
+                    stack.append(stmt["block"])
+
+    def invalidate(self, stmt):
+        """
+        Forget the digests of a directive that changed, of each block enclosing it and of its file
+
+        :param stmt: A directive of the payload, changed in place or just `link`ed
+        :type stmt: ```dict```
+        """
+        while True:
+            self._digests.pop(id(stmt), None)
+            stmt = self._parents[id(stmt)][1]
+            if isinstance(stmt, int):
+                self._files.pop(stmt, None)
+                return
+
+    def file(self, index):
+        """
+        :param index: Index of the file in the payload's "config"
+        :type index: ```int```
+
+        :return: Digest of the file's directives
+        :rtype: ```str```
+        """
+        if index not in self._files:
+            self._files[index] = self.block(self.payload["config"][index]["parsed"])
+        return self._files[index]
+
+    def duplicates(self):
+        """
+        :return: Groups of blocks that are the same—e.g., a location repeated across servers—biggest groups first
+        :rtype: ```List[List[dict]]```
+        """
+        groups, stack = {}, [
+            iter(config["parsed"]) for config in reversed(self.payload["config"])
+        ]
+        while stack:  # Preorder, so each group is in the order of the config
+            stmt = next(stack[-1], None)
+            if stmt is None:
+                stack.pop()
+            elif stmt["directive"] != "#" and stmt.get("block"):
+                groups.setdefault(self(stmt), []).append(stmt)
+                stack.append(iter(stmt["block"]))
+        return sorted(
+            (group for group in groups.values() if len(group) > 1),
+            key=len,
+            reverse=True,
+        )
+
+
+__all__ = ["Digests", "MerkleIndex"]
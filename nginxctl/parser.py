@@ -1,138 +1,211 @@
+# -*- coding: utf-8 -*-
+
 import argparse
+import re
 import sys
-from functools import reduce
 from itertools import count
 
-from boltons.iterutils import remap
-
-
-def make_directive(args=None, directive=None, block=None, line=None):
-    return {
-        "args": args or [],
-        "directive": directive or None,
-        "block": block or [],
-        "line": line or None,
-    }
-
-
-def get_nested_dict(obj, path):
-    return reduce(lambda o, n: o["block"][n], path, obj)
-
+from nginxctl.directive import Directive
+from nginxctl.macros import Macros
+
+_open_block = frozenset(("-b", "--block"))
+
+# Directives whose CLI value is a single path, never split on whitespace
+_path_directives = frozenset(
+    (
+        "alias",
+        "auth_basic_user_file",
+        "include",
+        "root",
+        "ssl_certificate",
+        "ssl_certificate_key",
+        "ssl_client_certificate",
+        "ssl_dhparam",
+        "ssl_trusted_certificate",
+    )
+)
 
-def get_nested_list(obj, path):  # assert len(path) > 0
-    return reduce(lambda o, n: o[n]["block"], path, obj["block"])
+# An arg: unquoted text, "double quoted" (with \" escapes) or 'single quoted' pieces, or a stray quote
+_arg = re.compile(r"""(?:[^\s"']+|"(?:[^"\\]|\\.)*"|'[^']*'|["'])+""").finditer
+_quoted = re.compile(r""""((?:[^"\\]|\\.)*)"|'([^']*)'""").sub
+_double_quote_escape = re.compile(r'\\(["\\])').sub
+_needs_split = re.compile(r"""[\s"']""").search
 
 
-def insert_into(obj, path, value, key, counter):
-    block = get_nested_list(obj, path[:-1])
-    try:
-        directive = block[path[-1]]
-    except IndexError:
-        block.append(make_directive(**{key: value, "line": next(counter)}))
-        return
-    if not directive[key]:
-        directive[key] = value
-    else:
-        block.append(make_directive(**{key: value, "line": next(counter)}))
+def _unquote(match):
+    if match.group(2) is not None:
+        return match.group(2)
+    return _double_quote_escape(r"\1", match.group(1))
 
 
 def parse_args(args):
+    """
+    Split a CLI value into directive args on whitespace, like a shell would: quoted pieces—'…' or "…"—are kept
+    together and unquoted, so `'Connection ""'` gives `["Connection", ""]`
+    """
     if not isinstance(args, (list, tuple)):
         args = [args]
     if not len(args) == 1:
         return args
 
-    stack, components = [], []
-    for arg in args:
-        for c in arg:
-            if c == " ":
-                components.append("".join(stack))
-                stack.clear()
-            else:
-                stack.append(c)
-    components.append("".join(stack))
+    arg = args[0]
+    if not _needs_split(arg):
+        return [arg]
+    return [_quoted(_unquote, match.group()) for match in _arg(arg)]
+
+
+def iter_cli_tokens(lines):
+    """
+    Tokenize a file of CLI tokens: whitespace separated, quoted like a shell, `#` comment lines ignored
+
+    :param lines: e.g., an open file
+    :type lines: ```Iterable[str]```
+
+    :return: CLI tokens, e.g., `-b`, `server`, `--listen`, `8080`, `-}`
+    :rtype: ```Iterator[str]```
+    """
+    for line in lines:
+        if line.lstrip().startswith("#"):
+            continue
+        for match in _arg(line):
+            yield _quoted(_unquote, match.group())
+
+
+def iter_cli_blocks(tokens, macros=None):
+    """
+    Parse a stream of CLI tokens in one pass, keeping a stack of the open blocks
+
+    `-b name [args…]` (or `--block`) opens a block, `-{` turns the last directive into a block,
+    `-}` closes the innermost block, `--name [args…]` adds a directive to it;
+    every other token adds args to the last directive. Macros—e.g., `--proxy`—are expanded as their top-level
+    block closes, see `nginxctl.macros`.
+
+    :param tokens: CLI tokens, e.g., argv or `iter_cli_tokens(f)`
+    :type tokens: ```Iterable[str]```
+
+    :param macros: Expands macros; pass the same one to share upstreams between calls, e.g., records of a batch
+    :type macros: ```Optional[Macros]```
+
+    :return: (context, directive) for each top-level block as it closes: context is "server" for servers,
+      "http" for everything else (upstream, map, &etc.)—including those that macros add
+    :rtype: ```Iterator[Tuple[str, Directive]]```
+    """
+    macros = Macros() if macros is None else macros
+    line, stack, current, opening = count(), [], None, False
+    for token in tokens:
+        if opening:
+            current, opening = _open_named(stack, token, next(line)), False
+        elif token in _open_block:
+            next(line)
+            opening = True
+        elif token == "-{":
+            next(line)
+            current = _open_last(stack, current)
+        elif token == "-}":
+            closed, current = _close(stack), None
+            if closed is not None:
+                for context_block in macros.expand(closed):
+                    yield context_block
+        elif token.startswith("--"):
+            current = _add_directive(stack, token, next(line))
+        else:
+            _add_args(current, token)
+    if stack or opening:
+        raise argparse.ArgumentTypeError("Imbalanced {}")
 
-    return components
 
+def _open_named(stack, name, line):
+    """`-b name`: open a block, in the innermost open one"""
+    directive = Directive(name.lstrip("-"), (), [], line)
+    if stack:
+        stack[-1].block.append(directive)
+    stack.append(directive)
+    return directive
 
-def parse_cli_config(argv=None):
-    p, top_d, idx, c = [], make_directive(), 0, count()
-    argv = tuple(argv or sys.argv[1:])
 
-    while idx < len(argv):
-        arg = argv[idx]
+def _open_last(stack, current):
+    """`-{`: turn the last directive into a block, and open it"""
+    if current is None:
+        raise argparse.ArgumentTypeError("-{ does not follow a directive")
+    if current.block is None:
+        current.block = []
+    stack.append(current)
+    return current
 
-        if arg == "-{":
-            p.append(-1)
-            next(c)
 
-        elif arg in frozenset(("-b", "--block")):
-            next(c)
-            idx += 1
-            arg = argv[idx]
-            if idx == 1:
-                top_d.update({"directive": arg.lstrip("--"), "line": next(c)})
-                if len(argv) > 2 and argv[3].startswith("--"):
-                    top_d["args"] = parse_args(argv[2])
-                    idx += 1
-            else:
-                insert_into(top_d, p, arg.lstrip("--"), "directive", c)
+def _close(stack):
+    """`-}`: close the innermost block, returning it if it's a top-level one"""
+    if not stack:
+        raise argparse.ArgumentTypeError("Imbalanced {}")
+    closed = stack.pop()
+    return None if stack else closed
+
+
+def _add_directive(stack, token, line):
+    """`--name`: add a directive to the innermost open block"""
+    if not stack:
+        raise argparse.ArgumentTypeError("{} is outside of any block".format(token))
+    directive = Directive(token[2:], (), None, line)
+    stack[-1].block.append(directive)
+    return directive
+
+
+def _add_args(current, token):
+    """Any other token: add args to the last directive"""
+    if current is None:
+        raise argparse.ArgumentTypeError(
+            "{!r} does not follow a directive".format(token)
+        )
+    current.args += tuple(
+        (token,) if current.directive in _path_directives else parse_args(token)
+    )
 
-            if not argv[idx + 1].startswith("--"):
-                idx += 1
-                insert_into(top_d, p, parse_args(argv[idx]), "args", c)
 
-            p.append(-1)
+def parse_cli_directives(argv=None):
+    """
+    Parse CLI tokens of one top-level block, e.g., `-b server --listen 8080 -}`, into a directive tree
 
-        elif arg == "-}":
-            p.pop(-1)
+    :param argv: CLI tokens, defaults to `sys.argv[1:]`
+    :type argv: ```Optional[Iterable[str]]```
 
-        else:
-            if arg.startswith("--"):
-                key = "directive"
-                arg = arg.lstrip("--")
-            else:
-                key = "args"
-                if argv[idx - 1] == "--root":  # TODO: Add other paths here
-                    arg = [arg]
-                else:
-                    arg = parse_args(arg)
-            insert_into(top_d, p, arg, key, c)
-        idx += 1
-    if p:
-        raise argparse.ArgumentTypeError("Imbalanced {}")
+    :return: The top-level directive
+    :rtype: ```Directive```
+    """
+    blocks = list(iter_cli_blocks(sys.argv[1:] if argv is None else argv))
+    if len(blocks) != 1:
+        raise argparse.ArgumentTypeError(
+            "Expected one top-level block, got {}".format(len(blocks))
+        )
+    return blocks[0][1]
 
-    return remap(
-        top_d, visit=lambda _, k, v: (k, None if k == "block" and not v else v)
-    )
 
+def parse_cli_config(argv=None):
+    """
+    Parse CLI tokens, e.g., `-b server --listen 8080 -}`, into crossplane's payload format
+
+    :param argv: CLI tokens, defaults to `sys.argv[1:]`
+    :type argv: ```Optional[Iterable[str]]```
+
+    :return: The top-level directive, with "block" None for simple directives
+    :rtype: ```dict```
+    """
+    return _to_dict(parse_cli_directives(argv))
 
-def cli_to_context2block(cli_to_parse):
-    context2block = {"http": [], "server": []}
-    left, left_added, context, stack = 0, 0, None, []
-    for idx, arg in enumerate(cli_to_parse):
-        if arg == "-b":
-            left += 1
-            left_added = idx
-        elif arg == "-}":
-            left -= 1
-        elif left_added == idx - 1 and left == 1:
-            if len(stack) == 0 and idx != 0:
-                stack = [context2block[context][-1].pop()]
-            context = arg if arg == "server" else "http"
-            context2block[context].append(stack.copy())
-            stack.clear()
-
-        if context is not None:
-            context2block[context][-1].append(arg)
-        else:
-            stack.append(arg)
 
-    # Flatten. Later on we might want to generate different files, rather than one server.conf &etc. So unflatten then.
+def _to_dict(directive):
     return {
-        context: [item for sublist in block for item in sublist]
-        for context, block in context2block.items()
+        "args": list(directive.args),
+        "block": (
+            None if directive.block is None else list(map(_to_dict, directive.block))
+        ),
+        "directive": directive.directive,
+        "line": directive.line,
     }
 
 
-__all__ = ["parse_cli_config", "cli_to_context2block"]
+__all__ = [
+    "iter_cli_blocks",
+    "iter_cli_tokens",
+    "parse_cli_config",
+    "parse_cli_directives",
+]
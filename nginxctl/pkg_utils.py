@@ -8,8 +8,6 @@ import inspect
 from os import listdir, path
 from sys import version_info
 
-import pkg_resources
-
 if version_info.major == 2:
 
     class suppress:
@@ -34,6 +32,8 @@ else:
 
 
 class PythonPackageInfo(object):
+    _app_name = None
+
     @staticmethod
     def get_first_setup_py(cur_dir):
         if "setup.py" in listdir(cur_dir):
@@ -57,8 +57,28 @@ class PythonPackageInfo(object):
             and node.targets[0].id == "package_name"
         )
 
-    # Originally https://stackoverflow.com/a/56032725
     def get_app_name(self):
+        """
+        Name of the distribution this package was installed as. Memoized in-process and on disk,
+        as discovering it means scanning the RECORD of every installed distribution.
+
+        :return: Project name, e.g., "nginxctl"
+        :rtype: ```str```
+        """
+        if PythonPackageInfo._app_name is None:
+            from nginxctl.cache import file_key, memoize
+
+            PythonPackageInfo._app_name = memoize(
+                "app_name",
+                file_key(inspect.getfile(self.__class__)),
+                self._discover_app_name,
+            )
+        return PythonPackageInfo._app_name
+
+    # Originally https://stackoverflow.com/a/56032725
+    def _discover_app_name(self):
+        import pkg_resources
+
         # if version_info.major == 2:
         #     return 'nginxctl'  # TODO: Fix this for Python 2.7… or just drop support for that old version
 
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write `.gz`—and, if the `brotli` package is installed, `.br`—siblings of the compressible files of a webroot, so
+nginx's `gzip_static`/`brotli_static` serve them without compressing anything per request
+"""
+
+from __future__ import division, print_function
+
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from sys import version_info
+from timeit import default_timer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from nginxctl.cache import get_cache_dir
+from nginxctl.helpers import atomic_write
+from nginxctl.manifest import digest
+from nginxctl.static import walk
+
+# Text-like files; images, video, woff/woff2 fonts and archives are compressed already
+extensions = frozenset(
+    (
+        ".atom",
+        ".css",
+        ".csv",
+        ".eot",
+        ".htm",
+        ".html",
+        ".ico",
+        ".js",
+        ".json",
+        ".map",
+        ".md",
+        ".mjs",
+        ".otf",
+        ".rss",
+        ".svg",
+        ".ttf",
+        ".txt",
+        ".wasm",
+        ".webmanifest",
+        ".xml",
+    )
+)
+
+
+def available_encodings():
+    """
+    :return: Extensions of the siblings that can be written: "gz", and "br" when `brotli` is installed
+    :rtype: ```Tuple[str, ...]```
+    """
+    return ("gz",) if brotli is None else ("gz", "br")
+
+
+def _compress(data, encoding):
+    if encoding == "gz":
+        # Like `gzip.compress(data, 9, mtime=0)`, which Python 2 lacks: no timestamp, so the output is reproducible
+        out = BytesIO()
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as f:
+            f.write(data)
+        return out.getvalue()
+    return brotli.compress(data, quality=11)
+
+
+if version_info[0] == 2:
+
+    # Python 2 only has float mtimes, to the microsecond. `os.utime` truncates them, so they're set half a
+    # microsecond on, so what's read back rounds to what was set.
+    def _mtime_ns(st):
+        return int(round(st.st_mtime * 1e6)) * 1000
+
+    def _set_mtime_ns(path, mtime_ns):
+        mtime = (mtime_ns + 500) / 1e9
+        os.utime(path, (mtime, mtime))
+
+else:
+
+    def _mtime_ns(st):
+        return st.st_mtime_ns
+
+    def _set_mtime_ns(path, mtime_ns):
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def iter_stale(root, encodings, min_size=1024):
+    """
+    Find the compressible files of `root` with stale siblings, in one `static.walk`
+
+    :param root: Webroot
+    :type root: ```str```
+
+    :param encodings: Siblings to check, e.g., `("gz",)`
+    :type encodings: ```Iterable[str]```
+
+    :param min_size: Smaller files aren't worth compressing
+    :type min_size: ```int```
+
+    :return: (path, size, mtime_ns, encodings) of each compressible file, and those of its siblings that are
+      missing or older than it; the latter is empty when they're all fresh
+    :rtype: ```Iterator[Tuple[str, int, int, Tuple[str, ...]]]```
+    """
+    for directory, files in walk(root):
+        for name, st in files.items():
+            if (
+                os.path.splitext(name)[1].lower() not in extensions
+                or st.st_size < min_size
+            ):
+                continue
+            mtime_ns = _mtime_ns(st)
+            siblings = ("{}.{}".format(name, encoding) for encoding in encodings)
+            yield os.path.join(directory, name), st.st_size, mtime_ns, tuple(
+                encoding
+                for encoding, sibling in zip(encodings, siblings)
+                if sibling not in files or _mtime_ns(files[sibling]) < mtime_ns
+            )
+
+
+def _write_sibling(path, encoding, data, mtime_ns, max_ratio):
+    """
+    :return: Compressed size of `path`'s sibling for `encoding`, None if not worth writing—or keeping
+    :rtype: ```Optional[int]```
+    """
+    sibling = "{}.{}".format(path, encoding)
+    compressed = _compress(data, encoding)
+    if len(compressed) > len(data) * max_ratio:
+        try:
+            os.remove(sibling)
+        except OSError:
+            pass
+        return None
+    atomic_write(sibling, compressed, "wb")
+    _set_mtime_ns(sibling, mtime_ns)
+    return len(compressed)
+
+
+def compress_file(task, max_ratio=0.9):
+    """
+    Write the compressed siblings of a file, each with the file's mtime, so it's fresh until the file changes.
+    One not smaller than `max_ratio` of the file isn't worth it: it's not written, and an old one is removed,
+    so nginx never serves stale content.
+
+    :param task: path, size, mtime_ns and encodings, as from `iter_stale`
+    :type task: ```Tuple[str, int, int, Tuple[str, ...]]```
+
+    :param max_ratio: Most compressed size, as a fraction of the size, worth keeping
+    :type max_ratio: ```float```
+
+    :return: path, and each encoding's compressed size—None if not worth it
+    :rtype: ```Tuple[str, List[Tuple[str, Optional[int]]]]```
+    """
+    path, _, mtime_ns, encodings = task
+    with open(path, "rb") as f:
+        data = f.read()
+    return path, [
+        (encoding, _write_sibling(path, encoding, data, mtime_ns, max_ratio))
+        for encoding in encodings
+    ]
+
+
+def _skip_list_path(root):
+    """Where files of `root` not worth compressing are remembered, None when caching is disabled"""
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    return os.path.join(
+        cache_dir,
+        "precompress_{}.json".format(digest(os.path.realpath(root))[:16]),
+    )
+
+
+def _load_skip_list(skip_list_path):
+    """:return: path to [size, mtime_ns, encodings not worth writing] of files remembered at `skip_list_path`"""
+    if skip_list_path is not None:
+        try:
+            with open(skip_list_path, "rt") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+    return {}
+
+
+def _save_skip_list(skip_list_path, not_worth):
+    try:
+        if not os.path.isdir(os.path.dirname(skip_list_path)):
+            os.makedirs(os.path.dirname(skip_list_path))
+        atomic_write(skip_list_path, json.dumps(not_worth))
+    except (IOError, OSError):
+        pass  # An unwritable cache only costs speed
+
+
+def _plan(root, encodings, min_size, skip_list, stats):
+    """
+    :return: The tasks for `compress_file` of `root`, and the files of `skip_list` still not worth compressing,
+      counting the files found in `stats`
+    :rtype: ```Tuple[List[Tuple[str, int, int, Tuple[str, ...]]], dict]```
+    """
+    not_worth, tasks = {}, []
+    for path, size, mtime_ns, stale in iter_stale(root, encodings, min_size):
+        stats["files"] += 1
+        skipped = skip_list.get(path)
+        if skipped is not None and skipped[:2] == [size, mtime_ns]:
+            not_worth[path] = skipped
+            stale = tuple(encoding for encoding in stale if encoding not in skipped[2])
+        if stale:
+            tasks.append((path, size, mtime_ns, stale))
+        elif path in not_worth:
+            stats["skipped"] += 1
+        else:
+            stats["fresh"] += 1
+    return tasks, not_worth
+
+
+def _record(stats, not_worth, task, sizes):
+    """Count a compressed file in `stats`, and remember in `not_worth` the encodings it isn't worth it for"""
+    path, size, mtime_ns = task[:3]
+    kept = [compressed for _, compressed in sizes if compressed is not None]
+    stats["bytes_in"] += size * len(kept)
+    stats["bytes_out"] += sum(kept)
+    stats["compressed" if kept else "skipped"] += 1
+    skipped = [encoding for encoding, compressed in sizes if compressed is None]
+    if skipped:
+        previous = not_worth.get(path)
+        not_worth[path] = [
+            size,
+            mtime_ns,
+            sorted(set(skipped + (previous[2] if previous else []))),
+        ]
+
+
+def precompress(roots, processes=None, min_size=1024, max_ratio=0.9, encodings=None):
+    """
+    Write the compressed siblings of the compressible files under `roots` that are missing or older than the file,
+    in a process pool. Files found not worth compressing are remembered—in the cache directory—until they change,
+    so a run on a tree that's up to date only walks it. Bytes saved and throughput are reported on stderr.
+
+    :param roots: Webroots, e.g., the `root` of each location
+    :type roots: ```Iterable[str]```
+
+    :param processes: Size of the process pool; defaults to the CPU count. With 1, no pool is used.
+    :type processes: ```Optional[int]```
+
+    :param min_size: Smaller files aren't worth compressing
+    :type min_size: ```int```
+
+    :param max_ratio: Most compressed size, as a fraction of the size, worth keeping
+    :type max_ratio: ```float```
+
+    :param encodings: Siblings to write, defaults to `available_encodings()`
+    :type encodings: ```Optional[Iterable[str]]```
+
+    :return: files: compressible files found, compressed: of them, those compressed now, fresh: those whose siblings
+      were up to date, skipped: those not worth compressing; bytes_in and bytes_out: sizes of the files compressed
+      now, and of their siblings; seconds taken
+    :rtype: ```dict```
+    """
+    start = default_timer()
+    encodings = available_encodings() if encodings is None else tuple(encodings)
+    stats = dict.fromkeys(
+        ("files", "compressed", "fresh", "skipped", "bytes_in", "bytes_out"), 0
+    )
+    compress = partial(compress_file, max_ratio=max_ratio)
+    executor = None if processes == 1 else ProcessPoolExecutor(processes)
+    try:
+        for root in roots:
+            skip_list_path = _skip_list_path(root)
+            skip_list = _load_skip_list(skip_list_path)
+            tasks, not_worth = _plan(root, encodings, min_size, skip_list, stats)
+            for task, (_, sizes) in zip(
+                tasks,
+                (
+                    map(compress, tasks)
+                    if executor is None
+                    else executor.map(compress, tasks, chunksize=16)
+                ),
+            ):
+                _record(stats, not_worth, task, sizes)
+            if skip_list_path is not None and not_worth != skip_list:
+                _save_skip_list(skip_list_path, not_worth)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    stats["seconds"] = default_timer() - start
+    print(
+        "precompressed {compressed} of {files} files ({fresh} fresh, {skipped} not worth it) in {seconds:.3f}s:"
+        " {saved} bytes saved ({rate:.1f} MB/s)".format(
+            saved=stats["bytes_in"] - stats["bytes_out"],
+            rate=(
+                stats["bytes_in"] / stats["seconds"] / 1e6
+                if stats["seconds"]
+                else float("inf")
+            ),
+            **stats
+        ),
+        file=sys.stderr,
+    )
+    return stats
+
+
+__all__ = [
+    "available_encodings",
+    "compress_file",
+    "extensions",
+    "iter_stale",
+    "precompress",
+]
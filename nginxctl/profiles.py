@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+Performance profiles for the generated nginx.conf: worker, connection and file descriptor limits, TCP options,
+caches, keepalive and buffer sizes, sized from the CPUs, file descriptor limit and memory of the machine
+"""
+
+import os
+from collections import OrderedDict
+from multiprocessing import cpu_count
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# throughput: many concurrent connections, big transfers; latency: small, interactive responses;
+# low-memory: small boxes and containers
+names = "throughput", "latency", "low-memory"
+
+# Per profile: most worker_connections, memory per connection (bytes) to budget for, and http directives
+_profiles = {
+    "throughput": (
+        16384,
+        64 << 10,
+        (
+            ("sendfile", "on"),
+            ("tcp_nopush", "on"),
+            ("tcp_nodelay", "on"),
+            ("keepalive_timeout", "65"),
+            ("keepalive_requests", "10000"),
+            ("client_body_buffer_size", "128k"),
+            ("large_client_header_buffers", "4", "16k"),
+            ("output_buffers", "2", "64k"),
+            ("gzip", "on"),
+            ("gzip_comp_level", "4"),
+            ("gzip_min_length", "1024"),
+        ),
+    ),
+    "latency": (
+        4096,
+        32 << 10,
+        (
+            ("sendfile", "on"),
+            ("tcp_nopush", "off"),
+            ("tcp_nodelay", "on"),
+            ("keepalive_timeout", "15"),
+            ("keepalive_requests", "1000"),
+            ("client_body_buffer_size", "16k"),
+            ("large_client_header_buffers", "4", "8k"),
+            ("output_buffers", "1", "16k"),
+            ("gzip", "on"),
+            ("gzip_comp_level", "1"),
+            ("gzip_min_length", "1024"),
+        ),
+    ),
+    "low-memory": (
+        1024,
+        16 << 10,
+        (
+            ("sendfile", "on"),
+            ("tcp_nopush", "on"),
+            ("tcp_nodelay", "on"),
+            ("keepalive_timeout", "15"),
+            ("keepalive_requests", "100"),
+            ("client_body_buffer_size", "8k"),
+            ("large_client_header_buffers", "2", "4k"),
+            ("output_buffers", "1", "8k"),
+            ("gzip", "off"),
+        ),
+    ),
+}
+
+# Never set worker_rlimit_nofile above this, however high the hard limit
+_max_nofile = 1 << 20
+
+
+def detect():
+    """
+    :return: "cpus" this process may run on, the hard limit on open files "nofile"—None if unlimited or
+      unknown—and physical "memory" in bytes, None if unknown
+    :rtype: ```dict```
+    """
+    cpus = (
+        len(os.sched_getaffinity(0))
+        if hasattr(os, "sched_getaffinity")
+        else cpu_count()
+    )
+    nofile = None
+    if resource is not None:
+        hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+        if hard != resource.RLIM_INFINITY:
+            nofile = hard
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, OSError, ValueError):
+        memory = None
+    return {"cpus": cpus or 1, "nofile": nofile, "memory": memory}
+
+
+def tune(profile, hardware=None, instances=1):
+    """
+    Directives for a profile, sized for the hardware
+
+    :param profile: One of `names`
+    :type profile: ```str```
+
+    :param hardware: As `detect` returns, which it defaults to
+    :type hardware: ```Optional[dict]```
+
+    :param instances: nginx instances sharing the hardware, e.g., a `fleet`'s; each is sized for its share of the
+      CPUs, file descriptors and memory
+    :type instances: ```int```
+
+    :return: Directives to set in the main, "events" and "http" contexts, keyed by context
+    :rtype: ```OrderedDict[str, List[dict]]```
+    """
+    if profile not in _profiles:
+        raise ValueError(
+            "Unknown profile {!r}, expected one of: {}".format(
+                profile, ", ".join(names)
+            )
+        )
+    hardware = detect() if hardware is None else hardware
+    max_connections, connection_memory, http = _profiles[profile]
+    workers = 1 if profile == "low-memory" else max(hardware["cpus"] // instances, 1)
+    nofile = min(hardware["nofile"] or _max_nofile, _max_nofile)
+    nofile = max(nofile // instances, min(nofile, 1024))
+    memory = hardware["memory"] and hardware["memory"] // instances
+
+    # Each connection may take 2 descriptors—client and upstream—and a worker also opens files and logs
+    connections = min(max_connections, max(nofile // 2 - 32, 64))
+    if memory:
+        # Leave three quarters of the memory to everything else
+        connections = min(
+            connections, max(memory // 4 // workers // connection_memory, 64)
+        )
+
+    def directives(*pairs):
+        return [{"directive": pair[0], "args": list(pair[1:])} for pair in pairs]
+
+    return OrderedDict(
+        (
+            (
+                "main",
+                directives(
+                    ("worker_processes", str(workers)),
+                    ("worker_rlimit_nofile", str(nofile)),
+                ),
+            ),
+            (
+                "events",
+                directives(
+                    ("worker_connections", str(connections)),
+                    ("multi_accept", "on" if profile == "throughput" else "off"),
+                ),
+            ),
+            (
+                "http",
+                directives(*http)
+                + (
+                    directives(
+                        (
+                            "open_file_cache",
+                            "max={}".format(min(nofile // 2, 100000)),
+                            "inactive={}".format(
+                                "60s" if profile == "throughput" else "20s"
+                            ),
+                        ),
+                        ("open_file_cache_valid", "30s"),
+                        ("open_file_cache_min_uses", "2"),
+                        ("open_file_cache_errors", "on"),
+                    )
+                    if profile != "low-memory"
+                    else directives(("open_file_cache", "off"))
+                ),
+            ),
+        )
+    )
+
+
+def apply_profile(parsed, tuning):
+    """
+    Set the tuned directives in a parsed nginx.conf: each replaces the directive of the same name in its
+    context, else is added before the context's first block
+
+    :param parsed: The "parsed" of nginx.conf in crossplane's payload; changed in place
+    :type parsed: ```List[dict]```
+
+    :param tuning: From `tune`
+    :type tuning: ```OrderedDict[str, List[dict]]```
+
+    :return: `parsed`
+    :rtype: ```List[dict]```
+    """
+    for context, tuned in tuning.items():
+        if context == "main":
+            block = parsed
+        else:
+            block = next(
+                (
+                    stmt["block"]
+                    for stmt in parsed
+                    if stmt["directive"] == context and stmt.get("block") is not None
+                ),
+                None,
+            )
+            if block is None:
+                block = []
+                parsed.append({"directive": context, "args": [], "block": block})
+        positions = {
+            stmt["directive"]: i for i, stmt in reversed(list(enumerate(block)))
+        }
+        added = []
+        for stmt in tuned:
+            if stmt["directive"] in positions:
+                block[positions[stmt["directive"]]] = dict(stmt)
+            else:
+                added.append(dict(stmt))
+        # Before the context's first block, e.g., main's before events
+        insert_at = next(
+            (i for i, stmt in enumerate(block) if stmt.get("block") is not None),
+            len(block),
+        )
+        block[insert_at:insert_at] = added
+    return parsed
+
+
+__all__ = ["apply_profile", "detect", "names", "tune"]
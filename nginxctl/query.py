@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Find directives in a parsed config—by name, by context path, or by arg—through inverted indexes, each built on
+first use, so repeated queries don't rescan the tree
+"""
+
+from collections import namedtuple
+from fnmatch import fnmatchcase
+
+from nginxctl.diff import format_key
+from nginxctl.upsert import directive_key, load
+
+
+class Node(namedtuple("Node", ("path", "stmt", "file"))):
+    """
+    A directive found by a query. `path` is its context path—the keys of the enclosing blocks followed by its own,
+    as used by `ConfigIndex`; `file` is the file it's in, which for a directive in an included file isn't that of
+    its enclosing blocks.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}:{}\t{}".format(
+            self.file, self.stmt.get("line"), " > ".join(map(format_key, self.path))
+        )
+
+
+class Query(object):
+    """
+    Queries over a crossplane payload, following includes, so paths are logical (http > server > location)
+    regardless of which file a directive lives in. Indexes reflect the payload when first used: `invalidate`
+    after changing it.
+    """
+
+    def __init__(self, payload):
+        """
+        :param payload: Output of `crossplane.parse`/`loader.parse`, e.g., `ConfigIndex.payload`
+        :type payload: ```dict```
+        """
+        self.payload = payload
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the indexes, so they're rebuilt—from the payload as it now is—by the next query"""
+        self._nodes = None
+        self._indexes = {}
+
+    @property
+    def nodes(self):
+        """
+        :return: Every directive, comments aside, in the order of the config
+        :rtype: ```List[Node]```
+        """
+        if self._nodes is None:
+            self._nodes = []
+            config = self.payload["config"]
+            stack = [(iter(config[0]["parsed"]), (), 0, frozenset((0,)))]
+            while stack:  # Preorder
+                block, path, file_index, seen = stack[-1]
+                stmt = next(block, None)
+                if stmt is None:
+                    stack.pop()
+                    continue
+                if stmt["directive"] == "#":
+                    continue
+                stmt_path = path + (directive_key(stmt),)
+                self._nodes.append(Node(stmt_path, stmt, config[file_index]["file"]))
+                if stmt.get("block") is not None:
+                    stack.append((iter(stmt["block"]), stmt_path, file_index, seen))
+                for index in reversed(stmt.get("includes") or ()):
+                    if index not in seen:  # include cycles
+                        stack.append(
+                            (iter(config[index]["parsed"]), path, index, seen | {index})
+                        )
+        return self._nodes
+
+    def _index(self, name, keys):
+        """
+        :param name: Name of the index
+        :type name: ```str```
+
+        :param keys: Maps a node to the keys it's indexed under
+        :type keys: ```Callable[[Node], Iterable[Hashable]]```
+
+        :return: The index—key to nodes, in the order of the config—built on first use
+        :rtype: ```dict```
+        """
+        if name not in self._indexes:
+            index = {}
+            for node in self.nodes:
+                for key in keys(node):
+                    index.setdefault(key, []).append(node)
+            self._indexes[name] = index
+        return self._indexes[name]
+
+    def by_directive(self, directive):
+        """
+        :param directive: Name, e.g., "proxy_pass"
+        :type directive: ```str```
+
+        :return: Directives of that name
+        :rtype: ```List[Node]```
+        """
+        return self._index("directive", lambda node: (node.stmt["directive"],)).get(
+            directive, []
+        )
+
+    def by_path(self, *names):
+        """
+        :param names: Directive names from the main context down, e.g., `("http", "server", "location")`; each may
+          be a glob, e.g., "*" for any one directive
+        :type names: ```str```
+
+        :return: Directives at that context path
+        :rtype: ```List[Node]```
+        """
+        index = self._index("path", lambda node: (tuple(key[0] for key in node.path),))
+        if not any(map(_is_glob, names)):
+            return index.get(names, [])
+        positions = self._indexes.get("position")
+        if positions is None:
+            positions = self._indexes["position"] = {
+                id(node): position for position, node in enumerate(self.nodes)
+            }
+        return sorted(
+            (
+                node
+                for path, nodes in index.items()
+                if len(path) == len(names) and all(map(fnmatchcase, path, names))
+                for node in nodes
+            ),
+            key=lambda node: positions[id(node)],
+        )
+
+    def by_arg(self, value, directive=None):
+        """
+        :param value: An arg, e.g., "/srv"
+        :type value: ```str```
+
+        :param directive: Only directives of this name
+        :type directive: ```Optional[str]```
+
+        :return: Directives with that arg
+        :rtype: ```List[Node]```
+        """
+        nodes = self._index(
+            "arg", lambda node: frozenset(node.stmt.get("args") or ())
+        ).get(value, [])
+        if directive is None:
+            return nodes
+        return [node for node in nodes if node.stmt["directive"] == directive]
+
+    def servers(self, server_name=None, listen=None):
+        """
+        :param server_name: One of the server's names, e.g., "example.com"
+        :type server_name: ```Optional[str]```
+
+        :param listen: Address the server listens on, as in its `listen` directive, e.g., "80" or "127.0.0.1:80"
+        :type listen: ```Optional[str]```
+
+        :return: Server blocks with that name and/or listen address; all of them, given neither
+        :rtype: ```List[Node]```
+        """
+
+        def server_keys(name):
+            def keys(node):
+                if node.stmt["directive"] != "server" or node.stmt.get("block") is None:
+                    return ()
+                return frozenset(
+                    arg
+                    for child in node.stmt["block"]
+                    if child["directive"] == name
+                    for arg in child["args"][: None if name == "server_name" else 1]
+                )
+
+            return keys
+
+        matches = None
+        for name, value in ("server_name", server_name), ("listen", listen):
+            if value is not None:
+                nodes = self._index(name, server_keys(name)).get(value, [])
+                if matches is not None:
+                    ids = frozenset(map(id, nodes))
+                    nodes = [node for node in matches if id(node) in ids]
+                matches = nodes
+        if matches is None:
+            return [
+                node
+                for node in self.by_directive("server")
+                if node.stmt.get("block") is not None
+            ]
+        return matches
+
+    def select(self, expression):
+        """
+        Run a query written as in the `query` command:
+
+        - `proxy_pass`: directives of that name
+        - `http > server > location`: directives at that context path; each name may be a glob
+        - `root=/srv`, `=/srv`, `http > server > root=/srv`: those of them with that arg
+        - `server_name=example.com`, `listen=80`: the servers with that name or listen address
+
+        :param expression: The query
+        :type expression: ```str```
+
+        :return: Matching directives
+        :rtype: ```List[Node]```
+        """
+        names = [name.strip() for name in expression.split(">")]
+        name, eq, value = names[-1].partition("=")
+        names[-1] = name.strip() or "*"
+        if not eq:
+            if len(names) == 1 and not _is_glob(names[0]):
+                return self.by_directive(names[0])
+            return self.by_path(*names)
+        value = value.strip()
+        if len(names) == 1 and names[0] in ("server_name", "listen"):
+            return self.servers(**{names[0]: value})
+        elif len(names) == 1:
+            return [
+                node
+                for node in self.by_arg(value)
+                if fnmatchcase(node.stmt["directive"], names[0])
+            ]
+        at_path = frozenset(map(id, self.by_path(*names)))
+        return [node for node in self.by_arg(value) if id(node) in at_path]
+
+
+def _is_glob(name):
+    return any(c in name for c in "*?[")
+
+
+def query(config_file, expression):
+    """
+    :param config_file: nginx.conf, whose includes are followed
+    :type config_file: ```str```
+
+    :param expression: The query, see `Query.select`
+    :type expression: ```str```
+
+    :return: Matching directives
+    :rtype: ```List[Node]```
+    """
+    return Query(load(config_file).payload).select(expression)
+
+
+__all__ = ["Node", "Query", "query"]
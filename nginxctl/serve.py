@@ -1,103 +1,262 @@
+# -*- coding: utf-8 -*-
+
 from __future__ import print_function
 
+import json
 import os
-from collections import deque
+import re
+from collections import OrderedDict
 from functools import partial
 from itertools import count
-from shutil import copy
-from subprocess import Popen
+from operator import itemgetter
 from sys import modules
 
 import crossplane
-from boltons.iterutils import research
-from pkg_resources import resource_filename
 
-from nginxctl import get_logger
-from nginxctl.helpers import is_directive, pp
+from nginxctl import __version__, control, get_logger, snapshot
+from nginxctl.defaults import get_nginx_defaults
+from nginxctl.manifest import Manifest, digest
+from nginxctl.merkle import Digests
 from nginxctl.pkg_utils import PythonPackageInfo
+from nginxctl.profiles import apply_profile, tune
+from nginxctl.static import apply_static
+
+_unsafe_filename_chars = re.compile(r"[^A-Za-z0-9._-]+").sub
 
 logger = get_logger(
     ":".join((PythonPackageInfo().get_app_name(), modules[__name__].__name__))
 )
 
 
-def serve(
-    known,
-    nginx_command,
-    parsed_config,
-    parsed_config_str,
-    parsed_config_http,
-    parsed_config_http_str,
+def build_nginx_conf(
+    template, sites_available, pid_file=None, tuning=None, blocks=None
 ):
+    """
+    Build the nginx.conf that `serve` runs: the template, in the foreground, logging to stdout/stderr,
+    with its example server replaced by an include of `sites_available`—or by `blocks` themselves
+
+    :param template: Path to the nginx.conf template
+    :type template: ```str```
+
+    :param sites_available: Directory of the generated server configs, absolute or relative to nginx.conf
+    :type sites_available: ```str```
+
+    :param pid_file: Where the master writes its pid, so later runs can reload it
+    :type pid_file: ```Optional[str]```
+
+    :param tuning: Directives of a performance profile to set, from `profiles.tune`
+    :type tuning: ```Optional[OrderedDict[str, List[dict]]]```
+
+    :param blocks: Top-level blocks to put in the config instead of the include, so it stands alone: the
+      directives of "events" and "http" blocks go in the template's, "mail" and "stream" in the main context,
+      and all other blocks in http—where `serve` would have included them from
+    :type blocks: ```Optional[Iterable[Union[Directive, dict]]]```
+
+    :return: The built nginx.conf
+    :rtype: ```str```
+    """
+    nginx_conf_parsed = crossplane.parse(
+        template, catch_errors=False, comments=False, single=True
+    )
+    nginx_conf_parse = nginx_conf_parsed["config"][0]
+
+    line = count(nginx_conf_parse["parsed"][-1]["block"][-1]["line"])
+    del nginx_conf_parse["parsed"][-1]["block"][-1]
+    if tuning is not None:
+        apply_profile(nginx_conf_parse["parsed"], tuning)
+    nginx_conf_parse["parsed"].insert(1, {"args": ["off"], "directive": "daemon"})
+    if pid_file is not None:
+        nginx_conf_parse["parsed"].insert(2, {"args": [pid_file], "directive": "pid"})
+    http = nginx_conf_parse["parsed"][-1]["block"]
+    http += [
+        {"args": ["stderr", "warn"], "directive": "error_log", "line": next(line)},
+        {"args": ["/dev/stdout"], "directive": "access_log", "line": next(line)},
+    ]
+    if blocks is None:
+        http.append(
+            {
+                "args": [os.path.join(sites_available, "*.conf")],
+                "directive": "include",
+                "includes": [2],
+                "line": next(line),
+            }
+        )
+    else:
+        contexts = {
+            stmt["directive"]: stmt["block"]
+            for stmt in nginx_conf_parse["parsed"]
+            if stmt.get("block") is not None
+        }
+        for block in blocks:
+            if block["directive"] in contexts:
+                contexts[block["directive"]] += block["block"]
+            elif block["directive"] in ("mail", "stream"):
+                nginx_conf_parse["parsed"].append(block)
+            else:
+                http.append(block)
+    return crossplane.build(nginx_conf_parse["parsed"]) + os.linesep
+
+
+def shard_name(block):
+    """
+    Stable filename for a top-level block: `<server_name>_<listen>.conf` for servers,
+    `<directive>_<args>.conf` otherwise (e.g., `upstream_backend.conf`)
+
+    :param block: A parsed top-level block, e.g., from `parse_cli_directives`
+    :type block: ```Union[Directive, dict]```
+
+    :return: Filename, without directory
+    :rtype: ```str```
+    """
+    if block["directive"] == "server":
+        first_args = {
+            directive["directive"]: directive["args"][0]
+            for directive in reversed(block.get("block") or [])
+            if directive["directive"] in ("server_name", "listen") and directive["args"]
+        }
+        parts = first_args.get("server_name", "_"), first_args.get("listen", "default")
+    else:
+        parts = [block["directive"]] + list(block["args"])
+    return "{}.conf".format(_unsafe_filename_chars("-", "_".join(parts)))
+
+
+def shard(blocks):
+    """
+    :param blocks: Parsed top-level blocks
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :return: filename to blocks of that file. Servers sharing a server_name/listen pair share a file.
+    :rtype: ```OrderedDict[str, List[Union[Directive, dict]]]```
+    """
+    shards = OrderedDict()
+    for block in blocks:
+        shards.setdefault(shard_name(block), []).append(block)
+    return shards
+
+
+def generate(known, blocks):
+    """
+    Generate the config for `blocks` into `known.temp_dir`: one file per shard under sites-available,
+    and the nginx.conf that includes them. Files whose content is unchanged are left untouched.
+    Then snapshot them, see `snapshot.create`; the snapshot's id is `snapshot.snapshot_id(manifest)`.
+
+    :param known: Parsed CLI arguments, using `nginx`, `temp_dir` and—if set—`profile`, see `profiles.names`,
+      `share`, the instances sharing the machine, see `profiles.tune`, and `static`, see `static.apply_static`
+    :type known: ```Namespace```
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :return: What was rebuilt, reused and removed
+    :rtype: ```Manifest```
+    """
+    nginx_defaults = get_nginx_defaults(known.nginx)
+    if nginx_defaults is None:
+        raise EnvironmentError("nginx not found, got {!r}".format(known.nginx))
+    logger.debug(
+        "nginx:\t{!r} version {}".format(known.nginx, nginx_defaults["version"])
+    )
     if not os.path.isdir(known.temp_dir):
         os.mkdir(known.temp_dir)
     logger.debug("temp_dir:\t{!r}".format(known.temp_dir))
+    manifest = Manifest(known.temp_dir)
     _config_files = "nginx.conf", "mime.types"
     nginx_conf_join = partial(
-        os.path.join,
-        os.path.join(
-            os.path.dirname(
-                os.path.join(
-                    resource_filename(PythonPackageInfo().get_app_name(), "__init__.py")
-                )
-            ),
-            "_config",
-        ),
+        os.path.join, os.path.join(os.path.dirname(__file__), "_config")
     )
-    config_files = tuple(map(nginx_conf_join, _config_files))
-    deque(map(partial(copy, dst=known.temp_dir), config_files), maxlen=0)
-    sites_available = os.path.join(known.temp_dir, "sites-available")
-    if not os.path.isdir(sites_available):
-        os.mkdir(sites_available)
-    server_conf = os.path.join(sites_available, "server.conf")
-    if parsed_config is not None:
-        pp(parsed_config)
-        pp(
-            research(
-                parsed_config,
-                query=lambda p, k, v: is_directive(v)
-                and print("k:", k, ";\nv:", v, ";"),
-            )
+    manifest.copy(_config_files[1], nginx_conf_join(_config_files[1]))
+    if getattr(known, "static", False):
+        blocks = apply_static(blocks, nginx_defaults)
+    # Relative to nginx.conf, so each snapshot refers to its own sites
+    sites_available = "sites-available"
+    shards = tuple(
+        (os.path.join("sites-available", filename), shard_blocks)
+        for filename, shard_blocks in shard(blocks).items()
+    )
+    # A shard whose directives are the same as when last built—semantically, see `merkle.Digests`—isn't rebuilt
+    digests = Digests()
+    for relpath, shard_blocks in shards:
+        manifest.dump(
+            relpath, shard_blocks, digest(__version__, digests.block(shard_blocks))
         )
-    # pp(research(parsed_config, query=lambda p, k, v: is_directive(v)))
-    with open(server_conf, "wt") as f:
-        if parsed_config_http_str is not None:
-            f.write(parsed_config_http_str)
-        if parsed_config_str is not None:
-            f.write(parsed_config_str)
+    manifest.prune("sites-available", map(itemgetter(0), shards))
     # Include this config in the new nginx.conf
-    nginx_conf = os.path.join(known.temp_dir, _config_files[0])
-    nginx_conf_parsed = crossplane.parse(nginx_conf, catch_errors=False, comments=False)
-    nginx_conf_parse = next(
-        config
-        for config in nginx_conf_parsed["config"]
-        if os.path.basename(config["file"]) == "nginx.conf"
+    with open(nginx_conf_join(_config_files[0]), "rb") as f:
+        nginx_conf_template = f.read()
+    pid_file = manifest.path(control.pid_filename)
+    profile = getattr(known, "profile", None)
+    tuning = (
+        None if profile is None else tune(profile, instances=getattr(known, "share", 1))
+    )
+    if tuning is not None:
+        logger.debug("profile:\t{} {}".format(profile, json.dumps(tuning)))
+    manifest.build(
+        _config_files[0],
+        digest(
+            __version__,
+            nginx_conf_template,
+            sites_available,
+            pid_file,
+            *(() if tuning is None else (json.dumps(tuning),))
+        ),
+        partial(
+            build_nginx_conf,
+            nginx_conf_join(_config_files[0]),
+            sites_available,
+            pid_file,
+            tuning,
+        ),
     )
+    manifest.save()
+    logger.info(manifest.report())
+    snapshot.create(manifest)
+    return manifest
 
-    line = count(nginx_conf_parse["parsed"][-1]["block"][-1]["line"])
-    del nginx_conf_parse["parsed"][-1]["block"][-1]
-    nginx_conf_parse["parsed"].insert(1, {"args": ["off"], "directive": "daemon"})
-    nginx_conf_parse["parsed"][-1]["block"] += [
-        {"args": ["stderr", "warn"], "directive": "error_log", "line": next(line)},
-        {"args": ["/dev/stdout"], "directive": "access_log", "line": next(line)},
-        {
-            "args": [os.path.join(sites_available, "*.conf")],
-            "directive": "include",
-            "includes": [2],
-            "line": next(line),
-        },
-    ]
-    config_str = crossplane.build(nginx_conf_parse["parsed"])
-    os.remove(nginx_conf)
-    with open(nginx_conf, "wt") as f:
-        f.write(config_str + os.linesep)
-    # logger.error
-    print(
-        "nginx is running. Stop with: {}".format(
-            " ".join((known.nginx, "-c", nginx_conf, "-s", "stop"))
+
+def serve(known, nginx_command, blocks):
+    """
+    Generate the config for `blocks` into `known.temp_dir`, make its snapshot current and start nginx on it—or,
+    when a master started by an earlier `serve` on the same temp_dir is still running and the snapshot isn't
+    current already, validate the snapshot, make it current and reload that master
+
+    :param known: Parsed CLI arguments, using `nginx`, `temp_dir` and—if set—`keep`, the snapshots to keep
+    :type known: ```Namespace```
+
+    :param nginx_command: Further arguments to nginx
+    :type nginx_command: ```List[str]```
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :return: What was rebuilt, reused and removed
+    :rtype: ```Manifest```
+    """
+    manifest = generate(known, blocks)
+    snapshot_id = snapshot.snapshot_id(manifest)
+    nginx_conf = snapshot.current_path(known.temp_dir, "nginx.conf")
+    keep = snapshot.keep_of(known)
+    pid = control.read_pid(manifest.path(control.pid_filename))
+    if pid is None:
+        snapshot.publish(known.temp_dir, snapshot_id, keep)
+        print(
+            "nginx is running. Stop with: {}".format(
+                " ".join((known.nginx, "-c", nginx_conf, "-s", "stop"))
+            )
         )
-    )
-    Popen([known.nginx, "-c", nginx_conf] + nginx_command)
+        control.start(known.nginx, nginx_conf, nginx_command)
+    elif snapshot_id != snapshot.current(known.temp_dir):
+        # Validate first: a bad config must not reach the running master, nor become current
+        control.validate(
+            known.nginx,
+            snapshot.snapshot_path(known.temp_dir, snapshot_id, "nginx.conf"),
+            nginx_command,
+        )
+        snapshot.publish(known.temp_dir, snapshot_id, keep)
+        control.reload(known.nginx, nginx_conf, nginx_command)
+        print("nginx (pid {}) reloaded".format(pid))
+    else:
+        logger.info("config unchanged; nginx (pid {}) left as is".format(pid))
+    return manifest
     # os.remove(server_conf)
     # os.rmdir(sites_available)
     # deque(os.remove, config_files)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""
+Versioned, content-addressed snapshots of generated configs, published by atomically swapping a symlink
+
+    <directory>/current -> snapshots/<id>
+    <directory>/snapshots/<id>/{nginx.conf,mime.types,sites-available/…}
+    <directory>/snapshots/history.json
+
+nginx runs on `current/nginx.conf`, which only refers to other files by paths relative to it, so switching
+snapshots—to publish or to roll back—is one rename however big the config, a crash at any point leaves `current`
+on a complete snapshot, and a snapshot can be validated with `nginx -t` before it's made current.
+"""
+
+import json
+import os
+import shutil
+
+from nginxctl.helpers import atomic_write, replace
+from nginxctl.manifest import digest
+
+snapshots_dirname = "snapshots"
+current_name = "current"
+history_filename = "history.json"
+
+
+def current_path(directory, *relpath):
+    """
+    :return: Path of `relpath` in the current snapshot, e.g., `current_path(temp_dir, "nginx.conf")`
+    :rtype: ```str```
+    """
+    return os.path.join(directory, current_name, *relpath)
+
+
+def current(directory):
+    """
+    :param directory: Directory the snapshots are published in, e.g., `serve`'s temp_dir
+    :type directory: ```str```
+
+    :return: id of the current snapshot, if any
+    :rtype: ```Optional[str]```
+    """
+    try:
+        return os.path.basename(os.readlink(os.path.join(directory, current_name)))
+    except OSError:
+        return None
+
+
+def history(directory):
+    """
+    :return: ids of published snapshots, oldest first; the last is current unless rolled back past
+    :rtype: ```List[str]```
+    """
+    try:
+        with open(
+            os.path.join(directory, snapshots_dirname, history_filename), "rt"
+        ) as f:
+            return json.load(f)["history"]
+    except (IOError, OSError, ValueError, KeyError):
+        return []
+
+
+def _save_history(directory, ids):
+    atomic_write(
+        os.path.join(directory, snapshots_dirname, history_filename),
+        json.dumps({"history": ids}),
+    )
+
+
+def switch(directory, snapshot_id):
+    """
+    Atomically point `current` at a snapshot
+
+    :param directory: Directory the snapshots are published in
+    :type directory: ```str```
+
+    :param snapshot_id: id of an existing snapshot
+    :type snapshot_id: ```str```
+    """
+    target = os.path.join(snapshots_dirname, snapshot_id)
+    if not os.path.isdir(os.path.join(directory, target)):
+        raise EnvironmentError(
+            "No snapshot {!r} in {!r}".format(snapshot_id, directory)
+        )
+    link = os.path.join(directory, ".{}.{}".format(current_name, os.getpid()))
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(target, link)
+    replace(link, os.path.join(directory, current_name))
+
+
+def _link_or_copy(src, dst):
+    """Hard link—sharing unchanged files between snapshots—else copy"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def snapshot_id(manifest):
+    """
+    :param manifest: Manifest of the generated files
+    :type manifest: ```Manifest```
+
+    :return: id of the snapshot of those files: a digest of their paths and contents
+    :rtype: ```str```
+    """
+    return digest(
+        *(
+            "{}\0{}".format(relpath, manifest.files[relpath]["sha256"])
+            for relpath in sorted(manifest.files)
+        )
+    )[:16]
+
+
+def snapshot_path(directory, snapshot_id, *relpath):
+    """
+    :return: Path of `relpath` in a snapshot, e.g., `snapshot_path(temp_dir, snapshot_id, "nginx.conf")`
+    :rtype: ```str```
+    """
+    return os.path.join(directory, snapshots_dirname, snapshot_id, *relpath)
+
+
+def create(manifest):
+    """
+    Snapshot the files `manifest` generated—hard linked, as they're only ever replaced, never modified in
+    place—unless there already is a snapshot of identical files. The snapshot appears atomically, complete.
+
+    :param manifest: Manifest of the generated files
+    :type manifest: ```Manifest```
+
+    :return: id of the snapshot
+    :rtype: ```str```
+    """
+    directory, new_id = manifest.directory, snapshot_id(manifest)
+    snapshot = snapshot_path(directory, new_id)
+    if os.path.isdir(snapshot):
+        return new_id
+    staging = os.path.join(
+        directory, snapshots_dirname, ".{}.{}".format(new_id, os.getpid())
+    )
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    for relpath in manifest.files:
+        dst = os.path.join(staging, relpath)
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        _link_or_copy(manifest.path(relpath), dst)
+    try:
+        os.rename(staging, snapshot)
+    except OSError:
+        if not os.path.isdir(snapshot):
+            raise
+        shutil.rmtree(staging)  # Created concurrently
+    return new_id
+
+
+def keep_of(known):
+    """
+    :param known: Parsed CLI arguments, maybe with `keep`
+    :type known: ```Namespace```
+
+    :return: Snapshots to keep: `known.keep`—0 included—if given, else 10
+    :rtype: ```int```
+    """
+    keep = getattr(known, "keep", None)
+    return 10 if keep is None else keep
+
+
+def publish(directory, snapshot_id, keep=10):
+    """
+    Make a snapshot current, record it in the history, then `gc`
+
+    :param directory: Directory the snapshots are published in
+    :type directory: ```str```
+
+    :param snapshot_id: id of an existing snapshot, e.g., from `create`
+    :type snapshot_id: ```str```
+
+    :param keep: Snapshots to keep, see `gc`
+    :type keep: ```int```
+
+    :return: Whether `current` changed
+    :rtype: ```bool```
+    """
+    switched = current(directory) != snapshot_id
+    if switched:
+        switch(directory, snapshot_id)
+        ids = history(directory)
+        if not ids or ids[-1] != snapshot_id:
+            _save_history(directory, ids + [snapshot_id])
+    gc(directory, keep)
+    return switched
+
+
+def rollback(directory):
+    """
+    Make the snapshot published before the current one current again
+
+    :param directory: Directory the snapshots are published in
+    :type directory: ```str```
+
+    :return: id of the now current snapshot
+    :rtype: ```str```
+    """
+    ids, snapshot_id = history(directory), current(directory)
+    if ids and ids[-1] == snapshot_id:
+        ids = ids[:-1]
+    if not ids:
+        raise EnvironmentError("No snapshot to roll back to in {!r}".format(directory))
+    switch(directory, ids[-1])
+    _save_history(directory, ids)
+    return ids[-1]
+
+
+def gc(directory, keep=10):
+    """
+    Remove all snapshots but the current one and the last `keep` in the history
+
+    :param directory: Directory the snapshots are published in
+    :type directory: ```str```
+
+    :param keep: Snapshots to keep
+    :type keep: ```int```
+
+    :return: ids removed
+    :rtype: ```List[str]```
+    """
+    ids = history(directory)
+    # Not `ids[-keep:]`, which is all of them when `keep` is 0
+    last = ids[max(len(ids) - keep, 0) :]
+    kept = frozenset(last + [current(directory)])
+    if len(last) < len(ids):
+        _save_history(directory, last)
+    snapshots = os.path.join(directory, snapshots_dirname)
+    if not os.path.isdir(snapshots):
+        return []
+    removed = sorted(
+        name
+        for name in os.listdir(snapshots)
+        if name not in kept and not name.startswith(".") and name != history_filename
+    )
+    for name in removed:
+        shutil.rmtree(os.path.join(snapshots, name))
+    return removed
+
+
+__all__ = [
+    "create",
+    "current",
+    "current_name",
+    "current_path",
+    "gc",
+    "history",
+    "keep_of",
+    "publish",
+    "rollback",
+    "snapshot_id",
+    "snapshot_path",
+    "snapshots_dirname",
+    "switch",
+]
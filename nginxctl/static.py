@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+Static-site serving: walk each `root` once—noting precompressed siblings, fingerprinted asset names and large
+files—and add the directives that serve what's there cheaply: `gzip_static`, `open_file_cache`, long `expires` for
+immutable assets, `sendfile` and `aio`
+"""
+
+import os
+import re
+import stat
+from collections import namedtuple
+
+from nginxctl.defaults import has_module
+from nginxctl.directive import Directive
+
+# A content hash—8 or more hex digits—just before the extension, e.g., app.3f2a9c41.js or style-3f2a9c41d0.css
+_fingerprint = r"[.-][0-9a-f]{{8,}}\.({})$"
+_fingerprinted = re.compile(_fingerprint.format("[a-z0-9]+"), re.IGNORECASE).search
+
+# Files at least this big bypass the page cache (directio) and are read by aio rather than sendfile
+_large_file = 4 << 20
+
+# Most open_file_cache entries, however many files there are
+_max_open_files = 100000
+
+
+class Scan(namedtuple("Scan", ("files", "gz", "br", "fingerprinted", "large"))):
+    """
+    What's in a root: how many files—precompressed siblings aside—and how many of them have a `.gz` sibling, a `.br`
+    sibling, or are large; `fingerprinted` is the extensions of fingerprinted files, e.g., `frozenset(("js",))`
+    """
+
+    __slots__ = ()
+
+
+def walk(root):
+    """
+    Walk `root` a directory at a time, so memory is bounded by the largest directory not the tree
+
+    :param root: Directory, e.g., a location's root
+    :type root: ```str```
+
+    :return: Each directory with the stat of each of its regular files by name, following symlinks
+    :rtype: ```Iterator[Tuple[str, Dict[str, os.stat_result]]]```
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        files = {}
+        for name in names:
+            filename = os.path.join(directory, name)
+            try:
+                st = os.lstat(filename)
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(filename)
+                    continue
+                elif stat.S_ISLNK(st.st_mode):
+                    st = os.stat(filename)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files[name] = st
+        yield directory, files
+
+
+def scan(root):
+    """
+    :param root: Directory, e.g., a location's root
+    :type root: ```str```
+
+    :return: What's in it, from one `walk`
+    :rtype: ```Scan```
+    """
+    files = gz = br = large = 0
+    fingerprinted = set()
+    for _, stats in walk(root):
+        for name, st in stats.items():
+            base, extension = os.path.splitext(name)
+            if extension in (".gz", ".br") and base in stats:
+                continue
+            files += 1
+            gz += name + ".gz" in stats
+            br += name + ".br" in stats
+            match = _fingerprinted(name)
+            if match is not None:
+                fingerprinted.add(match.group(1).lower())
+            large += st.st_size >= _large_file
+    return Scan(files, gz, br, frozenset(fingerprinted), large)
+
+
+def _static_module(defaults, module):
+    """Whether `module` was built into nginx, rather than being a dynamic module the config would have to load"""
+    return has_module(defaults, module) and not any(
+        argument.startswith("--add-dynamic-module=")
+        and os.path.basename(argument.rstrip("/")) == module
+        or argument == "--with-{}_module=dynamic".format(module)
+        for argument in defaults["configure_arguments"]
+    )
+
+
+def static_directives(found, defaults=None):
+    """
+    :param found: What's in the root, from `scan`
+    :type found: ```Scan```
+
+    :param defaults: Output of `get_nginx_defaults`: directives of modules nginx wasn't built with are left out
+    :type defaults: ```Optional[dict]```
+
+    :return: Directives to serve the root with, in crossplane's payload format
+    :rtype: ```List[dict]```
+    """
+
+    def directive(name, *args, **kwargs):
+        return dict({"directive": name, "args": list(args)}, **kwargs)
+
+    stmts = [
+        directive("sendfile", "on"),
+        directive("tcp_nopush", "on"),
+        directive(
+            "open_file_cache",
+            "max={}".format(min(max(found.files, 1000), _max_open_files)),
+            "inactive=60s",
+        ),
+        directive("open_file_cache_valid", "60s"),
+        directive("open_file_cache_errors", "on"),
+    ]
+    if found.gz and _static_module(defaults, "http_gzip_static"):
+        stmts += directive("gzip_static", "on"), directive("gzip_vary", "on")
+    if found.br and _static_module(defaults, "ngx_brotli"):
+        stmts.append(directive("brotli_static", "on"))
+    if found.large and has_module(defaults, "threads"):
+        stmts += directive("aio", "threads"), directive("directio", "4m")
+    elif found.large and has_module(defaults, "file-aio"):
+        stmts += directive("aio", "on"), directive("directio", "4m")
+    if found.fingerprinted:
+        # Names change with content, so the rest—e.g., index.html, which refers to them—must be revalidated.
+        # `expires` rather than `add_header`, which would stop the block inheriting the add_headers around it.
+        stmts += (
+            directive("expires", "epoch"),
+            directive(
+                "location",
+                "~*",
+                _fingerprint.format("|".join(sorted(found.fingerprinted))),
+                block=[directive("expires", "1y")],
+            ),
+        )
+    return stmts
+
+
+def apply_static(blocks, defaults=None):
+    """
+    Add `static_directives` to each server and location—of the server blocks—that has a `root` directory; those
+    of a name the block already has are left out, so what's given explicitly wins
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :param defaults: Output of `get_nginx_defaults`
+    :type defaults: ```Optional[dict]```
+
+    :return: Copies of `blocks`, with the directives added
+    :rtype: ```List[Directive]```
+    """
+    scans, copies = {}, []
+    for block in blocks:
+        block = Directive.from_crossplane(
+            block.to_crossplane() if isinstance(block, Directive) else block
+        )
+        copies.append(block)
+        if block.directive != "server":
+            continue
+        stack = [block]
+        while stack:
+            parent = stack.pop()
+            stack += (child for child in parent.block if child.block is not None)
+            root = next(
+                (child for child in parent.block if child.directive == "root"), None
+            )
+            if root is None or len(root.args) != 1 or not os.path.isdir(root.args[0]):
+                continue
+            if root.args[0] not in scans:
+                scans[root.args[0]] = scan(root.args[0])
+            present = frozenset(
+                (child.directive, child.args if child.block is not None else ())
+                for child in parent.block
+            )
+            parent.block += (
+                Directive.from_crossplane(dict(stmt, line=root.line))
+                for stmt in static_directives(scans[root.args[0]], defaults)
+                if (stmt["directive"], tuple(stmt["args"]) if "block" in stmt else ())
+                not in present
+            )
+    return copies
+
+
+__all__ = ["Scan", "apply_static", "scan", "static_directives", "walk"]
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+"""
+Keep nginx running as a child of nginxctl: restart it with backoff when it exits, reload it on request,
+and record how long that all takes in a metrics file
+"""
+
+import os
+import signal
+import socket
+import time
+from collections import OrderedDict
+from sys import modules
+
+from nginxctl import control, get_logger, snapshot
+from nginxctl.helpers import atomic_write
+from nginxctl.pkg_utils import PythonPackageInfo
+from nginxctl.serve import generate
+
+logger = get_logger(
+    ":".join((PythonPackageInfo().get_app_name(), modules[__name__].__name__))
+)
+
+metrics_filename = "nginxctl.metrics"
+
+
+def parse_listen(arg):
+    """
+    :param arg: First arg of a `listen` directive, e.g., "8080", "127.0.0.1:80", "[::]:443", "unix:/run/a.sock"
+    :type arg: ```str```
+
+    :return: (host, port) to connect to—wildcards replaced with loopback—or the path of a unix socket
+    :rtype: ```Union[Tuple[str, int], str]```
+    """
+    if arg.startswith("unix:"):
+        return arg[len("unix:") :]
+    host, sep, port = arg.rpartition(":")
+    if not sep or not port.isdigit():
+        host, port = ("", arg) if arg.isdigit() else (arg, "80")
+    host = host.strip("[]")
+    if host in ("", "*", "0.0.0.0"):
+        host = "127.0.0.1"
+    elif host == "::":
+        host = "::1"
+    return host, int(port)
+
+
+def listen_addresses(blocks):
+    """
+    :param blocks: Parsed blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```Iterable[Union[Directive, dict]]```
+
+    :return: Addresses of all `listen` directives, see `parse_listen`, without duplicates
+    :rtype: ```List[Union[Tuple[str, int], str]]```
+    """
+    addresses, stack = [], list(blocks)
+    while stack:
+        stmt = stack.pop()
+        if stmt["directive"] == "listen" and stmt["args"]:
+            address = parse_listen(stmt["args"][0])
+            if address not in addresses:
+                addresses.append(address)
+        stack.extend(stmt.get("block") or ())
+    return addresses
+
+
+def _accepts(address, timeout):
+    """Whether a connection to `address` is accepted"""
+    if isinstance(address, tuple):
+        family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+    else:
+        family = socket.AF_UNIX
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+        return True
+    except (socket.error, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+def wait_for_listen(addresses, timeout, process=None, interval=0.05):
+    """
+    Poll until every address accepts connections
+
+    :param addresses: See `listen_addresses`
+    :type addresses: ```List[Union[Tuple[str, int], str]]```
+
+    :param timeout: Seconds to give up after
+    :type timeout: ```float```
+
+    :param process: Give up if this process exits first
+    :type process: ```Optional[Popen]```
+
+    :param interval: Seconds between polls
+    :type interval: ```float```
+
+    :return: Seconds until all addresses accepted connections, None on timeout or if `process` exited
+    :rtype: ```Optional[float]```
+    """
+    start, pending = time.time(), list(addresses)
+    while True:
+        pending = [address for address in pending if not _accepts(address, interval)]
+        elapsed = time.time() - start
+        if not pending:
+            return elapsed
+        if elapsed > timeout or process is not None and process.poll() is not None:
+            return None
+        time.sleep(interval)
+
+
+class Supervisor(object):
+    """
+    Runs nginx, in the foreground, on the config `serve` generates for `blocks`; restarts it whenever it exits,
+    waiting `backoff` seconds—doubling on each consecutive crash up to `max_backoff`—and reloads it on request.
+
+    Metrics are rewritten to `metrics_file`, one `nginxctl_<name> <value>` line each, after every change:
+    `up`, `pid`, `starts_total`, `restarts_total`, `reloads_total`, `reload_failures_total`,
+    and the latest `config_compile_seconds`, `time_to_listen_seconds` and `reload_duration_seconds`.
+    """
+
+    def __init__(
+        self,
+        known,
+        nginx_command,
+        blocks,
+        metrics_file=None,
+        backoff=0.5,
+        max_backoff=30.0,
+        stable_after=10.0,
+        listen_timeout=30.0,
+        interval=0.1,
+    ):
+        """
+        :param known: Parsed CLI arguments, using `nginx` and `temp_dir`
+        :type known: ```Namespace```
+
+        :param nginx_command: Further arguments to nginx
+        :type nginx_command: ```List[str]```
+
+        :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+        :type blocks: ```List[Union[Directive, dict]]```
+
+        :param metrics_file: Where metrics are written, defaults to `metrics_filename` in temp_dir
+        :type metrics_file: ```Optional[str]```
+
+        :param backoff: Seconds before the first restart
+        :type backoff: ```float```
+
+        :param max_backoff: Most seconds between restarts
+        :type max_backoff: ```float```
+
+        :param stable_after: Seconds nginx must run for, for its exit not to count as a crash
+        :type stable_after: ```float```
+
+        :param listen_timeout: Seconds to wait for nginx to accept connections on its `listen` addresses
+        :type listen_timeout: ```float```
+
+        :param interval: Seconds between checks on the child and on requests to reload or stop
+        :type interval: ```float```
+        """
+        self.known, self.nginx_command, self.blocks = known, nginx_command, blocks
+        self.metrics_file = metrics_file or os.path.join(
+            known.temp_dir, metrics_filename
+        )
+        self.backoff, self.max_backoff, self.stable_after = (
+            backoff,
+            max_backoff,
+            stable_after,
+        )
+        self.listen_timeout, self.interval = listen_timeout, interval
+        self.child = None
+        self.nginx_conf = snapshot.current_path(known.temp_dir, "nginx.conf")
+        self.stopping, self._reload_blocks = False, None
+        self.metrics = OrderedDict(
+            (
+                ("up", 0),
+                ("pid", None),
+                ("starts_total", 0),
+                ("restarts_total", 0),
+                ("reloads_total", 0),
+                ("reload_failures_total", 0),
+                ("config_compile_seconds", None),
+                ("time_to_listen_seconds", None),
+                ("reload_duration_seconds", None),
+            )
+        )
+
+    def write_metrics(self):
+        try:
+            atomic_write(
+                self.metrics_file,
+                "".join(
+                    "nginxctl_{} {}\n".format(name, value)
+                    for name, value in self.metrics.items()
+                    if value is not None
+                ),
+            )
+        except (IOError, OSError) as e:
+            logger.warning("could not write metrics: {}".format(e))
+
+    def compile(self):
+        """
+        Generate the config, and snapshot it
+
+        :return: id of the snapshot
+        :rtype: ```str```
+        """
+        start = time.time()
+        snapshot_id = snapshot.snapshot_id(generate(self.known, self.blocks))
+        self.metrics["config_compile_seconds"] = time.time() - start
+        return snapshot_id
+
+    def publish(self, snapshot_id):
+        """Make the snapshot current"""
+        snapshot.publish(self.known.temp_dir, snapshot_id, snapshot.keep_of(self.known))
+
+    def start(self):
+        """Start nginx and wait for it to accept connections"""
+        self.child = control.start(
+            self.known.nginx, self.nginx_conf, self.nginx_command
+        )
+        self.started_at = time.time()
+        self.metrics["up"], self.metrics["pid"] = 1, self.child.pid
+        self.metrics["starts_total"] += 1
+        self.write_metrics()
+        addresses = listen_addresses(self.blocks)
+        if addresses:
+            time_to_listen = wait_for_listen(
+                addresses, self.listen_timeout, self.child, self.interval / 2
+            )
+            if time_to_listen is None:
+                logger.warning(
+                    "nginx isn't accepting connections on all of {!r}".format(addresses)
+                )
+            else:
+                self.metrics["time_to_listen_seconds"] = time_to_listen
+                self.write_metrics()
+
+    def reload(self):
+        """
+        Regenerate the config and—if its snapshot isn't current—validate it, make it current, then have nginx
+        reload it
+
+        :return: Whether nginx was reloaded
+        :rtype: ```bool```
+        """
+        start = time.time()
+        snapshot_id = self.compile()
+        if snapshot_id == snapshot.current(self.known.temp_dir):
+            return False
+        try:
+            control.validate(
+                self.known.nginx,
+                snapshot.snapshot_path(self.known.temp_dir, snapshot_id, "nginx.conf"),
+                self.nginx_command,
+            )
+        except EnvironmentError as e:
+            self.metrics["reload_failures_total"] += 1
+            self.write_metrics()
+            logger.error(e)
+            return False
+        self.publish(snapshot_id)
+        self.child.send_signal(signal.SIGHUP)
+        self.metrics["reload_duration_seconds"] = time.time() - start
+        self.metrics["reloads_total"] += 1
+        self.write_metrics()
+        return True
+
+    def request_reload(self, blocks=None):
+        """
+        Have `run` reload nginx, on new `blocks` if given. Safe to call from a signal handler or another thread.
+        """
+        self._reload_blocks = self.blocks if blocks is None else blocks
+
+    def stop(self):
+        """
+        Have `run` shut nginx down gracefully and return. Safe to call from a signal handler or another thread.
+        """
+        self.stopping = True
+
+    def _sleep(self, seconds):
+        """Sleep, waking early to stop"""
+        deadline = time.time() + seconds
+        while not self.stopping and time.time() < deadline:
+            time.sleep(min(self.interval, max(0, deadline - time.time())))
+
+    def run(self, max_restarts=None):
+        """
+        Supervise nginx until `stop` is called—or, if given, until it has been restarted `max_restarts` times
+
+        :param max_restarts: Return rather than restart nginx again after this many restarts
+        :type max_restarts: ```Optional[int]```
+
+        :return: nginx's exit status
+        :rtype: ```int```
+        """
+        self.publish(self.compile())
+        crashes = 0
+        while True:
+            self.start()
+            while self.child.poll() is None:
+                if self.stopping:
+                    self.child.send_signal(signal.SIGQUIT)
+                    self.child.wait()
+                    break
+                if self._reload_blocks is not None:
+                    self.blocks, self._reload_blocks = self._reload_blocks, None
+                    self.reload()
+                time.sleep(self.interval)
+            self.metrics["up"], self.metrics["pid"] = 0, None
+            self.write_metrics()
+            if self.stopping or (
+                max_restarts is not None
+                and self.metrics["restarts_total"] >= max_restarts
+            ):
+                return self.child.returncode
+
+            crashes = (
+                0 if time.time() - self.started_at >= self.stable_after else crashes + 1
+            )
+            delay = min(self.max_backoff, self.backoff * 2 ** max(crashes - 1, 0))
+            logger.warning(
+                "nginx exited with {}; restarting in {:.1f}s".format(
+                    self.child.returncode, delay
+                )
+            )
+            self._sleep(delay)
+            if self.stopping:
+                return self.child.returncode
+            self.metrics["restarts_total"] += 1
+            if self._reload_blocks is not None:
+                self.blocks, self._reload_blocks = self._reload_blocks, None
+                self.publish(self.compile())
+
+
+def supervise(known, nginx_command, blocks):
+    """
+    Supervise nginx until SIGINT or SIGTERM; SIGHUP regenerates the config and reloads nginx if it changed
+
+    :param known: Parsed CLI arguments, using `nginx`, `temp_dir` and `metrics`
+    :type known: ```Namespace```
+
+    :param nginx_command: Further arguments to nginx
+    :type nginx_command: ```List[str]```
+
+    :param blocks: Parsed top-level blocks, e.g., from `iter_cli_blocks`
+    :type blocks: ```List[Union[Directive, dict]]```
+
+    :return: nginx's exit status
+    :rtype: ```int```
+    """
+    supervisor = Supervisor(
+        known, nginx_command, blocks, getattr(known, "metrics", None)
+    )
+    for signum in signal.SIGINT, signal.SIGTERM:
+        signal.signal(signum, lambda *_: supervisor.stop())
+    signal.signal(signal.SIGHUP, lambda *_: supervisor.request_reload())
+    print(
+        "supervising nginx; metrics in {}. Reload with: kill -HUP {}".format(
+            supervisor.metrics_file, os.getpid()
+        )
+    )
+    return supervisor.run()
+
+
+__all__ = [
+    "Supervisor",
+    "listen_addresses",
+    "metrics_filename",
+    "parse_listen",
+    "supervise",
+    "wait_for_listen",
+]
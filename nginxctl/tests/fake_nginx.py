@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shell script stand-in for the nginx binary, for tests
+"""
+
+import os
+from os import path
+
+FAKE_NGINX = """#!/bin/sh
+echo "$@" >> "$0.log"
+case "$1" in
+  -V)
+    if [ -n "$FAKE_NGINX_BROKEN" ]; then
+      echo "nginx: $FAKE_NGINX_BROKEN" >&2
+      exit 1
+    fi
+    echo 'nginx version: nginx/{version}' >&2
+    echo 'built by fake' >&2
+    echo "configure arguments: {configure_arguments}" >&2
+    ;;
+  -t)
+    if [ -n "$FAKE_NGINX_DELAY" ]; then
+      sleep "$FAKE_NGINX_DELAY"
+    fi
+    if [ -n "$FAKE_NGINX_INVALID" ]; then
+      echo "nginx: [emerg] $FAKE_NGINX_INVALID" >&2
+      exit 1
+    fi
+    ;;
+esac
+{foreground}exit 0
+"""
+
+# Keeps the master—invoked as `nginx -c <conf>`—up until SIGQUIT/SIGTERM, logging signals it receives
+FOREGROUND = """if [ "$1" = -c ] && [ -z "$3" ]; then
+  trap 'echo SIGHUP >> "$0.log"' HUP
+  trap 'echo SIGQUIT >> "$0.log"; exit 0' QUIT
+  trap 'echo SIGTERM >> "$0.log"; exit 0' TERM
+  while :; do sleep 0.05; done
+fi
+"""
+
+DEFAULT_CONFIGURE_ARGUMENTS = (
+    "--prefix=/opt/fake/nginx --conf-path=/opt/fake/nginx/nginx.conf "
+    "--modules-path=/opt/fake/nginx/modules --with-threads --with-http_v2_module "
+    "--with-stream=dynamic --with-cc-opt='-g -O2 -fstack-protector' "
+    "--add-dynamic-module=/build/ngx_brotli"
+)
+
+
+def write_fake_nginx(
+    directory,
+    version="1.25.0",
+    configure_arguments=DEFAULT_CONFIGURE_ARGUMENTS,
+    foreground=False,
+):
+    """
+    Write an executable `nginx` into `directory`. Each invocation appends its arguments to `nginx.log` beside it.
+    `nginx -t` fails while the environment variable `FAKE_NGINX_INVALID` is set, with it as the error,
+    and takes `FAKE_NGINX_DELAY` seconds if that's set. `nginx -V` likewise fails while `FAKE_NGINX_BROKEN` is set.
+    With `foreground`, the master runs until stopped—logging the signals it gets—instead of exiting at once.
+
+    :return: Path to the fake nginx
+    :rtype: ```str```
+    """
+    nginx = path.join(directory, "nginx")
+    with open(nginx, "wt") as f:
+        f.write(
+            FAKE_NGINX.format(
+                version=version,
+                configure_arguments=configure_arguments,
+                foreground=FOREGROUND if foreground else "",
+            )
+        )
+    os.chmod(nginx, 0o755)
+    return nginx
+
+
+def read_fake_nginx_log(nginx):
+    """
+    :return: Arguments of each invocation of the fake nginx so far
+    :rtype: ```List[List[str]]```
+    """
+    log = "{}.log".format(nginx)
+    if not path.isfile(log):
+        return []
+    with open(log, "rt") as f:
+        return [line.split() for line in f.read().splitlines()]
+
+
+def set_environ(test_case, name, value):
+    """
+    Set—or, with None, unset—an environment variable for the rest of a test, restoring it once the test is done
+
+    :param test_case: The running test
+    :type test_case: ```TestCase```
+
+    :param name: Environment variable, e.g., "NGINXCTL_CACHE_DIR"
+    :type name: ```str```
+
+    :param value: Its value during the test; "" disables nginxctl's cache
+    :type value: ```Optional[str]```
+    """
+
+    def put(value):
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+    test_case.addCleanup(put, os.environ.get(name))
+    put(value)
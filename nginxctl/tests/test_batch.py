@@ -0,0 +1,67 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+from unittest import TestCase
+from unittest import main as unittest_main
+
+try:  # Python 2's takes the `str` nginxctl writes, as well as `unicode`
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from nginxctl.batch import batch, iter_records
+
+SITE = "-b server --server_name site{i}.example.com --listen 80 -b location / --root '/srv/site {i}' -}} -}}"
+
+EXPECTED = (
+    "server {{\n"
+    "    server_name site{i}.example.com;\n"
+    "    listen 80;\n"
+    "    location / {{\n"
+    "        root '/srv/site {i}';\n"
+    "    }}\n"
+    "}}"
+)
+
+
+class TestBatch(TestCase):
+    def test_formats(self):
+        expected = [
+            ["-b", "server", "--server_name", "a", "-}"],
+            ["-b", "server", "--server_name", "b c", "-}"],
+        ]
+        for fmt, content in (
+            (
+                "lines",
+                "-b server --server_name a -}\n\n# comment\n-b server --server_name 'b c' -}\n",
+            ),
+            (
+                "nul",
+                "-b server\n--server_name a -}\0-b server --server_name 'b c'\n-}\0",
+            ),
+            ("nul", "-b server --server_name a -}\0-b server --server_name 'b c' -}"),
+            ("jsonl", "\n".join(map(json.dumps, expected)) + "\n"),
+        ):
+            self.assertListEqual(
+                list(iter_records(StringIO(content), fmt, chunk_size=7)), expected
+            )
+        with self.assertRaises(ValueError):
+            list(iter_records(StringIO(""), "xml"))
+
+    def test_batch(self):
+        n = 5000
+        output = StringIO()
+        stats = batch(
+            StringIO("\n".join(SITE.format(i=i) for i in range(n))), output, "lines"
+        )
+        self.assertEqual(stats["records"], n)
+        self.assertEqual(stats["blocks"], n)
+        self.assertEqual(
+            output.getvalue(),
+            "\n".join(EXPECTED.format(i=i) for i in range(n)) + "\n",
+        )
+        self.assertLess(stats["seconds"], 10)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+from os import path
+from timeit import default_timer
+from unittest import TestCase, skipUnless
+from unittest import main as unittest_main
+
+import crossplane
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+try:  # Python 2's takes the `str` nginxctl writes, as well as `unicode`
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from nginxctl.builder import dump, iter_build
+from nginxctl.directive import from_crossplane
+from nginxctl.tests.test_serve import parse_blocks, server_cli
+
+NGINX_CONF = path.join(path.dirname(path.dirname(__file__)), "_config", "nginx.conf")
+
+
+class TestBuilder(TestCase):
+    def assertBuildsSame(self, payload, **kwargs):
+        self.assertEqual(
+            "".join(iter_build(payload, **kwargs)), crossplane.build(payload, **kwargs)
+        )
+
+    def test_same_as_crossplane(self):
+        parsed = crossplane.parse(NGINX_CONF, comments=True, single=True)
+        parsed = parsed["config"][0]["parsed"]
+        for kwargs in {}, {"indent": 2}, {"tabs": True}, {"header": True}:
+            self.assertBuildsSame(parsed, **kwargs)
+        self.assertBuildsSame(from_crossplane(parsed))
+        self.assertBuildsSame(parse_blocks(server_cli("example.com", "80") * 2))
+
+    def test_edge_cases(self):
+        self.assertBuildsSame([])
+        self.assertBuildsSame(
+            [
+                # Comments on the same line as what precedes them are inlined—also without line numbers
+                {"directive": "#", "args": [], "comment": " first"},
+                {"directive": "events", "args": [], "block": [], "line": 1},
+                {"directive": "#", "args": [], "comment": " after }", "line": 1},
+                {
+                    "directive": "http",
+                    "args": [],
+                    "line": 2,
+                    "block": [
+                        {"directive": "#", "args": [], "comment": " {", "line": 2},
+                        {
+                            "directive": "if",
+                            "args": ["$request_method", "=", "POST"],
+                            "line": 3,
+                            "block": [{"directive": "return", "args": ["405"]}],
+                        },
+                        {"directive": "add_header", "args": ["X-A", "a b;"]},
+                        {"directive": "set", "args": ["$x", "${y}z", ""]},
+                        {"directive": "log_format", "args": ["m", 'it\'s "q"']},
+                    ],
+                },
+            ]
+        )
+
+    def test_lazy(self):
+        def blocks():
+            for i in range(3):
+                yield {"directive": "upstream", "args": ["u{}".format(i)], "block": []}
+
+        pieces = iter_build(blocks())
+        self.assertEqual(next(pieces), "upstream u0 {")
+        self.assertEqual(
+            "upstream u0 {" + "".join(pieces),
+            crossplane.build(list(blocks())),
+        )
+
+    def test_dump(self):
+        parsed = crossplane.parse(NGINX_CONF, comments=True, single=True)
+        parsed = parsed["config"][0]["parsed"]
+        for buffer_size in 1, 100, 1 << 16:
+            output = StringIO()
+            self.assertEqual(
+                dump(parsed, output, buffer_size=buffer_size), len(output.getvalue())
+            )
+            self.assertEqual(output.getvalue(), crossplane.build(parsed))
+
+    @skipUnless(tracemalloc, "tracemalloc is Python 3.4+")
+    def test_benchmark_big_map(self):
+        n = 20000
+        payload = [
+            {
+                "directive": "map",
+                "args": ["$host", "$backend"],
+                "block": [
+                    {
+                        "directive": "host{}.example.com".format(i),
+                        "args": ["10.0.{}.{}:8080".format(i // 256 % 256, i % 256)],
+                    }
+                    for i in range(n)
+                ],
+            }
+        ]
+
+        class Sink(object):
+            def __init__(self):
+                self.written = []
+
+            def write(self, s):
+                self.written.append(len(s))
+
+        def measure(write):
+            sink = Sink()
+            start = default_timer()
+            write(sink)
+            seconds = default_timer() - start
+            tracemalloc.start()
+            write(Sink())
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return sink, seconds, peak
+
+        built, built_seconds, built_peak = measure(
+            lambda f: f.write(crossplane.build(payload) + os.linesep)
+        )
+        dumped, dumped_seconds, dumped_peak = measure(
+            lambda f: (dump(payload, f), f.write(os.linesep))
+        )
+        self.assertEqual(sum(dumped.written), sum(built.written))
+        # Buffered: bounded by the buffer, rather than twice the size of the output
+        self.assertLess(dumped_peak, built_peak / 4)
+        self.assertLess(dumped_seconds, 5)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl.defaults import get_nginx_defaults, has_module, parse_nginx_v
+from nginxctl.tests.fake_nginx import read_fake_nginx_log, set_environ, write_fake_nginx
+
+
+class TestDefaults(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", path.join(self.temp_dir, "cache"))
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_parse_nginx_v(self):
+        defaults = parse_nginx_v(
+            "nginx version: nginx/1.18.0 (Ubuntu)\n"
+            "built with OpenSSL 1.1.1f  31 Mar 2020\n"
+            "TLS SNI support enabled\n"
+            "configure arguments: --with-cc-opt='-g -O2' --prefix=/usr/share/nginx "
+            "--conf-path=/etc/nginx/nginx.conf --pid-path=/run/nginx.pid "
+            "--modules-path=/usr/lib/nginx/modules --with-openssl=/src/openssl "
+            "--with-http_ssl_module --with-stream=dynamic --without-http_gzip_module "
+            "--add-dynamic-module=/build/nginx/debian/modules/http-geoip2/\n"
+        )
+        self.assertEqual(defaults["version"], "1.18.0")
+        self.assertEqual(defaults["prefix"], "/usr/share/nginx")
+        self.assertEqual(defaults["conf_path"], "/etc/nginx/nginx.conf")
+        self.assertEqual(defaults["modules_path"], "/usr/lib/nginx/modules")
+        self.assertEqual(defaults["pid_path"], "/run/nginx.pid")
+        self.assertIsNone(defaults["sbin_path"])
+        self.assertListEqual(defaults["modules"], ["http_ssl", "stream", "http-geoip2"])
+        self.assertListEqual(defaults["without_modules"], ["http_gzip"])
+        self.assertEqual(defaults["configure_arguments"][0], "--with-cc-opt=-g -O2")
+
+    def test_parse_nginx_v_relative_paths(self):
+        defaults = parse_nginx_v(
+            "nginx version: nginx/1.25.0\nconfigure arguments: --prefix=/opt/nginx\n"
+        )
+        self.assertEqual(defaults["conf_path"], "/opt/nginx/conf/nginx.conf")
+        self.assertEqual(defaults["modules_path"], "/opt/nginx/modules")
+        self.assertListEqual(defaults["modules"], [])
+
+    def test_get_nginx_defaults_cached(self):
+        nginx = write_fake_nginx(self.temp_dir)
+        defaults = get_nginx_defaults(nginx)
+        self.assertEqual(defaults["nginx"], nginx)
+        self.assertEqual(defaults["version"], "1.25.0")
+        self.assertEqual(defaults["conf_path"], "/opt/fake/nginx/nginx.conf")
+        self.assertTrue(has_module(defaults, "stream"))
+        self.assertTrue(has_module(defaults, "ngx_brotli"))
+        self.assertFalse(has_module(defaults, "http_perl"))
+
+        self.assertDictEqual(get_nginx_defaults(nginx), defaults)
+        self.assertEqual(len(read_fake_nginx_log(nginx)), 1)
+
+        # Replacing the binary invalidates the cache
+        os.remove(nginx)
+        write_fake_nginx(self.temp_dir, version="1.27.10")
+        self.assertEqual(get_nginx_defaults(nginx)["version"], "1.27.10")
+
+    def test_get_nginx_defaults_missing(self):
+        self.assertIsNone(get_nginx_defaults(path.join(self.temp_dir, "nope")))
+        self.assertFalse(has_module(None, "stream"))
+
+    def test_get_nginx_defaults_broken(self):
+        nginx = write_fake_nginx(self.temp_dir)
+        os.environ["FAKE_NGINX_BROKEN"] = "error while loading shared libraries"
+        try:
+            self.assertIsNone(get_nginx_defaults(nginx))
+        finally:
+            del os.environ["FAKE_NGINX_BROKEN"]
+        # Not cached: once it works again, it's probed again
+        self.assertEqual(get_nginx_defaults(nginx)["version"], "1.25.0")
+        self.assertEqual(len(read_fake_nginx_log(nginx)), 2)
+
+
+if __name__ == "__main__":
+    unittest_main()
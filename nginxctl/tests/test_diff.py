@@ -0,0 +1,141 @@
+from __future__ import absolute_import, unicode_literals
+
+from copy import deepcopy
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+from nginxctl.diff import diff_blocks, diff_payloads
+from nginxctl.directive import Directive
+from nginxctl.merkle import Digests
+
+NGINX_CONF = """http {
+    # sites
+    upstream backend {
+        server 127.0.0.1:9000;
+    }
+    server {
+        listen 80;
+        server_name example.com;
+        location / {
+            root /srv;
+        }
+        location /api {
+            proxy_pass http://backend;
+            proxy_set_header Host $host;
+        }
+    }
+}
+"""
+
+
+class TestDiff(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def parse(self, conf, comments=False):
+        filename = path.join(self.temp_dir, "nginx.conf")
+        with open(filename, "wt") as f:
+            f.write(conf)
+        return crossplane.parse(filename, single=True, comments=comments)
+
+    def diff(self, old, new):
+        return [
+            str(change)
+            for change in diff_blocks(
+                self.parse(old)["config"][0]["parsed"],
+                self.parse(new)["config"][0]["parsed"],
+            )
+        ]
+
+    def test_same(self):
+        # Comments and line numbers don't count
+        old = self.parse(NGINX_CONF, comments=True)["config"][0]["parsed"]
+        new = self.parse(NGINX_CONF.replace("{\n", "{\n\n"))["config"][0]["parsed"]
+        self.assertListEqual(diff_blocks(old, new), [])
+        self.assertListEqual(
+            diff_blocks(old, list(map(Directive.from_crossplane, new))), []
+        )
+        digests = Digests()
+        self.assertEqual(digests.block(old), digests.block(new))
+
+    def test_changes(self):
+        new = (
+            NGINX_CONF.replace("root /srv;", "root /var/www;")
+            .replace("proxy_set_header Host $host;\n", "")
+            .replace(
+                "        server 127.0.0.1:9000;\n", "        server 127.0.0.1:9001;\n"
+            )
+            .replace("    }\n}", "    }\n    gzip on;\n}")
+        )
+        self.assertListEqual(
+            self.diff(NGINX_CONF, new),
+            [
+                "- http > upstream backend > server 127.0.0.1:9000",
+                "+ http > upstream backend > server 127.0.0.1:9001",
+                "~ http > server example.com 80 > location / > root",
+                "- http > server example.com 80 > location /api > proxy_set_header Host",
+                "+ http > gzip",
+            ],
+        )
+
+    def test_reordered(self):
+        location = "        location / {\n            root /srv;\n        }\n"
+        new = NGINX_CONF.replace(location, "").replace(
+            "        }\n    }\n}", "        }\n" + location + "    }\n}"
+        )
+        self.assertListEqual(
+            self.diff(NGINX_CONF, new), ["^ http > server example.com 80"]
+        )
+
+    def test_diff_payloads(self):
+        old = self.parse(NGINX_CONF)
+        new = deepcopy(old)
+        new["config"][0]["file"] = "other.conf"
+        diffs = diff_payloads(old, new)
+        self.assertListEqual(list(diffs), [old["config"][0]["file"], "other.conf"])
+        self.assertListEqual(list(map(str, diffs["other.conf"])), ["+ http"])
+        self.assertEqual(len(diff_payloads(old, deepcopy(old))), 0)
+
+    def test_benchmark_many_locations(self):
+        n = 20000
+        old = [
+            {
+                "directive": "server",
+                "args": [],
+                "block": [{"directive": "listen", "args": ["80"]}]
+                + [
+                    {
+                        "directive": "location",
+                        "args": ["/app{}".format(i)],
+                        "block": [
+                            {
+                                "directive": "proxy_pass",
+                                "args": ["http://10.0.0.1:{}".format(i)],
+                            }
+                        ],
+                    }
+                    for i in range(n)
+                ],
+            }
+        ]
+        new = deepcopy(old)
+        new[0]["block"][n // 2]["block"][0]["args"] = ["http://10.0.0.2"]
+        start = default_timer()
+        changes = diff_blocks(old, new)
+        elapsed = default_timer() - start
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].kind, "changed")
+        self.assertLess(elapsed, 5)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+from copy import deepcopy
+from os import path
+from unittest import TestCase, skipUnless
+from unittest import main as unittest_main
+
+import crossplane
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from nginxctl.directive import Directive, from_crossplane, to_crossplane
+from nginxctl.helpers import get_dict_by_key_val, is_directive
+from nginxctl.parser import parse_cli_config, parse_cli_directives
+
+NGINX_CONF = path.join(path.dirname(path.dirname(__file__)), "_config", "nginx.conf")
+
+
+def make_big_payload(n):
+    """crossplane-shaped `http { map … { … } }` with `n` entries in the map"""
+    return [
+        {
+            "directive": "http",
+            "line": 1,
+            "args": [],
+            "block": [
+                {
+                    "directive": "map",
+                    "line": 2,
+                    "args": ["$uri", "$new_uri"],
+                    "block": [
+                        {
+                            "directive": "/old/{}".format(i),
+                            "line": 3 + i,
+                            "args": ["/new/{}".format(i)],
+                        }
+                        for i in range(n)
+                    ],
+                }
+            ],
+        }
+    ]
+
+
+class TestDirective(TestCase):
+    def test_round_trip(self):
+        payload = crossplane.parse(NGINX_CONF, comments=True)["config"][0]["parsed"]
+        directives = from_crossplane(payload)
+        self.assertIsInstance(directives[0], Directive)
+        self.assertListEqual(to_crossplane(directives), payload)
+        self.assertEqual(crossplane.build(directives), crossplane.build(payload))
+
+    def test_mapping_interface(self):
+        directive = Directive("listen", ["80"], line=3)
+        self.assertEqual(directive["args"], ("80",))
+        self.assertIsNone(directive.get("block"))
+        self.assertEqual(directive.get("block", []), [])
+        self.assertIn("line", directive)
+        self.assertNotIn("block", directive)
+        with self.assertRaises(KeyError):
+            directive["includes"]
+        self.assertListEqual(sorted(directive.keys()), ["args", "directive", "line"])
+        self.assertTrue(is_directive(directive))
+        self.assertTrue(is_directive({"directive": "listen", "args": ["80"]}))
+        self.assertFalse(is_directive({"config": []}))
+
+    def test_cli(self):
+        argv = [
+            "-b",
+            "server",
+            "--listen",
+            "8080",
+            "-b",
+            "location",
+            "/",
+            "--root",
+            "/srv",
+            "-}",
+            "-}",
+        ]
+        server = parse_cli_directives(argv)
+        self.assertEqual(server.block[1].block[0], Directive("root", ["/srv"], line=5))
+        self.assertEqual(
+            get_dict_by_key_val(server, "directive", "root").args, ("/srv",)
+        )
+        self.assertEqual(
+            crossplane.build([server]), crossplane.build([parse_cli_config(argv)])
+        )
+
+
+@skipUnless(tracemalloc, "tracemalloc is Python 3.4+")
+class TestDirectiveMemory(TestCase):
+    """Memory of a 100k-directive tree as crossplane dicts versus as `Directive`s"""
+
+    n = 100000
+
+    def measure(self, make):
+        tracemalloc.start()
+        try:
+            tree = make()
+            return tracemalloc.get_traced_memory()[0], tree
+        finally:
+            tracemalloc.stop()
+
+    def test_memory(self):
+        payload = make_big_payload(self.n)
+        dict_bytes, dicts = self.measure(lambda: deepcopy(payload))
+        directive_bytes, directives = self.measure(lambda: from_crossplane(payload))
+        self.assertEqual(len(directives[0].block[0].block), self.n)
+        self.assertLess(directive_bytes, dict_bytes)
+
+
+if __name__ == "__main__":
+    unittest_main()
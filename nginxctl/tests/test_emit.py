@@ -0,0 +1,200 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from shutil import copy, rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+try:  # Python 2's takes the `str` nginxctl writes, as well as `unicode`
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from nginxctl.emit import check, dry_run, emit
+from nginxctl.parser import iter_cli_blocks
+from nginxctl.profiles import tune
+from nginxctl.serve import build_nginx_conf, shard
+from nginxctl.tests.test_profiles import HARDWARE
+from nginxctl.tests.test_serve import UPSTREAM_CLI, parse_blocks, server_cli
+
+TEMPLATE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "_config", "nginx.conf"
+)
+
+
+def write_file(filename, content):
+    with open(filename, "wt") as f:
+        f.write(content)
+
+
+def combined(directory):
+    """The config of `directory`'s nginx.conf and the files it includes, as one tree without files and lines"""
+    copy(os.path.join(os.path.dirname(TEMPLATE), "mime.types"), directory)
+    payload = crossplane.parse(
+        os.path.join(directory, "nginx.conf"), combine=True, check_ctx=False
+    )
+    stack = list(payload["config"][0]["parsed"])
+    while stack:
+        stmt = stack.pop()
+        stmt.pop("file", None)
+        stmt.pop("line", None)
+        stack += stmt.get("block", ())
+    return payload["config"][0]["parsed"]
+
+
+class TestEmit(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        self.cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        rmtree(self.temp_dir)
+
+    def test_emit(self):
+        blocks = parse_blocks(server_cli("example.com", "80") + UPSTREAM_CLI)
+        output = StringIO()
+        self.assertEqual(emit(iter(blocks), output), len(output.getvalue()))
+        self.assertEqual(output.getvalue(), crossplane.build(blocks) + os.linesep)
+
+        output = StringIO()
+        self.assertEqual(emit(iter(()), output), 0)
+        self.assertEqual(output.getvalue(), "")
+
+    def test_emit_many(self):
+        n = 10000
+        blocks = (
+            block
+            for i in range(n)
+            for _, block in iter_cli_blocks(
+                server_cli("site{}.example.com".format(i), "80")
+            )
+        )
+        output = StringIO()
+        emit(blocks, output)
+        self.assertEqual(output.getvalue().count("server {"), n)
+
+    def test_emit_tuned(self):
+        tuning = tune("throughput", HARDWARE)
+        blocks = parse_blocks(server_cli("example.com", "80") + UPSTREAM_CLI)
+        output = StringIO()
+        self.assertEqual(emit(iter(blocks), output, tuning), len(output.getvalue()))
+
+        # The config serve would write, which dry_run reports, with the files it includes inlined
+        report = StringIO()
+        self.assertListEqual(dry_run(blocks, report, tuning=tuning), [])
+        nginx_conf = build_nginx_conf(TEMPLATE, "sites-available", tuning=tuning)
+        self.assertEqual(
+            report.getvalue().splitlines()[0],
+            "nginx.conf\t{}".format(len(nginx_conf.encode("utf8"))),
+        )
+        os.makedirs(os.path.join("serve", "sites-available"))
+        os.mkdir("emit")
+        write_file(os.path.join("serve", "nginx.conf"), nginx_conf)
+        for filename, shard_blocks in shard(blocks).items():
+            write_file(
+                os.path.join("serve", "sites-available", filename),
+                crossplane.build(shard_blocks),
+            )
+        write_file(os.path.join("emit", "nginx.conf"), output.getvalue())
+        self.assertListEqual(combined("emit"), combined("serve"))
+        # Including the template's mime.types
+        self.assertEqual(combined("emit")[-1]["block"][0]["directive"], "types")
+
+        # The directives of events and http blocks go in the template's, rather than nesting in http
+        output = StringIO()
+        emit(
+            parse_blocks(
+                [
+                    "-b",
+                    "events",
+                    "--use",
+                    "epoll",
+                    "-}",
+                    "-b",
+                    "http",
+                    "--gzip_vary",
+                    "on",
+                    "-}",
+                ]
+            ),
+            output,
+            tuning,
+        )
+        config = output.getvalue()
+        self.assertEqual(config.count("events {"), 1)
+        self.assertEqual(config.count("http {"), 1)
+        self.assertIn("    use epoll;\n", config)
+        self.assertIn("    gzip_vary on;\n", config)
+
+    def test_check(self):
+        self.assertListEqual(
+            check(parse_blocks(server_cli("example.com", "80"))[0]), []
+        )
+        (http,) = parse_blocks(
+            [
+                "-b",
+                "http",
+                "--listen",
+                "80",
+                "-b",
+                "server",
+                "--root",
+                "/a",
+                "/b",
+                "-}",
+                "-}",
+            ]
+        )
+        self.assertListEqual(
+            check(http),
+            [
+                '"listen" directive is not allowed here in <cli>:2',
+                'invalid number of arguments in "root" directive in <cli>:5',
+            ],
+        )
+        self.assertEqual(len(check(http, strict=True)), 2)
+        (server,) = parse_blocks(["-b", "server", "--no_such", "x", "-}"])
+        self.assertListEqual(check(server), [])
+        self.assertListEqual(
+            check(server, strict=True), ['unknown directive "no_such" in <cli>:2']
+        )
+
+    def test_dry_run(self):
+        output = StringIO()
+        blocks = parse_blocks(server_cli("example.com", "80") + UPSTREAM_CLI)
+        self.assertListEqual(dry_run(blocks, output), [])
+        report = output.getvalue().splitlines()
+        self.assertListEqual(
+            [line.split("\t")[0] for line in report[:-1]],
+            ["example.com_80.conf", "upstream_backend.conf"],
+        )
+        self.assertEqual(
+            sum(int(line.split("\t")[1]) for line in report[:-1]),
+            sum(len(crossplane.build([block]) + os.linesep) for block in blocks),
+        )
+        self.assertTrue(report[-1].endswith(": ok"))
+
+        output = StringIO()
+        errors = dry_run(parse_blocks(["-b", "server", "--proxy_pass", "-}"]), output)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(output.getvalue().endswith("1 errors\n"))
+
+        self.assertListEqual(os.listdir(self.temp_dir), [])
+
+        output = StringIO()
+        self.assertListEqual(
+            dry_run(blocks, output, tuning=tune("latency", HARDWARE)), []
+        )
+        report = output.getvalue().splitlines()
+        self.assertEqual(report[0].split("\t")[0], "nginx.conf")
+        self.assertTrue(report[-1].startswith("3 files"))
+        self.assertListEqual(os.listdir(self.temp_dir), [])
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,111 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import time
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl import snapshot
+from nginxctl.fleet import apply, fleet, summarize
+from nginxctl.tests.fake_nginx import read_fake_nginx_log, set_environ, write_fake_nginx
+from nginxctl.tests.test_serve import parse_blocks, server_cli
+
+
+class TestFleet(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+        # Set by some of the tests
+        set_environ(self, "FAKE_NGINX_DELAY", None)
+        set_environ(self, "FAKE_NGINX_INVALID", None)
+        self.nginx = write_fake_nginx(self.temp_dir)
+        self.instances = [
+            path.join(self.temp_dir, "tenant{}".format(i)) for i in range(6)
+        ]
+        # Every other instance is running
+        for temp_dir in self.instances[::2]:
+            os.mkdir(temp_dir)
+            with open(path.join(temp_dir, "nginx.pid"), "wt") as f:
+                f.write("{}\n".format(os.getpid()))
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def apply(self, root="/srv", **kwargs):
+        blocks = parse_blocks(server_cli("localhost", "8080", root=root))
+        return apply(self.nginx, self.instances, blocks, **kwargs)
+
+    def calls(self, *args):
+        return sum(
+            1
+            for call in read_fake_nginx_log(self.nginx)
+            if call[: len(args)] == list(args)
+        )
+
+    def test_apply(self):
+        results = self.apply()
+        self.assertListEqual([result["temp_dir"] for result in results], self.instances)
+        self.assertListEqual(
+            [result["status"] for result in results], ["reloaded", "validated"] * 3
+        )
+        self.assertEqual(self.calls("-t"), 6)
+        self.assertEqual(
+            sum(
+                1
+                for call in read_fake_nginx_log(self.nginx)
+                if call[-2:] == ["-s", "reload"]
+            ),
+            3,
+        )
+        for result in results:
+            self.assertIsNone(result["error"])
+            self.assertGreaterEqual(result["total"], result["compile"] + result["test"])
+        self.assertTrue(
+            summarize(results, 1).endswith(
+                "6 instances in 1.000s: 3 reloaded, 3 validated"
+            )
+        )
+
+        published = list(map(snapshot.current, self.instances))
+        self.assertNotIn(None, published)
+
+        # Nothing changed: nothing to validate or reload
+        self.assertListEqual(
+            [result["status"] for result in self.apply()], ["unchanged"] * 6
+        )
+        self.assertEqual(self.calls("-t"), 6)
+
+        os.environ["FAKE_NGINX_INVALID"] = "unknown directive"
+        results = self.apply(root="/var/www")
+        self.assertListEqual([result["status"] for result in results], ["invalid"] * 6)
+        self.assertIn("unknown directive", results[0]["error"])
+        self.assertListEqual(list(map(snapshot.current, self.instances)), published)
+
+    def test_keep_none(self):
+        known = Namespace(nginx=self.nginx, concurrency=8, keep=0)
+        for root in "/srv", "/var/www":
+            blocks = parse_blocks(server_cli("localhost", "8080", root=root))
+            fleet(known, [], blocks, self.instances)
+        for temp_dir in self.instances:
+            self.assertListEqual(snapshot.history(temp_dir), [])
+            with self.assertRaises(EnvironmentError):
+                snapshot.rollback(temp_dir)
+
+    def test_bounded_concurrency(self):
+        os.environ["FAKE_NGINX_DELAY"] = "0.3"
+        start = time.time()
+        self.apply(concurrency=3, reload=False)
+        elapsed = time.time() - start
+        # 6 validations of 0.3s, 3 at a time: 2 rounds, rather than 6 in sequence or 1 all at once
+        self.assertGreaterEqual(elapsed, 0.6)
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(self.calls("-t"), 6)
+        self.assertEqual(self.calls("-c"), 0)
+
+
+if __name__ == "__main__":
+    unittest_main()
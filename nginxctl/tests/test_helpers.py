@@ -0,0 +1,142 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import random
+from os import path
+from shutil import rmtree
+from string import printable
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl.helpers import strings
+
+NGINX_USAGE = (
+    "Usage: nginx [-?hvVtTq] [-s signal] [-p prefix]\n"
+    "  -p prefix     : set prefix path (default: /etc/nginx/)\n"
+    "  -c filename   : set configuration file (default: /etc/nginx/nginx.conf)\n"
+)
+
+
+def legacy_strings(filename, minimum=4):
+    """The character-by-character implementation `strings` replaced; kept as a benchmark baseline"""
+    with io.open(filename, errors="ignore") as f:
+        result = ""
+        for c in f.read():
+            if c in printable:
+                result += c
+                continue
+            if len(result) >= minimum:
+                yield result
+            result = ""
+        if len(result) >= minimum:  # catch result at EOF
+            yield result
+
+
+class TestStrings(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def write(self, name, content):
+        filename = path.join(self.temp_dir, name)
+        with open(filename, "wb") as f:
+            f.write(content)
+        return filename
+
+    def test_runs_and_minimum(self):
+        filename = self.write("bin", b"\x00abc\x01abcd\x02\x03hello world\x7fxy")
+        self.assertListEqual(list(strings(filename)), ["abcd", "hello world"])
+        self.assertListEqual(
+            list(strings(filename, minimum=2)), ["abc", "abcd", "hello world", "xy"]
+        )
+
+    def test_run_spanning_chunks(self):
+        filename = self.write("bin", b"\x00" * 5 + b"a" * 23 + b"\x00" + b"b" * 7)
+        for chunk_size in 1, 2, 3, 7, 64:
+            self.assertListEqual(
+                list(strings(filename, chunk_size=chunk_size)), ["a" * 23, "b" * 7]
+            )
+
+    def test_needle(self):
+        filename = self.write(
+            "bin", b"\x00first\x00" + NGINX_USAGE.encode("ascii") + b"\x00last\x00"
+        )
+        self.assertEqual(
+            next(strings(filename, needle="set prefix path", chunk_size=16)),
+            NGINX_USAGE,
+        )
+        self.assertListEqual(list(strings(filename, needle="absent")), [])
+
+
+class TestStringsBenchmark(TestCase):
+    """
+    Compare `strings` against the character-by-character implementation it replaced,
+    on a fixture the size of a real nginx binary
+    """
+
+    size = 4 * 1024 * 1024
+
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        # Random bytes mapped so ~1 in 10 is non-printable; '\r' is left out
+        # because the legacy text-mode reader translates newlines
+        printable_bytes = printable.replace("\r", "").encode("ascii")
+        non_printable = bytes(
+            bytearray(c for c in range(0x80) if chr(c) not in printable)
+        )
+        table = bytes(
+            bytearray(
+                (
+                    non_printable[i % len(non_printable)]
+                    if i % 10 == 0
+                    else printable_bytes[i % len(printable_bytes)]
+                )
+                for i in range(256)
+            )
+        )
+        rand = random.Random(0)
+        data = bytearray(rand.getrandbits(8) for _ in range(256))
+        data = (bytes(data) * (self.size // len(data))).translate(table)
+        shuffled = bytearray(data)
+        rand.shuffle(shuffled)
+        split = len(shuffled) * 3 // 4
+        content = (
+            bytes(shuffled[:split])
+            + b"\x00"
+            + NGINX_USAGE.encode("ascii")
+            + b"\x00"
+            + bytes(shuffled[split:])
+        )
+        self.filename = path.join(self.temp_dir, "nginx")
+        with open(self.filename, "wb") as f:
+            f.write(content)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_benchmark(self):
+        start = default_timer()
+        legacy = list(legacy_strings(self.filename))
+        legacy_time = default_timer() - start
+
+        start = default_timer()
+        streamed = list(strings(self.filename))
+        streamed_time = default_timer() - start
+
+        start = default_timer()
+        found = next(strings(self.filename, needle="set prefix path"))
+        needle_time = default_timer() - start
+
+        self.assertListEqual(streamed, legacy)
+        self.assertEqual(found, NGINX_USAGE)
+        self.assertLess(streamed_time, legacy_time)
+        # Stops reading at the match
+        self.assertLess(needle_time, streamed_time)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,224 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+from nginxctl import loader
+
+NGINX_CONF = """user nginx;
+events {
+    worker_connections 1024;
+}
+http {
+    include conf.d/*.conf;
+    include sites-enabled/*;
+}
+"""
+
+UPSTREAM_CONF = """upstream backend{i} {{
+    server 10.0.{i}.1:8080;
+    server 10.0.{i}.2:8080;
+}}
+"""
+
+SITE_CONF = """# site {i}
+server {{
+    listen 80;
+    server_name site{i}.example.com;
+    include snippets/common.conf;
+    location / {{
+        proxy_pass http://backend{i};
+        proxy_set_header Host $host;
+    }}
+    location /static {{
+        root /srv/site{i};
+        if ($request_method = POST) {{
+            return 405;
+        }}
+    }}
+}}
+"""
+
+COMMON_CONF = """add_header X-Frame-Options DENY;
+gzip on;
+"""
+
+
+def write_tree(directory, sites):
+    """Write an nginx.conf including `sites` sites and as many upstreams, which all include one snippet"""
+    for subdirectory in "conf.d", "sites-enabled", "snippets":
+        os.mkdir(path.join(directory, subdirectory))
+    files = [
+        ("nginx.conf", NGINX_CONF),
+        (path.join("snippets", "common.conf"), COMMON_CONF),
+    ]
+    for i in range(sites):
+        files.append(
+            (
+                path.join("conf.d", "upstream{:04d}.conf".format(i)),
+                UPSTREAM_CONF.format(i=i),
+            )
+        )
+        files.append(
+            (path.join("sites-enabled", "site{:04d}".format(i)), SITE_CONF.format(i=i))
+        )
+    for filename, content in files:
+        with open(path.join(directory, filename), "wt") as f:
+            f.write(content)
+    return path.join(directory, "nginx.conf")
+
+
+class TestLoader(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_same_payload_as_crossplane(self):
+        nginx_conf = write_tree(self.temp_dir, 20)
+        for kwargs in {}, {"comments": True}, {"ignore": ("gzip",)}:
+            expected = crossplane.parse(nginx_conf, **kwargs)
+            self.assertEqual(expected["status"], "ok")
+            self.assertEqual(len(expected["config"]), 42)
+            for processes in 1, 2:
+                self.assertDictEqual(
+                    loader.parse(nginx_conf, processes=processes, **kwargs), expected
+                )
+
+    def test_pool(self):
+        nginx_conf = write_tree(self.temp_dir, 2)
+        parse_one = loader.parse_file
+        # No processes are started for a lone file
+        pool = loader._Pool(2)
+        self.assertListEqual(
+            list(pool.map(parse_one, [nginx_conf])), [parse_one(nginx_conf)]
+        )
+        self.assertIsNone(pool.executor)
+
+        filenames = [
+            path.join(self.temp_dir, "conf.d", "upstream{:04d}.conf".format(i))
+            for i in range(2)
+        ]
+        try:
+            self.assertListEqual(
+                list(pool.map(parse_one, filenames)), list(map(parse_one, filenames))
+            )
+            self.assertIsNotNone(pool.executor)
+        finally:
+            pool.shutdown()
+
+    def test_errors(self):
+        nginx_conf = write_tree(self.temp_dir, 2)
+        with open(path.join(self.temp_dir, "sites-enabled", "site0001"), "at") as f:
+            f.write("listen 80;\ninclude missing.conf;\nproxy_pass;\n")
+        with open(path.join(self.temp_dir, "conf.d", "broken.conf"), "wt") as f:
+            f.write("upstream broken {\n")
+
+        for catch_errors in True, False:
+            expected = crossplane.parse(nginx_conf, catch_errors=catch_errors)
+            self.assertEqual(expected["status"], "failed")
+            self.assertDictEqual(
+                loader.parse(nginx_conf, processes=2, catch_errors=catch_errors),
+                expected,
+            )
+
+    def test_cache(self):
+        nginx_conf = write_tree(self.temp_dir, 50)
+        cache_dir = path.join(self.temp_dir, "cache", loader.ParseCache.dirname)
+        expected = crossplane.parse(nginx_conf)
+
+        cache = loader.ParseCache(cache_dir)
+        self.assertDictEqual(loader.parse(nginx_conf, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 102))
+        cache.save()
+
+        # Backdate the tree, as if cached long after it was written
+        old = default_timer() - 3600
+        for root, _, filenames in os.walk(self.temp_dir):
+            for filename in filenames:
+                os.utime(path.join(root, filename), (old, old))
+        cache = loader.ParseCache(cache_dir)
+        self.assertDictEqual(loader.parse(nginx_conf, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (102, 0))
+        cache.save()
+
+        # A changed file, a new file in an include glob, and a touched file
+        site = path.join(self.temp_dir, "sites-enabled", "site0007")
+        with open(site, "at") as f:
+            f.write("server {\n    listen 81;\n}\n")
+        with open(path.join(self.temp_dir, "sites-enabled", "site9999"), "wt") as f:
+            f.write("server {\n    listen 82;\n}\n")
+        os.utime(path.join(self.temp_dir, "conf.d", "upstream0003.conf"), None)
+        expected = crossplane.parse(nginx_conf)
+        self.assertEqual(len(expected["config"]), 103)
+
+        cache = loader.ParseCache(cache_dir)
+        self.assertDictEqual(loader.parse(nginx_conf, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (101, 2))
+        self.assertEqual(cache.report(), "parse cache: 101 hits, 2 misses, 0 evicted")
+
+        # Least recently used entries are evicted, down to the size of the parses kept
+        cache.max_bytes = sum(
+            size for _, _, _, _, size in list(cache.entries.values())[-10:]
+        )
+        cache.save()
+        self.assertEqual(cache.evictions, 93)
+        self.assertEqual(len(os.listdir(cache_dir)), 10 + 1)  # and the index
+        cache = loader.ParseCache(cache_dir)
+        self.assertEqual(len(cache.entries), 10)
+        options = (), False
+        self.assertNotIn((nginx_conf, options), cache.entries)
+        self.assertIn(
+            (path.join(self.temp_dir, "sites-enabled", "site9999"), options),
+            cache.entries,
+        )
+        self.assertDictEqual(loader.parse(nginx_conf, cache=cache), expected)
+        self.assertEqual(cache.hits, 10)
+
+    def test_cache_trusted(self):
+        nginx_conf = write_tree(self.temp_dir, 2)
+        cache_dir = path.join(self.temp_dir, "cache", loader.ParseCache.dirname)
+        cache = loader.ParseCache(cache_dir)
+        loader.parse(nginx_conf, cache=cache)
+        cache.save()
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+        options = (), False
+        name = loader.ParseCache(cache_dir).entries[nginx_conf, options][3]
+
+        # Parses that another user could have written aren't unpickled
+        os.chmod(path.join(cache_dir, name), 0o666)
+        self.assertIsNone(loader.ParseCache(cache_dir).get(nginx_conf, options))
+        os.chmod(path.join(cache_dir, name), 0o644)
+        self.assertIsNotNone(loader.ParseCache(cache_dir).get(nginx_conf, options))
+        os.chmod(cache_dir, 0o777)
+        try:
+            self.assertIsNone(loader.ParseCache(cache_dir).get(nginx_conf, options))
+        finally:
+            os.chmod(cache_dir, 0o700)
+
+    def test_benchmark_serial_vs_parallel(self):
+        sites = 1500
+        nginx_conf = write_tree(self.temp_dir, sites)
+
+        timings = []
+        for processes in 1, None:
+            start = default_timer()
+            payload = loader.parse(nginx_conf, processes=processes)
+            timings.append(default_timer() - start)
+            self.assertEqual(len(payload["config"]), 2 + 2 * sites)
+            self.assertEqual(payload["status"], "ok")
+
+        self.assertDictEqual(crossplane.parse(nginx_conf), payload)
+        self.assertLess(max(timings), 10)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+import os
+import re
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+try:  # Python 2's takes the `str` nginxctl writes, as well as `unicode`
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from nginxctl import macros
+from nginxctl.batch import compile_records, iter_records
+from nginxctl.directive import Directive
+from nginxctl.macros import Macros, expand_template, load_macro
+from nginxctl.parser import iter_cli_blocks
+from nginxctl.serve import generate
+from nginxctl.tests.fake_nginx import set_environ, write_fake_nginx
+
+
+def proxy_cli(*proxy_args, **kwargs):
+    return (
+        [
+            "-b",
+            "server",
+            "--server_name",
+            kwargs.get("server_name", "example.com"),
+            "--listen",
+            "80",
+            "--proxy",
+        ]
+        + list(proxy_args)
+        + ["-}"]
+    )
+
+
+class TestMacros(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+        self.old_macro_path = os.environ.pop("NGINXCTL_MACRO_PATH", None)
+
+    def tearDown(self):
+        if self.old_macro_path is None:
+            os.environ.pop("NGINXCTL_MACRO_PATH", None)
+        else:
+            os.environ["NGINXCTL_MACRO_PATH"] = self.old_macro_path
+        rmtree(self.temp_dir)
+
+    def write_macro(self, name, definition):
+        filename = path.join(self.temp_dir, "{}.macro".format(name))
+        with open(filename, "wt") as f:
+            f.write(definition)
+        return filename
+
+    def test_proxy(self):
+        blocks = list(
+            iter_cli_blocks(
+                proxy_cli(
+                    "/api", "127.0.0.1:9000", "unix:/run/app.sock", "keepalive=64"
+                )
+            )
+        )
+        self.assertListEqual([context for context, _ in blocks], ["http", "server"])
+        upstream, server = (block for _, block in blocks)
+        name = upstream.args[0]
+        self.assertTrue(re.match(r"^backend_[0-9a-f]{8}$", name), name)
+        self.assertEqual(
+            crossplane.build([upstream]),
+            "upstream {} {{\n"
+            "    server 127.0.0.1:9000 max_fails=3 fail_timeout=10s;\n"
+            "    server unix:/run/app.sock max_fails=3 fail_timeout=10s;\n"
+            "    keepalive 64;\n"
+            "    keepalive_requests 1000;\n"
+            "    keepalive_timeout 60s;\n"
+            "}}".format(name),
+        )
+        location = server.block[2]
+        self.assertEqual(location.directive, "location")
+        self.assertTupleEqual(location.args, ("/api",))
+        self.assertEqual(location.line, server.block[1].line + 1)
+        settings = {
+            child.directive: child.args
+            for child in location.block
+            if child.directive != "proxy_set_header"
+        }
+        self.assertTupleEqual(settings["proxy_pass"], ("http://{}".format(name),))
+        self.assertTupleEqual(settings["proxy_http_version"], ("1.1",))
+        self.assertTupleEqual(settings["proxy_buffers"], ("8", "16k"))
+        self.assertIn(
+            ("Connection", ""),
+            [
+                child.args
+                for child in location.block
+                if child.directive == "proxy_set_header"
+            ],
+        )
+
+    def test_proxy_addresses(self):
+        for target, scheme, server in (
+            ("http://127.0.0.1:9000", "http", "127.0.0.1:9000"),
+            ("https://api.internal", "https", "api.internal"),
+            ("localhost", "http", "localhost"),
+        ):
+            upstream, server_block = (
+                block for _, block in iter_cli_blocks(proxy_cli("/api", target))
+            )
+            self.assertEqual(upstream.directive, "upstream")
+            self.assertTupleEqual(upstream.block[0].args[:1], (server,))
+            self.assertIn(
+                ("keepalive", ("32",)),
+                [(child.directive, child.args) for child in upstream.block],
+            )
+            self.assertTupleEqual(
+                server_block.block[2].block[0].args,
+                ("{}://{}".format(scheme, upstream.args[0]),),
+            )
+
+        # The same backend, with or without its scheme, shares an upstream
+        self.assertEqual(
+            list(iter_cli_blocks(proxy_cli("/", "http://127.0.0.1:9000")))[0][1].args,
+            list(iter_cli_blocks(proxy_cli("/", "127.0.0.1:9000")))[0][1].args,
+        )
+
+    def test_proxy_to_upstream(self):
+        blocks = list(
+            iter_cli_blocks(
+                [
+                    "-b",
+                    "server",
+                    "--upstream",
+                    "app",
+                    "10.0.0.1:80",
+                    "10.0.0.2:80",
+                    "method=least_conn",
+                    "--proxy",
+                    "/",
+                    "app",
+                    "scheme=https",
+                    "read_timeout=5s",
+                    "-}",
+                ]
+            )
+        )
+        self.assertListEqual([context for context, _ in blocks], ["http", "server"])
+        upstream, server = (block for _, block in blocks)
+        self.assertTupleEqual(upstream.args, ("app",))
+        self.assertListEqual(
+            [child.directive for child in upstream.block],
+            [
+                "least_conn",
+                "server",
+                "server",
+                "keepalive",
+                "keepalive_requests",
+                "keepalive_timeout",
+            ],
+        )
+        self.assertEqual(len(server.block), 1)
+        location = {child.directive: child.args for child in server.block[0].block}
+        self.assertTupleEqual(location["proxy_pass"], ("https://app",))
+        self.assertTupleEqual(location["proxy_read_timeout"], ("5s",))
+
+    def test_literal_upstream(self):
+        # An `upstream` block is nginx's own, not the macro
+        ((context, http),) = iter_cli_blocks(
+            [
+                "-b",
+                "http",
+                "-b",
+                "upstream",
+                "backend",
+                "--server",
+                "127.0.0.1:9000",
+                "-}",
+                "-}",
+            ]
+        )
+        self.assertEqual(context, "http")
+        self.assertEqual(
+            crossplane.build([http]),
+            "http {\n    upstream backend {\n        server 127.0.0.1:9000;\n    }\n}",
+        )
+
+    def test_shared_upstreams(self):
+        # The same backends, from two records of a batch, share one upstream
+        blocks, n = compile_records(
+            iter_records(
+                StringIO(
+                    "{}\n\n{}\n".format(
+                        " ".join(proxy_cli("/", "127.0.0.1:9000")),
+                        " ".join(
+                            proxy_cli("/", "127.0.0.1:9000", server_name="example.org")
+                        ),
+                    )
+                )
+            )
+        )
+        self.assertEqual(n, 2)
+        self.assertListEqual(
+            [block.directive for block in blocks], ["upstream", "server", "server"]
+        )
+
+        # …while two definitions of one upstream conflict
+        with self.assertRaises(argparse.ArgumentTypeError):
+            list(
+                iter_cli_blocks(
+                    [
+                        "-b",
+                        "server",
+                        "--upstream",
+                        "app",
+                        "10.0.0.1:80",
+                        "--upstream",
+                        "app",
+                        "10.0.0.2:80",
+                        "-}",
+                    ]
+                )
+            )
+
+    def test_invalid(self):
+        for argv in (
+            proxy_cli("/"),
+            proxy_cli("/", "127.0.0.1:9000", "keepalives=8"),
+            proxy_cli("/", "127.0.0.1:9000", "method=fastest"),
+            proxy_cli("/", "ftp://127.0.0.1:9000"),
+            proxy_cli("/", "http://127.0.0.1:9000/api"),
+            proxy_cli("/", "https://127.0.0.1:9000", "scheme=http"),
+        ):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                list(iter_cli_blocks(argv))
+
+    def test_generate(self):
+        known = Namespace(
+            nginx=write_fake_nginx(self.temp_dir),
+            temp_dir=path.join(self.temp_dir, "serve"),
+            profile=None,
+        )
+        generate(
+            known,
+            [block for _, block in iter_cli_blocks(proxy_cli("/", "127.0.0.1:9000"))],
+        )
+        sites_available = path.join(known.temp_dir, "sites-available")
+        upstream_conf = next(
+            filename
+            for filename in os.listdir(sites_available)
+            if filename.startswith("upstream_backend_")
+        )
+        payload = crossplane.parse(
+            path.join(sites_available, upstream_conf),
+            single=True,
+            catch_errors=False,
+            check_ctx=False,
+        )
+        self.assertEqual(payload["status"], "ok")
+
+    def test_macro_file(self):
+        self.write_macro(
+            "app",
+            "# --app LOCATION ROOT [upstream=backend]\n"
+            "--params location root upstream=backend\n"
+            "-b location {{location}}\n"
+            "    --root {{root}}\n"
+            "    --try_files $uri @{{upstream}}\n"
+            "-}\n"
+            "--proxy @{{upstream}} {{upstream}}\n"
+            "-b http\n"
+            "    -b map $http_upgrade $connection_upgrade\n"
+            "        --default upgrade\n"
+            "    -}\n"
+            "-}\n",
+        )
+        blocks = list(
+            iter_cli_blocks(
+                [
+                    "-b",
+                    "server",
+                    "--app",
+                    "/",
+                    "/srv/www",
+                    "--app",
+                    "/api",
+                    "/srv/api",
+                    "upstream=api",
+                    "-}",
+                ],
+                Macros(path=[self.temp_dir]),
+            )
+        )
+        self.assertListEqual([context for context, _ in blocks], ["http", "server"])
+        self.assertEqual(
+            crossplane.build([blocks[0][1]]),
+            "map $http_upgrade $connection_upgrade {\n    default upgrade;\n}",
+        )
+        server = blocks[1][1]
+        self.assertListEqual(
+            [(child.directive, child.args) for child in server.block],
+            [
+                ("location", ("/",)),
+                ("location", ("@backend",)),
+                ("location", ("/api",)),
+                ("location", ("@api",)),
+            ],
+        )
+        self.assertTupleEqual(server.block[0].block[0].args, ("/srv/www",))
+        self.assertTupleEqual(server.block[2].block[1].args, ("$uri", "@api"))
+        # The macros it expands to are expanded in turn
+        self.assertTupleEqual(server.block[1].block[0].args, ("http://backend",))
+
+        # Bundled macros are found too, user macros first
+        self.write_macro(
+            "websockets", "--params location target\n-b location {{location}}\n-}\n"
+        )
+        os.environ["NGINXCTL_MACRO_PATH"] = self.temp_dir
+        self.assertIsNone(parse_location(["/ws", "http://127.0.0.1:9000"]))
+        del os.environ["NGINXCTL_MACRO_PATH"]
+        location = parse_location(["/ws", "http://127.0.0.1:9000", "read_timeout=60s"])
+        self.assertIn(("proxy_read_timeout", ("60s",)), location)
+
+    def test_invalid_macro(self):
+        self.write_macro("loop", "-b location / --loop -}\n")
+        self.write_macro("unknown", "--params location\n--root {{root}}\n")
+        self.write_macro("one", "--params location\n--root {{location}}\n")
+        for argv in (
+            ["--loop"],
+            ["--unknown", "/"],
+            ["--one"],
+            ["--one", "/", "/srv"],
+        ):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                list(
+                    iter_cli_blocks(
+                        ["-b", "server"] + argv + ["-}"], Macros(path=[self.temp_dir])
+                    )
+                )
+
+    def test_cached(self):
+        os.environ["NGINXCTL_CACHE_DIR"] = path.join(self.temp_dir, "cache")
+        filename = self.write_macro(
+            "root",
+            "--params root=/srv\n-b location /static\n    --root {{root}}/static\n-}\n",
+        )
+        template = load_macro(filename)
+        self.assertEqual(len(os.listdir(os.environ["NGINXCTL_CACHE_DIR"])), 1)
+
+        # A new process compiles it from the cache
+        macros._templates.clear()
+        self.assertEqual(load_macro(filename), template)
+        self.assertEqual(len(os.listdir(os.environ["NGINXCTL_CACHE_DIR"])), 1)
+        (location,), _ = expand_template(
+            load_macro(filename), Directive("root", ("/var/www",))
+        )
+        self.assertEqual(
+            crossplane.build([location]),
+            "location /static {\n    root /var/www/static;\n}",
+        )
+
+        # Changing the file recompiles it
+        self.write_macro(
+            "root", "--params root=/var/www\n-b location /\n    --root {{root}}\n-}\n"
+        )
+        self.assertListEqual(load_macro(filename)["params"], [["root", "/var/www"]])
+
+    def test_benchmark_batch(self):
+        n = 5000
+        self.write_macro(
+            "site",
+            "--params name port root\n"
+            "--server_name {{name}}.example.com www.{{name}}.example.com\n"
+            "--listen {{port}}\n"
+            "-b location /\n    --root {{root}}/{{name}}\n    --expires 1h\n-}\n"
+            "--websockets /ws http://127.0.0.1:{{port}}\n",
+        )
+        stream = StringIO(
+            "".join(
+                "-b server --site s{} {} /srv -}}\n".format(i, 8000 + i % 100)
+                for i in range(n)
+            )
+        )
+        os.environ["NGINXCTL_MACRO_PATH"] = self.temp_dir
+        start = default_timer()
+        blocks, records = compile_records(iter_records(stream))
+        elapsed = default_timer() - start
+        self.assertEqual(records, n)
+        self.assertEqual(len(blocks), n)
+        self.assertEqual(blocks[-1].block[3].block[0].args, ("http://127.0.0.1:8099",))
+        self.assertLess(elapsed, 10)
+
+
+def parse_location(websockets_args):
+    ((_, server),) = iter_cli_blocks(
+        ["-b", "server", "--websockets"] + websockets_args + ["-}"]
+    )
+    location = server.block[0]
+    return [(child.directive, child.args) for child in location.block] or None
+
+
+if __name__ == "__main__":
+    unittest_main()
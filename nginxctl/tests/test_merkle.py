@@ -0,0 +1,160 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl.merkle import Digests
+from nginxctl.tests.fake_nginx import set_environ
+from nginxctl.upsert import context_path, directive_key, load
+
+NGINX_CONF = """http {
+    include sites/*.conf;
+    server {
+        listen 80;
+        server_name a.example.com;
+        location /static {
+            root /srv/static;
+            expires 1d;
+        }
+    }
+    server {
+        listen 80;
+        server_name b.example.com;
+        location /static {
+            # same as a's
+            root /srv/static;
+            expires 1d;
+        }
+    }
+}
+"""
+
+SITE_CONF = """server {
+    listen 8080;
+    server_name site.example.com;
+    root /srv/site;
+}
+"""
+
+A = context_path("http", ("server", ("a.example.com",), ("80",)))
+B = context_path("http", ("server", ("b.example.com",), ("80",)))
+SITE = context_path("http", ("server", ("site.example.com",), ("8080",)))
+
+
+class TestMerkle(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        os.mkdir(path.join(self.temp_dir, "sites"))
+        self.nginx_conf = path.join(self.temp_dir, "nginx.conf")
+        for filename, content in (self.nginx_conf, NGINX_CONF), (
+            path.join(self.temp_dir, "sites", "site.conf"),
+            SITE_CONF,
+        ):
+            with open(filename, "wt") as f:
+                f.write(content)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def assertConsistent(self, index):
+        fresh = Digests()
+        for node in index.nodes.values():
+            self.assertEqual(index.merkle(node), fresh(node))
+        for i, config in enumerate(index.payload["config"]):
+            self.assertEqual(index.merkle.file(i), fresh.block(config["parsed"]))
+
+    def test_digests(self):
+        index = load(self.nginx_conf)
+        location = ("location", ("/static",))
+        # Comments and line numbers don't count
+        self.assertEqual(index.digest(A + (location,)), index.digest(B + (location,)))
+        self.assertNotEqual(index.digest(A), index.digest(B))
+        duplicates = index.merkle.duplicates()
+        self.assertEqual(len(duplicates), 1)
+        self.assertListEqual(
+            duplicates[0], [index.get(A + (location,)), index.get(B + (location,))]
+        )
+
+    def test_incremental(self):
+        index = load(self.nginx_conf)
+        digests = {p: index.digest(p) for p in (A, B, SITE)}
+        files = list(map(index.merkle.file, range(2)))
+        root = index.digest(SITE + (("root",),))
+
+        index.upsert(A, {"directive": "root", "args": ["/srv/a"]})
+        self.assertNotEqual(index.digest(A), digests[A])
+        self.assertNotEqual(index.merkle.file(0), files[0])
+        # Untouched subtrees and files keep their memoized digests
+        self.assertIn(id(index.get(B)), index.merkle._digests)
+        self.assertEqual(index.digest(B), digests[B])
+        self.assertEqual(index.merkle.file(1), files[1])
+        self.assertConsistent(index)
+
+        index.upsert(SITE, {"directive": "root", "args": ["/srv/other"]})
+        index.upsert(
+            SITE,
+            {
+                "directive": "location",
+                "args": ["/"],
+                "block": [{"directive": "try_files", "args": ["$uri", "=404"]}],
+            },
+        )
+        index.upsert(
+            A,
+            {
+                "directive": "location",
+                "args": ["/static"],
+                "block": [{"directive": "root", "args": ["/srv/a/static"]}],
+            },
+            merge=False,
+        )
+        self.assertNotEqual(index.digest(SITE), digests[SITE])
+        self.assertNotEqual(index.merkle.file(1), files[1])
+        self.assertListEqual(index.merkle.duplicates(), [])
+        self.assertConsistent(index)
+
+        # Back as it was: the same digest as before
+        index.upsert(SITE, {"directive": "root", "args": ["/srv/site"]})
+        self.assertEqual(index.digest(SITE + (("root",),)), root)
+        self.assertConsistent(index)
+
+    def test_benchmark_incremental(self):
+        n = 5000
+        index = load(self.nginx_conf)
+        locations = [
+            {
+                "directive": "location",
+                "args": ["/app{}".format(i)],
+                "block": [{"directive": "proxy_pass", "args": ["http://10.0.0.1"]}],
+            }
+            for i in range(n)
+        ]
+        index.upsert_many((A, location) for location in locations)
+        start = default_timer()
+        index.digest(A)
+        hashed = default_timer() - start
+
+        # Each replace compares against a memoized digest, and rehashes only its ancestors when asked
+        for location in locations:
+            location["block"][0]["args"] = ["http://10.0.0.2"]
+        start = default_timer()
+        index.upsert_many((A, location) for location in locations)
+        digest = index.digest(A)
+        rehashed = default_timer() - start
+        start = default_timer()
+        for location in locations:
+            self.assertNotEqual(index.digest(A + (directive_key(location),)), digest)
+        compared = default_timer() - start
+
+        self.assertConsistent(index)
+        self.assertLess(hashed + rehashed + compared, 5)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -1,11 +1,14 @@
 from __future__ import absolute_import, unicode_literals
 
+import argparse
 import unittest
 from copy import deepcopy
 from functools import partial
+from io import StringIO
 from os import linesep, path
 from shutil import rmtree
 from tempfile import mkdtemp
+from timeit import default_timer
 from unittest import TestCase
 from unittest import main as unittest_main
 
@@ -14,7 +17,15 @@ from boltons.iterutils import remap
 from pkg_resources import resource_filename
 
 from nginxctl.helpers import del_keys_d, get_dict_by_key_val, update_directive, pp
-from nginxctl.parser import parse_cli_config
+from nginxctl.__main__ import _build_parser, _config_tokens
+from nginxctl.directive import Directive
+from nginxctl.parser import (
+    iter_cli_blocks,
+    iter_cli_tokens,
+    parse_args,
+    parse_cli_config,
+    parse_cli_directives,
+)
 from nginxctl.pkg_utils import PythonPackageInfo
 
 
@@ -206,5 +217,193 @@ class TestParser(TestCase, object):
         self.assertEqual(server_conf, crossplane.build([output]) + linesep)
 
 
+class TestCliParser(TestCase):
+    def test_parse_args(self):
+        self.assertListEqual(parse_args("a b"), ["a", "b"])
+        self.assertListEqual(parse_args(""), [""])
+        self.assertListEqual(parse_args("Connection ''"), ["Connection", ""])
+        self.assertListEqual(
+            parse_args("Connection 'Upgrade, close'"), ["Connection", "Upgrade, close"]
+        )
+        self.assertListEqual(parse_args("~* \\.(js|css)$"), ["~*", "\\.(js|css)$"])
+        self.assertListEqual(parse_args('"a \\" b" it\'s'), ['a " b', "it's"])
+
+    def test_blocks(self):
+        blocks = list(
+            iter_cli_blocks(
+                [
+                    "-b",
+                    "server",
+                    "--server_name",
+                    "example.com",
+                    "www.example.com",
+                    "--listen",
+                    "80",
+                    "--proxy_set_header",
+                    "Connection ''",
+                    "--location",
+                    "/",
+                    "-{",
+                    "--root",
+                    "/srv/my site",
+                    "-}",
+                    "-}",
+                    "-b",
+                    "upstream",
+                    "backend",
+                    "--server",
+                    "127.0.0.1:9000",
+                    "-}",
+                    "-b",
+                    "events",
+                    "-}",
+                ]
+            )
+        )
+        self.assertListEqual(
+            [context for context, _ in blocks], ["server", "http", "http"]
+        )
+        server = blocks[0][1]
+        self.assertTupleEqual(server.block[0].args, ("example.com", "www.example.com"))
+        self.assertTupleEqual(server.block[2].args, ("Connection", ""))
+        self.assertEqual(
+            server.block[3],
+            Directive(
+                "location", ["/"], [Directive("root", ["/srv/my site"], line=7)], 5
+            ),
+        )
+        self.assertEqual(
+            crossplane.build([block for _, block in blocks]),
+            "server {\n"
+            "    server_name example.com www.example.com;\n"
+            "    listen 80;\n"
+            "    proxy_set_header Connection '';\n"
+            "    location / {\n"
+            "        root '/srv/my site';\n"
+            "    }\n"
+            "}\n"
+            "upstream backend {\n"
+            "    server 127.0.0.1:9000;\n"
+            "}\n"
+            "events {\n"
+            "}",
+        )
+
+    def test_path_directives(self):
+        server = parse_cli_directives(
+            [
+                "-b",
+                "server",
+                "--include",
+                "/etc/nginx/my sites/*.conf",
+                "--ssl_certificate",
+                "/etc/ssl/my site.pem",
+                "--add_header",
+                "X-Frame-Options DENY",
+                "-}",
+            ]
+        )
+        self.assertListEqual(
+            [child.args for child in server.block],
+            [
+                ("/etc/nginx/my sites/*.conf",),
+                ("/etc/ssl/my site.pem",),
+                ("X-Frame-Options", "DENY"),
+            ],
+        )
+
+    def test_imbalanced(self):
+        for argv in (
+            ["-b", "server", "--listen", "80"],
+            ["-b", "server", "-}", "-}"],
+            ["--listen", "80"],
+            ["-b"],
+        ):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                list(iter_cli_blocks(argv))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_cli_directives(["-b", "server", "-}", "-b", "server", "-}"])
+
+    def test_token_file(self):
+        tokens = list(
+            iter_cli_tokens(
+                StringIO(
+                    "# a site\n"
+                    "-b server --server_name localhost\n"
+                    "  -b location '~ \\.php$' --fastcgi_pass 127.0.0.1:9000 -}\n"
+                    "-}\n"
+                )
+            )
+        )
+        self.assertListEqual(
+            tokens,
+            [
+                "-b",
+                "server",
+                "--server_name",
+                "localhost",
+                "-b",
+                "location",
+                "~ \\.php$",
+                "--fastcgi_pass",
+                "127.0.0.1:9000",
+                "-}",
+                "-}",
+            ],
+        )
+        self.assertTupleEqual(
+            parse_cli_directives(tokens).block[1].args, ("~", "\\.php$")
+        )
+
+    def test_config_tokens(self):
+        _, _, parser, _ = _build_parser()
+        self.assertListEqual(
+            list(
+                _config_tokens(
+                    [
+                        "--temp_dir",
+                        "/tmp",
+                        "-b",
+                        "server",
+                        "--server_name",
+                        "localhost",
+                        "-c",
+                        "/etc/nginx.conf",
+                        "--nginx=/usr/sbin/nginx",
+                        "-}",
+                    ],
+                    parser,
+                    keep=frozenset(
+                        ("block", "open_paren", "close_paren", "listen", "root")
+                    ),
+                )
+            ),
+            ["-b", "server", "--server_name", "localhost", "-}"],
+        )
+
+    def test_benchmark(self):
+        n_locations = 6250  # 8 tokens each
+        argv = ["-b", "server", "--server_name", "localhost", "--listen", "8080"]
+        for i in range(n_locations):
+            argv += [
+                "-b",
+                "location",
+                "/app{}".format(i),
+                "--proxy_pass",
+                "http://10.0.0.1:{}".format(i),
+                "--root",
+                "/srv",
+                "-}",
+            ]
+        argv.append("-}")
+
+        start = default_timer()
+        server = parse_cli_directives(argv)
+        elapsed = default_timer() - start
+
+        self.assertEqual(len(server.block), 2 + n_locations)
+        self.assertLess(elapsed, 2)
+
+
 if __name__ == "__main__":
     unittest_main()
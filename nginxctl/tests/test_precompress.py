@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import gzip
+import os
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl.precompress import available_encodings, iter_stale, precompress
+from nginxctl.tests.fake_nginx import set_environ
+
+TEXT = b"body { margin: 0; padding: 0; }\n" * 256
+
+
+class TestPrecompress(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", path.join(self.temp_dir, "cache"))
+        self.root = path.join(self.temp_dir, "www")
+        os.makedirs(path.join(self.root, "assets"))
+        for filename, content in (
+            ("index.html", TEXT),
+            ("assets/style.css", TEXT),
+            ("assets/random.js", os.urandom(4096)),
+            ("assets/small.js", b"x"),
+            ("assets/logo.png", TEXT),
+        ):
+            self.write(filename, content)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def write(self, filename, content):
+        with open(path.join(self.root, filename), "wb") as f:
+            f.write(content)
+
+    def run_precompress(self, **kwargs):
+        stats = precompress([self.root], processes=1, encodings=("gz",), **kwargs)
+        return {key: stats[key] for key in ("files", "compressed", "fresh", "skipped")}
+
+    def test_precompress(self):
+        self.assertDictEqual(
+            self.run_precompress(),
+            {"files": 3, "compressed": 2, "fresh": 0, "skipped": 1},
+        )
+        with gzip.open(path.join(self.root, "index.html.gz"), "rb") as f:
+            self.assertEqual(f.read(), TEXT)
+        for filename in "random.js.gz", "small.js.gz", "logo.png.gz":
+            self.assertFalse(path.exists(path.join(self.root, "assets", filename)))
+
+        # Incremental: nothing to do, not even for the file not worth compressing
+        self.assertDictEqual(
+            self.run_precompress(),
+            {"files": 3, "compressed": 0, "fresh": 2, "skipped": 1},
+        )
+
+        # A changed file is recompressed
+        self.write("index.html", TEXT * 2)
+        os.utime(path.join(self.root, "index.html"), (0, 2 << 31))
+        self.assertDictEqual(
+            self.run_precompress(),
+            {"files": 3, "compressed": 1, "fresh": 1, "skipped": 1},
+        )
+        with gzip.open(path.join(self.root, "index.html.gz"), "rb") as f:
+            self.assertEqual(f.read(), TEXT * 2)
+
+        # …and a stale sibling is removed once the file isn't worth compressing anymore
+        self.write("index.html", os.urandom(4096))
+        os.utime(path.join(self.root, "index.html"), (0, 3 << 31))
+        self.assertEqual(self.run_precompress()["skipped"], 2)
+        self.assertFalse(path.exists(path.join(self.root, "index.html.gz")))
+
+    def test_process_pool(self):
+        stats = precompress([self.root], processes=2)
+        self.assertEqual(stats["compressed"], 2)
+        self.assertGreater(stats["bytes_in"], stats["bytes_out"])
+        self.assertDictEqual(
+            {
+                path.basename(filename): stale
+                for filename, _, _, stale in iter_stale(
+                    self.root, available_encodings()
+                )
+            },
+            {
+                "index.html": (),
+                "style.css": (),
+                "random.js": available_encodings(),
+            },
+        )
+
+    def test_benchmark_incremental(self):
+        n = 2000
+        for i in range(n):
+            self.write("assets/{}.js".format(i), TEXT)
+        stats = precompress([self.root], processes=1, encodings=("gz",))
+        self.assertEqual(stats["compressed"], n + 2)
+        start = default_timer()
+        stats = precompress([self.root], processes=1, encodings=("gz",))
+        incremental = default_timer() - start
+        self.assertEqual(stats["fresh"], n + 2)
+        self.assertLess(incremental, 5)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,136 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+from nginxctl.profiles import detect, names, tune
+from nginxctl.serve import build_nginx_conf, generate
+from nginxctl.tests.fake_nginx import set_environ, write_fake_nginx
+from nginxctl.tests.test_serve import parse_blocks, server_cli
+
+TEMPLATE = path.join(path.dirname(path.dirname(__file__)), "_config", "nginx.conf")
+
+HARDWARE = {"cpus": 8, "nofile": 65536, "memory": 64 << 30}
+
+
+def settings(tuning):
+    return {
+        context: {stmt["directive"]: stmt["args"] for stmt in stmts}
+        for context, stmts in tuning.items()
+    }
+
+
+class TestProfiles(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_detect(self):
+        hardware = detect()
+        self.assertGreaterEqual(hardware["cpus"], 1)
+        self.assertTrue(hardware["nofile"] is None or hardware["nofile"] > 0)
+
+    def test_tune(self):
+        throughput, latency, low_memory = (
+            settings(tune(profile, HARDWARE)) for profile in names
+        )
+        self.assertListEqual(throughput["main"]["worker_processes"], ["8"])
+        self.assertListEqual(throughput["main"]["worker_rlimit_nofile"], ["65536"])
+        self.assertListEqual(throughput["events"]["worker_connections"], ["16384"])
+        self.assertListEqual(latency["events"]["worker_connections"], ["4096"])
+        self.assertListEqual(latency["http"]["tcp_nopush"], ["off"])
+        self.assertListEqual(low_memory["main"]["worker_processes"], ["1"])
+        self.assertListEqual(low_memory["http"]["open_file_cache"], ["off"])
+        self.assertListEqual(low_memory["http"]["gzip"], ["off"])
+
+        # Bounded by file descriptors, then by memory
+        few_fds = settings(tune("throughput", dict(HARDWARE, nofile=1024)))
+        self.assertListEqual(few_fds["events"]["worker_connections"], ["480"])
+        small = settings(tune("throughput", dict(HARDWARE, memory=256 << 20)))
+        self.assertListEqual(small["events"]["worker_connections"], ["128"])
+        unlimited = settings(tune("latency", dict(HARDWARE, nofile=None, memory=None)))
+        self.assertListEqual(unlimited["main"]["worker_rlimit_nofile"], ["1048576"])
+
+        # Instances sharing the machine each get their share of it
+        shared = settings(tune("throughput", HARDWARE, instances=40))
+        self.assertListEqual(shared["main"]["worker_processes"], ["1"])
+        self.assertListEqual(shared["main"]["worker_rlimit_nofile"], ["1638"])
+        self.assertListEqual(shared["events"]["worker_connections"], ["787"])
+        shared = settings(tune("throughput", dict(HARDWARE, nofile=None), instances=4))
+        self.assertListEqual(shared["main"]["worker_processes"], ["2"])
+        self.assertListEqual(shared["events"]["worker_connections"], ["16384"])
+        small = dict(HARDWARE, cpus=2, memory=1 << 30)
+        self.assertListEqual(
+            settings(tune("throughput", small))["events"]["worker_connections"],
+            ["2048"],
+        )
+        self.assertListEqual(
+            settings(tune("throughput", small, 4))["events"]["worker_connections"],
+            ["1024"],
+        )
+
+        with self.assertRaises(ValueError):
+            tune("fast", HARDWARE)
+
+    def test_build_nginx_conf(self):
+        conf = path.join(self.temp_dir, "nginx.conf")
+        with open(conf, "wt") as f:
+            f.write(
+                build_nginx_conf(
+                    TEMPLATE, "sites-available", tuning=tune("throughput", HARDWARE)
+                )
+            )
+        os.mkdir(path.join(self.temp_dir, "sites-available"))
+        with open(path.join(self.temp_dir, "mime.types"), "wt") as f:
+            f.write("types {}\n")
+        payload = crossplane.parse(conf, catch_errors=False)
+        self.assertEqual(payload["status"], "ok")
+        parsed = payload["config"][0]["parsed"]
+        main = [stmt["directive"] for stmt in parsed]
+        self.assertEqual(main.count("worker_processes"), 1)
+        self.assertLess(main.index("worker_rlimit_nofile"), main.index("events"))
+        tuned = settings(
+            {
+                stmt["directive"]: stmt["block"]
+                for stmt in parsed
+                if stmt.get("block") is not None
+            }
+        )
+        self.assertListEqual(tuned["events"]["worker_connections"], ["16384"])
+        self.assertListEqual(tuned["http"]["sendfile"], ["on"])
+        self.assertListEqual(tuned["http"]["open_file_cache_errors"], ["on"])
+
+    def test_generate(self):
+        known = Namespace(
+            nginx=write_fake_nginx(self.temp_dir),
+            temp_dir=path.join(self.temp_dir, "serve"),
+            profile="latency",
+        )
+        blocks = parse_blocks(server_cli("localhost", "8080"))
+        generate(known, blocks)
+        with open(path.join(known.temp_dir, "nginx.conf"), "rt") as f:
+            self.assertIn("tcp_nodelay on;", f.read())
+
+        # Changing the profile rebuilds nginx.conf
+        known.profile = "low-memory"
+        self.assertListEqual(generate(known, blocks).rebuilt, ["nginx.conf"])
+        with open(path.join(known.temp_dir, "nginx.conf"), "rt") as f:
+            self.assertIn("worker_processes 1;", f.read())
+        known.profile = None
+        self.assertListEqual(generate(known, blocks).rebuilt, ["nginx.conf"])
+        with open(path.join(known.temp_dir, "nginx.conf"), "rt") as f:
+            self.assertNotIn("open_file_cache", f.read())
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl.query import Query, query
+from nginxctl.tests.fake_nginx import set_environ
+from nginxctl.upsert import load
+
+NGINX_CONF = """events {
+    worker_connections 1024;
+}
+http {
+    root /srv;
+    include sites/*.conf;
+    server {
+        listen 80;
+        server_name main.example.com www.example.com;
+        location / {
+            root /srv/main;
+        }
+    }
+}
+"""
+
+SITE_CONF = """server {
+    listen 127.0.0.1:8080 default_server;
+    server_name site.example.com;
+    location / {
+        root /srv;
+    }
+    location /api {
+        proxy_pass http://127.0.0.1:9000;
+    }
+}
+"""
+
+
+class TestQuery(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        os.mkdir(path.join(self.temp_dir, "sites"))
+        self.nginx_conf = path.join(self.temp_dir, "nginx.conf")
+        self.site_conf = path.join(self.temp_dir, "sites", "site.conf")
+        for filename, content in (self.nginx_conf, NGINX_CONF), (
+            self.site_conf,
+            SITE_CONF,
+        ):
+            with open(filename, "wt") as f:
+                f.write(content)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def select(self, expression):
+        return list(map(str, query(self.nginx_conf, expression)))
+
+    def test_select(self):
+        site = "http > server site.example.com 127.0.0.1:8080"
+        main = "http > server main.example.com www.example.com 80"
+        self.assertListEqual(
+            self.select("proxy_pass"),
+            [
+                "{}:8\t{} > location /api > proxy_pass".format(self.site_conf, site),
+            ],
+        )
+        # Included servers are where their include is
+        self.assertListEqual(
+            self.select("http > server > location"),
+            [
+                "{}:4\t{} > location /".format(self.site_conf, site),
+                "{}:7\t{} > location /api".format(self.site_conf, site),
+                "{}:10\t{} > location /".format(self.nginx_conf, main),
+            ],
+        )
+        self.assertListEqual(
+            self.select("http > * > location"), self.select("http > server > location")
+        )
+        self.assertListEqual(
+            self.select("root=/srv"),
+            [
+                "{}:5\thttp > root".format(self.nginx_conf),
+                "{}:5\t{} > location / > root".format(self.site_conf, site),
+            ],
+        )
+        self.assertListEqual(
+            self.select("http > root=/srv"),
+            ["{}:5\thttp > root".format(self.nginx_conf)],
+        )
+        self.assertEqual(len(self.select("=/srv")), 2)
+        self.assertListEqual(
+            self.select("server_name=www.example.com"),
+            ["{}:7\t{}".format(self.nginx_conf, main)],
+        )
+        self.assertListEqual(
+            self.select("listen=127.0.0.1:8080"),
+            ["{}:1\t{}".format(self.site_conf, site)],
+        )
+        self.assertListEqual(self.select("gzip"), [])
+
+    def test_servers(self):
+        q = Query(load(self.nginx_conf).payload)
+        self.assertEqual(len(q.servers()), 2)
+        self.assertEqual(len(q.servers("site.example.com", "127.0.0.1:8080")), 1)
+        self.assertListEqual(q.servers("site.example.com", "80"), [])
+
+        # Indexes reflect the payload once invalidated
+        q.payload["config"][0]["parsed"][1]["block"].append(
+            {"directive": "gzip", "args": ["on"]}
+        )
+        self.assertListEqual(q.by_directive("gzip"), [])
+        q.invalidate()
+        self.assertEqual(len(q.by_directive("gzip")), 1)
+
+    def test_benchmark_many_servers(self):
+        n = 5000
+        with open(self.site_conf, "wt") as f:
+            for i in range(n):
+                f.write(
+                    "server {{\n    listen {};\n    server_name s{}.example.com;\n"
+                    "    location / {{\n        proxy_pass http://10.0.0.1:{};\n    }}\n}}\n".format(
+                        8000 + i % 100, i, i
+                    )
+                )
+        q = Query(load(self.nginx_conf).payload)
+        start = default_timer()
+        self.assertEqual(len(q.servers("s42.example.com")), 1)
+        self.assertEqual(len(q.select("http > server > location > proxy_pass")), n)
+        self.assertEqual(len(q.by_arg("http://10.0.0.1:42")), 1)
+        indexed = default_timer() - start
+        self.assertLess(indexed, 5)
+
+        start = default_timer()
+        for i in range(1000):
+            q.servers("s{}.example.com".format(i))
+            q.select("listen=8042")
+            q.by_directive("proxy_pass")
+        queried = (default_timer() - start) / 3000
+        self.assertLess(queried, 1e-3)
+
+
+if __name__ == "__main__":
+    unittest_main()
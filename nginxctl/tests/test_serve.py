@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sys
+import time
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from subprocess import Popen
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl import snapshot
+from nginxctl.directive import to_crossplane
+from nginxctl.parser import iter_cli_blocks
+from nginxctl.serve import serve, shard_name
+from nginxctl.tests.fake_nginx import read_fake_nginx_log, set_environ, write_fake_nginx
+
+
+def parse_blocks(cli):
+    return to_crossplane(block for _, block in iter_cli_blocks(cli))
+
+
+def server_cli(server_name, listen, root="/tmp/wwwroot"):
+    return [
+        "-b",
+        "server",
+        "--server_name",
+        server_name,
+        "--listen",
+        listen,
+        "-b",
+        "location",
+        "/",
+        "--root",
+        root,
+        "-}",
+        "-}",
+    ]
+
+
+UPSTREAM_CLI = ["-b", "upstream", "backend", "--server", "127.0.0.1:9000", "-}"]
+
+
+class TestServe(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+        self.known = Namespace(
+            nginx=write_fake_nginx(self.temp_dir),
+            temp_dir=path.join(self.temp_dir, "serve"),
+        )
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def serve(self, cli):
+        return serve(self.known, [], parse_blocks(cli))
+
+    def test_incremental(self):
+        server_conf = path.join("sites-available", "localhost_8080.conf")
+        manifest = self.serve(server_cli("localhost", "8080"))
+        self.assertListEqual(
+            manifest.rebuilt, ["mime.types", server_conf, "nginx.conf"]
+        )
+        self.assertListEqual(manifest.reused, [])
+        with open(path.join(self.known.temp_dir, "nginx.conf"), "rt") as f:
+            self.assertIn(
+                "include {};".format(path.join("sites-available", "*.conf")),
+                f.read(),
+            )
+        nginx_conf_mtime = path.getmtime(path.join(self.known.temp_dir, "nginx.conf"))
+
+        manifest = self.serve(server_cli("localhost", "8080"))
+        self.assertListEqual(manifest.rebuilt, [])
+        self.assertListEqual(manifest.reused, ["mime.types", server_conf, "nginx.conf"])
+        self.assertEqual(
+            path.getmtime(path.join(self.known.temp_dir, "nginx.conf")),
+            nginx_conf_mtime,
+        )
+
+        manifest = self.serve(server_cli("localhost", "8080", root="/srv"))
+        self.assertListEqual(manifest.rebuilt, [server_conf])
+        with open(path.join(self.known.temp_dir, server_conf), "rt") as f:
+            self.assertIn("root /srv;", f.read())
+
+        # A generated file that went missing is rebuilt
+        os.remove(path.join(self.known.temp_dir, "nginx.conf"))
+        self.assertListEqual(
+            self.serve(server_cli("localhost", "8080", root="/srv")).rebuilt,
+            ["nginx.conf"],
+        )
+
+        # One edited in place—same size, new mtime—is rebuilt; one only touched is hashed, and reused
+        filename = path.join(self.known.temp_dir, server_conf)
+        with open(filename, "rt") as f:
+            conf = f.read()
+        with open(filename, "wt") as f:
+            f.write(conf.replace("/srv", "/tmp"))
+        os.utime(filename, (0, 0))
+        manifest = self.serve(server_cli("localhost", "8080", root="/srv"))
+        self.assertListEqual(manifest.rebuilt, [server_conf])
+        os.utime(filename, (0, 0))
+        manifest = self.serve(server_cli("localhost", "8080", root="/srv"))
+        self.assertListEqual(manifest.rebuilt, [])
+        self.assertIn(server_conf, manifest.reused)
+
+    def test_sharding(self):
+        sites_available = path.join(self.known.temp_dir, "sites-available")
+        manifest = self.serve(
+            server_cli("example.com", "80")
+            + UPSTREAM_CLI
+            + server_cli("example.org", "127.0.0.1:8080")
+        )
+        shards = sorted(
+            (
+                "example.com_80.conf",
+                "upstream_backend.conf",
+                "example.org_127.0.0.1-8080.conf",
+            )
+        )
+        self.assertListEqual(sorted(os.listdir(sites_available)), shards)
+        self.assertEqual(len(manifest.rebuilt), 5)
+        with open(path.join(sites_available, "upstream_backend.conf"), "rt") as f:
+            self.assertEqual(
+                f.read(),
+                "upstream backend {{\n    server 127.0.0.1:9000;\n}}{}".format(
+                    os.linesep
+                ),
+            )
+
+        # Only the changed site is rewritten, and the dropped one is removed
+        manifest = self.serve(
+            server_cli("example.com", "80", root="/srv") + UPSTREAM_CLI
+        )
+        self.assertListEqual(
+            manifest.rebuilt, [path.join("sites-available", "example.com_80.conf")]
+        )
+        self.assertListEqual(
+            manifest.removed,
+            [path.join("sites-available", "example.org_127.0.0.1-8080.conf")],
+        )
+        self.assertListEqual(
+            sorted(os.listdir(sites_available)),
+            ["example.com_80.conf", "upstream_backend.conf"],
+        )
+
+    def nginx_calls(self, n):
+        """The first `n` invocations of the fake nginx, waiting for those started in the background"""
+        deadline = time.time() + 5
+        while len(read_fake_nginx_log(self.known.nginx)) < n and time.time() < deadline:
+            time.sleep(0.01)
+        return [
+            args for args in read_fake_nginx_log(self.known.nginx) if args[0] != "-V"
+        ]
+
+    def test_reload(self):
+        nginx_conf = snapshot.current_path(self.known.temp_dir, "nginx.conf")
+        pid_file = path.join(self.known.temp_dir, "nginx.pid")
+        self.serve(server_cli("localhost", "8080"))
+        start = ["-c", nginx_conf]
+        self.assertListEqual(self.nginx_calls(2), [start])
+        with open(nginx_conf, "rt") as f:
+            self.assertIn("pid {};".format(pid_file), f.read())
+
+        # The fake nginx doesn't run, so stand in for its master
+        with open(pid_file, "wt") as f:
+            f.write("{}\n".format(os.getpid()))
+
+        # Unchanged: nothing to do
+        first = snapshot.current(self.known.temp_dir)
+        self.serve(server_cli("localhost", "8080"))
+        self.assertListEqual(self.nginx_calls(2), [start])
+        self.assertEqual(snapshot.current(self.known.temp_dir), first)
+
+        # Changed: the new snapshot validated, made current, then reloaded
+        self.serve(server_cli("localhost", "8080", root="/srv"))
+        second = snapshot.current(self.known.temp_dir)
+        self.assertNotEqual(second, first)
+        reload = (
+            [
+                "-t",
+                "-q",
+                "-c",
+                snapshot.snapshot_path(self.known.temp_dir, second, "nginx.conf"),
+            ],
+            ["-c", nginx_conf, "-s", "reload"],
+        )
+        self.assertListEqual(self.nginx_calls(4), [start] + list(reload))
+
+        # Invalid: not made current, not reloaded
+        os.environ["FAKE_NGINX_INVALID"] = "unknown directive"
+        try:
+            with self.assertRaises(EnvironmentError) as e:
+                self.serve(server_cli("localhost", "8080", root="/var/www"))
+        finally:
+            del os.environ["FAKE_NGINX_INVALID"]
+        self.assertIn("unknown directive", str(e.exception))
+        calls = self.nginx_calls(5)
+        self.assertListEqual(calls[:3], [start] + list(reload))
+        self.assertEqual(len(calls), 4)
+        self.assertListEqual(calls[3][:3], ["-t", "-q", "-c"])
+        self.assertNotEqual(calls[3][3], reload[0][3])
+        self.assertEqual(snapshot.current(self.known.temp_dir), second)
+        self.assertListEqual(snapshot.history(self.known.temp_dir), [first, second])
+
+    def test_stale_pid_file(self):
+        process = Popen([sys.executable, "-c", ""])
+        process.wait()
+        os.mkdir(self.known.temp_dir)
+        with open(path.join(self.known.temp_dir, "nginx.pid"), "wt") as f:
+            f.write("{}\n".format(process.pid))
+        self.serve(server_cli("localhost", "8080"))
+        self.assertListEqual(
+            self.nginx_calls(2),
+            [["-c", snapshot.current_path(self.known.temp_dir, "nginx.conf")]],
+        )
+
+    def test_keep_none(self):
+        self.known.keep = 0
+        self.serve(server_cli("localhost", "8080"))
+        self.serve(server_cli("localhost", "8080", root="/srv"))
+        current = snapshot.current(self.known.temp_dir)
+        self.assertListEqual(snapshot.history(self.known.temp_dir), [])
+        self.assertListEqual(
+            sorted(
+                os.listdir(path.join(self.known.temp_dir, snapshot.snapshots_dirname))
+            ),
+            sorted((current, "history.json")),
+        )
+        with self.assertRaises(EnvironmentError):
+            snapshot.rollback(self.known.temp_dir)
+
+    def test_shard_name(self):
+        self.assertEqual(
+            shard_name(parse_blocks(["-b", "server", "--root", "/srv", "-}"])[0]),
+            "__default.conf",
+        )
+        self.assertEqual(
+            shard_name(
+                parse_blocks(["-b", "upstream", "$up/stream", "--server", "x", "-}"])[0]
+            ),
+            "upstream_-up-stream.conf",
+        )
+
+
+if __name__ == "__main__":
+    unittest_main()
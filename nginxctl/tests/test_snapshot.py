@@ -0,0 +1,131 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl import snapshot
+from nginxctl.serve import generate
+from nginxctl.tests.fake_nginx import set_environ, write_fake_nginx
+from nginxctl.tests.test_serve import parse_blocks, server_cli
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+        self.known = Namespace(
+            nginx=write_fake_nginx(self.temp_dir),
+            temp_dir=path.join(self.temp_dir, "serve"),
+        )
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def publish(self, root, keep=10):
+        snapshot_id = snapshot.snapshot_id(
+            generate(self.known, parse_blocks(server_cli("localhost", "8080", root)))
+        )
+        snapshot.publish(self.known.temp_dir, snapshot_id, keep)
+        return snapshot_id
+
+    def current_site(self):
+        with open(
+            snapshot.current_path(
+                self.known.temp_dir, "sites-available", "localhost_8080.conf"
+            ),
+            "rt",
+        ) as f:
+            return f.read()
+
+    def test_publish_and_rollback(self):
+        self.assertIsNone(snapshot.current(self.known.temp_dir))
+        ids = [self.publish(root) for root in ("/srv/a", "/srv/b", "/srv/c")]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(snapshot.current(self.known.temp_dir), ids[2])
+        self.assertListEqual(snapshot.history(self.known.temp_dir), ids)
+        self.assertIn("/srv/c", self.current_site())
+
+        # Republishing the current snapshot changes nothing
+        self.assertEqual(self.publish("/srv/c"), ids[2])
+        self.assertListEqual(snapshot.history(self.known.temp_dir), ids)
+
+        self.assertEqual(snapshot.rollback(self.known.temp_dir), ids[1])
+        self.assertIn("/srv/b", self.current_site())
+        self.assertEqual(snapshot.rollback(self.known.temp_dir), ids[0])
+        self.assertIn("/srv/a", self.current_site())
+        self.assertListEqual(snapshot.history(self.known.temp_dir), ids[:1])
+        with self.assertRaises(EnvironmentError):
+            snapshot.rollback(self.known.temp_dir)
+        self.assertEqual(snapshot.current(self.known.temp_dir), ids[0])
+
+        # Publishing a rolled back config again makes it the latest
+        self.publish("/srv/c")
+        self.assertListEqual(snapshot.history(self.known.temp_dir), [ids[0], ids[2]])
+
+    def test_unchanged_files_are_shared(self):
+        first, second = self.publish("/srv/a"), self.publish("/srv/b")
+
+        def inode(snapshot_id, relpath):
+            return os.stat(
+                snapshot.snapshot_path(self.known.temp_dir, snapshot_id, relpath)
+            ).st_ino
+
+        self.assertEqual(inode(first, "mime.types"), inode(second, "mime.types"))
+        site = path.join("sites-available", "localhost_8080.conf")
+        self.assertNotEqual(inode(first, site), inode(second, site))
+
+    def test_gc(self):
+        ids = [self.publish("/srv/{}".format(i), keep=2) for i in range(4)]
+        self.assertListEqual(snapshot.history(self.known.temp_dir), ids[2:])
+        self.assertListEqual(
+            sorted(
+                os.listdir(path.join(self.known.temp_dir, snapshot.snapshots_dirname))
+            ),
+            sorted(ids[2:] + ["history.json"]),
+        )
+
+        # The current snapshot survives, even when rolled back past `keep`
+        snapshot.rollback(self.known.temp_dir)
+        self.assertListEqual(snapshot.gc(self.known.temp_dir, keep=0), [ids[3]])
+        self.assertEqual(snapshot.current(self.known.temp_dir), ids[2])
+
+        # With none to keep, only the current one is left, and there's nothing to roll back to
+        ids = [self.publish("/srv/{}".format(i), keep=2) for i in range(4, 6)]
+        self.assertListEqual(snapshot.gc(self.known.temp_dir, keep=0), [ids[0]])
+        self.assertListEqual(snapshot.history(self.known.temp_dir), [])
+        self.assertEqual(snapshot.current(self.known.temp_dir), ids[1])
+        with self.assertRaises(EnvironmentError):
+            snapshot.rollback(self.known.temp_dir)
+
+    def test_crash_leftovers(self):
+        snapshot_id = self.publish("/srv/a")
+        snapshots = path.join(self.known.temp_dir, snapshot.snapshots_dirname)
+
+        # A half-made snapshot and symlink, as a crash mid-publish leaves them
+        staging = path.join(snapshots, ".{}.{}".format("0" * 16, os.getpid()))
+        os.mkdir(staging)
+        os.symlink(
+            path.join(snapshot.snapshots_dirname, "0" * 16),
+            path.join(self.known.temp_dir, ".current.{}".format(os.getpid())),
+        )
+        self.assertListEqual(snapshot.gc(self.known.temp_dir), [])
+        self.assertTrue(path.isdir(staging))
+
+        with self.assertRaises(EnvironmentError):
+            snapshot.switch(self.known.temp_dir, "0" * 16)
+        self.assertEqual(snapshot.current(self.known.temp_dir), snapshot_id)
+
+        other = self.publish("/srv/b")
+        self.assertEqual(snapshot.current(self.known.temp_dir), other)
+        self.assertTrue(
+            path.isfile(snapshot.current_path(self.known.temp_dir, "nginx.conf"))
+        )
+
+
+if __name__ == "__main__":
+    unittest_main()
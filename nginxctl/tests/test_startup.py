@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sys
+from os import path
+from shutil import rmtree
+from subprocess import PIPE, Popen
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl.tests.fake_nginx import write_fake_nginx
+
+
+class TestStartup(TestCase):
+    """
+    Startup-time budget for `python -m nginxctl`—`--help` and `dry_run`—cold (empty cache) and warm
+    """
+
+    cold_budget = 5.0
+    warm_budget = 2.0
+
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        self.cache_dir = path.join(self.temp_dir, "cache")
+        bin_dir = path.join(self.temp_dir, "bin")
+        os.mkdir(bin_dir)
+        write_fake_nginx(bin_dir)
+
+        self.env = dict(os.environ)
+        self.env.pop("GITHUB_ACTION", None)
+        self.env.update(
+            NGINXCTL_CACHE_DIR=self.cache_dir,
+            PATH=os.pathsep.join((bin_dir, self.env.get("PATH", ""))),
+            PYTHONPATH=path.dirname(path.dirname(path.dirname(__file__))),
+        )
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def run_nginxctl(self, *args):
+        start = default_timer()
+        process = Popen(
+            (sys.executable, "-m", "nginxctl") + args,
+            stdout=PIPE,
+            stderr=PIPE,
+            env=self.env,
+        )
+        stdout, stderr = process.communicate()
+        elapsed = default_timer() - start
+        self.assertEqual(process.returncode, 0, stderr)
+        return stdout.decode("utf8"), elapsed
+
+    def test_help_cold_and_warm(self):
+        stdout, cold = self.run_nginxctl("--help")
+        self.assertIn("/opt/fake/nginx", stdout)
+        self.assertTrue(
+            any(
+                name.startswith("nginx_defaults_")
+                for name in os.listdir(self.cache_dir)
+            )
+        )
+        self.assertLess(cold, self.cold_budget)
+
+        stdout, warm = self.run_nginxctl("--help")
+        self.assertIn("/opt/fake/nginx", stdout)
+        self.assertLess(warm, self.warm_budget)
+
+    def test_help_broken_nginx(self):
+        self.env["FAKE_NGINX_BROKEN"] = "error while loading shared libraries"
+        stdout, _ = self.run_nginxctl("--help")
+        self.assertIn("usage:", stdout)
+        self.assertNotIn("/opt/fake/nginx", stdout)
+
+    def test_dry_run_cold_and_warm(self):
+        args = (
+            "dry_run",
+            "-b",
+            "server",
+            "--server_name",
+            "example.com",
+            "--listen",
+            "80",
+            "-b",
+            "location",
+            "/",
+            "--root",
+            "/srv",
+            "-}",
+            "-}",
+        )
+        stdout, cold = self.run_nginxctl(*args)
+        self.assertIn("example.com_80.conf", stdout)
+        self.assertLess(cold, self.cold_budget)
+
+        stdout, warm = self.run_nginxctl(*args)
+        self.assertIn("example.com_80.conf", stdout)
+        self.assertLess(warm, self.warm_budget)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+from nginxctl.defaults import parse_nginx_v
+from nginxctl.serve import generate
+from nginxctl.static import Scan, apply_static, scan, static_directives
+from nginxctl.tests.fake_nginx import (
+    DEFAULT_CONFIGURE_ARGUMENTS,
+    set_environ,
+    write_fake_nginx,
+)
+from nginxctl.tests.test_serve import parse_blocks, server_cli
+
+CONFIGURE_ARGUMENTS = (
+    "--with-threads --with-http_gzip_static_module --add-module=/build/ngx_brotli"
+)
+
+
+def nginx_v(configure_arguments):
+    return parse_nginx_v(
+        "nginx version: nginx/1.25.0\nconfigure arguments: {}\n".format(
+            configure_arguments
+        )
+    )
+
+
+def settings(stmts):
+    return {stmt["directive"]: stmt["args"] for stmt in stmts if "block" not in stmt}
+
+
+class TestStatic(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+        self.root = path.join(self.temp_dir, "www")
+        os.makedirs(path.join(self.root, "assets", "fonts"))
+        for filename, size in (
+            ("index.html", 100),
+            ("index.html.gz", 60),
+            ("assets/app.3f2a9c41.js", 100),
+            ("assets/app.3f2a9c41.js.gz", 30),
+            ("assets/app.3f2a9c41.js.br", 25),
+            ("assets/style-0123456789abcdef.CSS", 100),
+            ("assets/logo.png", 100),
+            ("assets/fonts/video.mp4", 5 << 20),
+        ):
+            with open(path.join(self.root, filename), "wb") as f:
+                f.truncate(size)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_scan(self):
+        self.assertEqual(scan(self.root), Scan(5, 2, 1, frozenset(("js", "css")), 1))
+        self.assertEqual(
+            scan(path.join(self.temp_dir, "missing")), Scan(0, 0, 0, frozenset(), 0)
+        )
+
+    def test_static_directives(self):
+        found = scan(self.root)
+        stmts = static_directives(found, nginx_v(CONFIGURE_ARGUMENTS))
+        tuned = settings(stmts)
+        self.assertListEqual(tuned["open_file_cache"], ["max=1000", "inactive=60s"])
+        self.assertListEqual(tuned["gzip_static"], ["on"])
+        self.assertListEqual(tuned["brotli_static"], ["on"])
+        self.assertListEqual(tuned["aio"], ["threads"])
+        self.assertListEqual(tuned["expires"], ["epoch"])
+        self.assertEqual(
+            crossplane.build([stmts[-1]]),
+            "location ~* '[.-][0-9a-f]{8,}\\.(css|js)$' {\n    expires 1y;\n}",
+        )
+
+        # Only modules nginx has—and doesn't need to load—are used
+        tuned = settings(static_directives(found, nginx_v(DEFAULT_CONFIGURE_ARGUMENTS)))
+        self.assertNotIn("gzip_static", tuned)
+        self.assertNotIn("brotli_static", tuned)
+        self.assertListEqual(tuned["aio"], ["threads"])
+        tuned = settings(static_directives(Scan(10, 0, 0, frozenset(), 0)))
+        self.assertListEqual(
+            sorted(tuned),
+            [
+                "open_file_cache",
+                "open_file_cache_errors",
+                "open_file_cache_valid",
+                "sendfile",
+                "tcp_nopush",
+            ],
+        )
+
+    def test_apply_static(self):
+        blocks = parse_blocks(server_cli("localhost", "8080", self.root))
+        blocks[0]["block"][2]["block"].append(
+            {"directive": "sendfile", "args": ["off"]}
+        )
+        static = apply_static(blocks, nginx_v(CONFIGURE_ARGUMENTS))
+        location = static[0].block[2]
+        tuned = settings(child.to_crossplane() for child in location.block)
+        # What's given explicitly wins
+        self.assertListEqual(tuned["sendfile"], ["off"])
+        self.assertListEqual(tuned["gzip_static"], ["on"])
+        self.assertEqual(location.block[-1].directive, "location")
+        # The blocks given are left as they were
+        self.assertEqual(len(blocks[0]["block"][2]["block"]), 2)
+        self.assertEqual(apply_static(static, nginx_v(CONFIGURE_ARGUMENTS)), static)
+
+    def test_inherited_headers(self):
+        # add_header in a block would hide those of the blocks around it, so none is added
+        blocks = parse_blocks(server_cli("localhost", "8080", self.root))
+        blocks[0]["block"].insert(
+            0,
+            {
+                "directive": "add_header",
+                "args": ["Strict-Transport-Security", "max-age=31536000"],
+            },
+        )
+        (server,) = apply_static(blocks, nginx_v(CONFIGURE_ARGUMENTS))
+        stack, add_headers = [server], []
+        while stack:
+            block = stack.pop()
+            for child in block.block:
+                if child.directive == "add_header":
+                    add_headers.append((block.directive, child.args))
+                elif child.block is not None:
+                    stack.append(child)
+        self.assertListEqual(
+            add_headers,
+            [("server", ("Strict-Transport-Security", "max-age=31536000"))],
+        )
+
+    def test_generate(self):
+        known = Namespace(
+            nginx=write_fake_nginx(
+                self.temp_dir, configure_arguments=CONFIGURE_ARGUMENTS
+            ),
+            temp_dir=path.join(self.temp_dir, "serve"),
+            static=True,
+        )
+        blocks = parse_blocks(server_cli("localhost", "8080", self.root))
+        generate(known, blocks)
+        with open(
+            path.join(known.temp_dir, "sites-available", "localhost_8080.conf"), "rt"
+        ) as f:
+            conf = f.read()
+        self.assertIn("gzip_static on;", conf)
+        self.assertIn("expires 1y;", conf)
+
+        # Precompressing the rest changes nothing; new kinds of files do
+        with open(path.join(self.root, "assets", "logo.png.gz"), "wb"):
+            pass
+        self.assertListEqual(generate(known, blocks).rebuilt, [])
+        with open(path.join(self.root, "assets", "vendor.0123abcd.mjs"), "wb"):
+            pass
+        self.assertListEqual(
+            generate(known, blocks).rebuilt,
+            ["sites-available/localhost_8080.conf"],
+        )
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,173 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import socket
+import time
+from argparse import Namespace
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from nginxctl import snapshot
+from nginxctl.supervise import (
+    Supervisor,
+    listen_addresses,
+    parse_listen,
+    wait_for_listen,
+)
+from nginxctl.tests.fake_nginx import read_fake_nginx_log, set_environ, write_fake_nginx
+from nginxctl.tests.test_serve import parse_blocks, server_cli
+
+
+def read_metrics(metrics_file):
+    with open(metrics_file, "rt") as f:
+        return {
+            name[len("nginxctl_") :]: float(value)
+            for name, value in (line.split() for line in f)
+        }
+
+
+def eventually(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class TestSupervise(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        set_environ(self, "NGINXCTL_CACHE_DIR", "")
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        self.port = str(self.listener.getsockname()[1])
+
+    def tearDown(self):
+        self.listener.close()
+        rmtree(self.temp_dir)
+
+    def supervisor(self, foreground, **kwargs):
+        known = Namespace(
+            nginx=write_fake_nginx(self.temp_dir, foreground=foreground),
+            temp_dir=path.join(self.temp_dir, "supervise"),
+        )
+        return Supervisor(
+            known,
+            [],
+            parse_blocks(server_cli("localhost", "127.0.0.1:" + self.port)),
+            interval=0.01,
+            **kwargs
+        )
+
+    def test_parse_listen(self):
+        self.assertEqual(parse_listen("8080"), ("127.0.0.1", 8080))
+        self.assertEqual(parse_listen("*:80"), ("127.0.0.1", 80))
+        self.assertEqual(parse_listen("example.com"), ("example.com", 80))
+        self.assertEqual(parse_listen("[::]:443"), ("::1", 443))
+        self.assertEqual(parse_listen("[::1]"), ("::1", 80))
+        self.assertEqual(parse_listen("unix:/run/a.sock"), "/run/a.sock")
+        self.assertListEqual(
+            listen_addresses(
+                parse_blocks(server_cli("a", "80") + server_cli("b", "80"))
+            ),
+            [("127.0.0.1", 80)],
+        )
+
+    def test_wait_for_listen(self):
+        address = "127.0.0.1", int(self.port)
+        self.assertLess(wait_for_listen([address], 1), 1)
+        self.listener.close()
+        self.assertIsNone(wait_for_listen([address], 0.1, interval=0.01))
+
+    def test_restarts_with_backoff(self):
+        supervisor = self.supervisor(foreground=False, backoff=0.05, max_backoff=0.1)
+        start = time.time()
+        supervisor.run(max_restarts=3)
+        # Backoff doubles on each crash, up to max_backoff: 0.05 + 0.1 + 0.1
+        self.assertGreaterEqual(time.time() - start, 0.25)
+
+        starts = [
+            args
+            for args in read_fake_nginx_log(supervisor.known.nginx)
+            if args[0] == "-c"
+        ]
+        self.assertEqual(len(starts), 4)
+        metrics = read_metrics(supervisor.metrics_file)
+        self.assertEqual(metrics["restarts_total"], 3)
+        self.assertEqual(metrics["starts_total"], 4)
+        self.assertEqual(metrics["up"], 0)
+        self.assertNotIn("pid", metrics)
+        self.assertIn("config_compile_seconds", metrics)
+
+    def test_keep_none(self):
+        supervisor = self.supervisor(foreground=True)
+        supervisor.known.keep = 0
+        supervisor.publish(supervisor.compile())
+        supervisor.blocks = parse_blocks(
+            server_cli("localhost", "127.0.0.1:" + self.port, root="/srv")
+        )
+        supervisor.publish(supervisor.compile())
+        self.assertListEqual(snapshot.history(supervisor.known.temp_dir), [])
+        with self.assertRaises(EnvironmentError):
+            snapshot.rollback(supervisor.known.temp_dir)
+
+    def test_reload_and_stop(self):
+        supervisor = self.supervisor(foreground=True)
+        thread = Thread(target=supervisor.run)
+        thread.start()
+        try:
+            eventually(lambda: supervisor.metrics["time_to_listen_seconds"] is not None)
+            metrics = read_metrics(supervisor.metrics_file)
+            self.assertEqual(metrics["up"], 1)
+            self.assertEqual(metrics["pid"], supervisor.child.pid)
+            self.assertLess(metrics["time_to_listen_seconds"], 1)
+
+            # Unchanged config: no reload
+            supervisor.request_reload()
+            eventually(lambda: supervisor._reload_blocks is None)
+            self.assertEqual(supervisor.metrics["reloads_total"], 0)
+
+            supervisor.request_reload(
+                parse_blocks(
+                    server_cli("localhost", "127.0.0.1:" + self.port, root="/srv")
+                )
+            )
+            eventually(lambda: supervisor.metrics["reloads_total"] == 1)
+            eventually(
+                lambda: ["SIGHUP"] in read_fake_nginx_log(supervisor.known.nginx)
+            )
+        finally:
+            supervisor.stop()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+        log = read_fake_nginx_log(supervisor.known.nginx)
+        self.assertIn(
+            [
+                "-t",
+                "-q",
+                "-c",
+                snapshot.snapshot_path(
+                    supervisor.known.temp_dir,
+                    snapshot.current(supervisor.known.temp_dir),
+                    "nginx.conf",
+                ),
+            ],
+            log,
+        )
+        self.assertEqual(len(snapshot.history(supervisor.known.temp_dir)), 2)
+        self.assertEqual(log[-1], ["SIGQUIT"])
+        metrics = read_metrics(supervisor.metrics_file)
+        self.assertEqual(metrics["restarts_total"], 0)
+        self.assertEqual(metrics["reloads_total"], 1)
+        self.assertIn("reload_duration_seconds", metrics)
+        self.assertEqual(metrics["up"], 0)
+
+
+if __name__ == "__main__":
+    unittest_main()
@@ -0,0 +1,204 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from unittest import TestCase
+from unittest import main as unittest_main
+
+import crossplane
+
+from nginxctl.parser import parse_cli_config
+from nginxctl.tests.fake_nginx import set_environ
+from nginxctl.upsert import context_path, directive_key, load, upsert
+
+NGINX_CONF = """events {
+    worker_connections 1024;
+}
+http {
+    # sites
+    include sites/*.conf;
+    server {
+        listen 80;
+        server_name main.example.com;
+        root /srv/main;
+    }
+}
+"""
+
+SITE_CONF = """server {
+    listen 8080;
+    server_name site.example.com;
+    location / {
+        root /srv/site;
+    }
+}
+"""
+
+
+class TestUpsert(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp("nginxctl", self.__class__.__name__)
+        os.mkdir(path.join(self.temp_dir, "sites"))
+        self.nginx_conf = path.join(self.temp_dir, "nginx.conf")
+        self.site_conf = path.join(self.temp_dir, "sites", "site.conf")
+        for filename, content in (self.nginx_conf, NGINX_CONF), (
+            self.site_conf,
+            SITE_CONF,
+        ):
+            with open(filename, "wt") as f:
+                f.write(content)
+        set_environ(self, "NGINXCTL_CACHE_DIR", path.join(self.temp_dir, "cache"))
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def read(self, filename):
+        with open(filename, "rt") as f:
+            return f.read()
+
+    def test_directive_key(self):
+        server = crossplane.parse(self.site_conf, single=True, check_ctx=False)
+        server = server["config"][0]["parsed"][0]
+        self.assertTupleEqual(
+            directive_key(server), ("server", ("site.example.com",), ("8080",))
+        )
+        self.assertTupleEqual(directive_key(server["block"][2]), ("location", ("/",)))
+        self.assertTupleEqual(
+            directive_key({"directive": "proxy_set_header", "args": ["Host", "$host"]}),
+            ("proxy_set_header", ("Host",)),
+        )
+        self.assertTupleEqual(
+            directive_key({"directive": "root", "args": ["/srv"]}), ("root",)
+        )
+
+    def test_upsert_into_included_file(self):
+        site = parse_cli_config(
+            [
+                "-b",
+                "server",
+                "--server_name",
+                "site.example.com",
+                "--listen",
+                "8080",
+                "-b",
+                "location",
+                "/",
+                "--root",
+                "/srv/new",
+                "-}",
+                "-b",
+                "location",
+                "/api",
+                "--proxy_pass",
+                "http://127.0.0.1:9000",
+                "-}",
+                "-}",
+            ]
+        )
+        self.assertListEqual(upsert(("http",), site, self.nginx_conf), [self.site_conf])
+        self.assertEqual(self.read(self.nginx_conf), NGINX_CONF)
+        self.assertEqual(
+            self.read(self.site_conf),
+            SITE_CONF.replace("/srv/site", "/srv/new").replace(
+                "    }\n}",
+                "    }\n    location /api {\n        proxy_pass http://127.0.0.1:9000;\n    }\n}",
+            ),
+        )
+
+        # Upserting the same thing again is a no-op
+        self.assertListEqual(upsert(("http",), site, self.nginx_conf), [])
+
+    def test_upsert_new_server(self):
+        site = parse_cli_config(
+            ["-b", "server", "--server_name", "new.example.com", "--listen", "80", "-}"]
+        )
+        self.assertListEqual(
+            upsert(["http"], [site], self.nginx_conf), [self.nginx_conf]
+        )
+        self.assertEqual(self.read(self.site_conf), SITE_CONF)
+        nginx_conf = self.read(self.nginx_conf)
+        self.assertIn("    # sites\n", nginx_conf)
+        self.assertTrue(
+            nginx_conf.endswith(
+                "    server {\n        server_name new.example.com;\n        listen 80;\n    }\n}\n"
+            )
+        )
+
+    def test_replace_simple_directive(self):
+        index = load(self.nginx_conf)
+        server = context_path("http", ("server", ("main.example.com",), ("80",)))
+        self.assertEqual(index.get(server + (("root",),))["args"], ["/srv/main"])
+        index.upsert(server, {"directive": "root", "args": ["/srv/other"]})
+        index.upsert(server, {"directive": "listen", "args": ["443", "ssl"]})
+        self.assertListEqual(index.write(), [self.nginx_conf])
+        nginx_conf = self.read(self.nginx_conf)
+        self.assertIn("root /srv/other;", nginx_conf)
+        self.assertIn("listen 80;", nginx_conf)
+        self.assertIn("listen 443 ssl;", nginx_conf)
+
+        with self.assertRaises(TypeError):
+            index.upsert(server + (("root",),), {"directive": "root", "args": ["/"]})
+
+    def test_semantically_unchanged_is_not_written(self):
+        # The parsed include also records which files it included, the CLI's doesn't: still the same directive
+        index = load(self.nginx_conf)
+        index.upsert(
+            context_path("http"), {"directive": "include", "args": ["sites/*.conf"]}
+        )
+        index.upsert(
+            context_path("http"),
+            {
+                "directive": "server",
+                "args": [],
+                "block": [
+                    {"directive": "listen", "args": ["80"], "line": 1},
+                    {"directive": "server_name", "args": ["main.example.com"]},
+                    {"directive": "root", "args": ["/srv/main"]},
+                ],
+            },
+            merge=False,
+        )
+        self.assertListEqual(index.write(), [])
+
+    def test_benchmark_many_locations(self):
+        n = 5000
+        index = load(self.nginx_conf)
+        server = context_path("http", ("server", ("main.example.com",), ("80",)))
+        locations = [
+            {
+                "directive": "location",
+                "args": ["/app{}".format(i)],
+                "block": [
+                    {
+                        "directive": "proxy_pass",
+                        "args": ["http://10.0.0.1:{}".format(i)],
+                    }
+                ],
+            }
+            for i in range(n)
+        ]
+        start = default_timer()
+        index.upsert_many((server, location) for location in locations)
+        inserted = default_timer() - start
+
+        for location in locations:
+            location["block"][0]["args"] = ["http://10.0.0.2"]
+        start = default_timer()
+        index.upsert_many((server, location) for location in locations)
+        replaced = default_timer() - start
+
+        self.assertEqual(
+            len(index.get(server)["block"]), 3 + n
+        )  # listen, server_name, root
+        self.assertEqual(
+            index.get(server + (("location", ("/app42",)), ("proxy_pass",)))["args"],
+            ["http://10.0.0.2"],
+        )
+        self.assertLess(inserted + replaced, 5)
+
+
+if __name__ == "__main__":
+    unittest_main()
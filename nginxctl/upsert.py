@@ -1,2 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""
+Insert-or-replace directives in an existing nginx config, through an index built once over the parsed tree
+"""
+
+import os
+from copy import deepcopy
+
+from nginxctl import loader
+from nginxctl.builder import dump
+from nginxctl.directive import Directive
+from nginxctl.helpers import atomic_writer, string_types
+from nginxctl.merkle import Digests, MerkleIndex
+
+# Directives that may appear more than once in a block, identified by their first arg
+REPEATABLE_BY_FIRST_ARG = frozenset(
+    (
+        "add_header",
+        "env",
+        "error_page",
+        "fastcgi_param",
+        "grpc_set_header",
+        "include",
+        "listen",
+        "load_module",
+        "proxy_set_header",
+        "scgi_param",
+        "server",  # in upstream
+        "set",
+        "uwsgi_param",
+    )
+)
+
+# Directives that may appear more than once in a block, identified by all their args
+REPEATABLE_BY_ARGS = frozenset(("allow", "deny", "rewrite", "ssl_certificate"))
+
+
+def directive_key(stmt):
+    """
+    Identity of a directive among its siblings. Servers are identified by their server_name and listen
+    directives; other blocks (location, upstream, if, &etc.) by name and args.
+    Repeatable directives are identified by name and (first) args; all others by name alone, so upserting
+    them replaces the existing one.
+
+    :param stmt: A directive, as in crossplane's payload
+    :type stmt: ```Union[dict, Directive]```
+
+    :return: Hashable key
+    :rtype: ```tuple```
+    """
+    directive, args = stmt["directive"], tuple(stmt.get("args") or ())
+    if stmt.get("block") is not None:
+        if directive == "server":
+            children = stmt["block"]
+            return (
+                directive,
+                tuple(
+                    name
+                    for child in children
+                    if child["directive"] == "server_name"
+                    for name in child["args"]
+                ),
+                tuple(
+                    child["args"][0]
+                    for child in children
+                    if child["directive"] == "listen" and child["args"]
+                ),
+            )
+        return directive, args
+    elif directive in REPEATABLE_BY_FIRST_ARG:
+        return directive, args[:1]
+    elif directive in REPEATABLE_BY_ARGS:
+        return directive, args
+    return (directive,)
+
+
+def context_path(*contexts):
+    """
+    :param contexts: Directive names of blocks without args (e.g., "http"), keys from `directive_key`, or directives
+    :type contexts: ```Union[str, tuple, dict]```
+
+    :return: Path of directive keys, as used by `ConfigIndex`
+    :rtype: ```tuple```
+    """
+    return tuple(
+        (
+            (context, ())
+            if isinstance(context, string_types)
+            else (
+                directive_key(context)
+                if isinstance(context, (dict, Directive))
+                else tuple(context)
+            )
+        )
+        for context in contexts
+    )
+
+
+class ConfigIndex(object):
+    """
+    Index from context path—the keys of the enclosing blocks followed by the directive's own key—to each directive
+    of a crossplane payload. Included files are indexed under the context of their include, so paths are logical
+    (http > server > location) regardless of which file a directive lives in.
+    """
+
+    def __init__(self, payload):
+        """
+        :param payload: Output of `crossplane.parse`
+        :type payload: ```dict```
+        """
+        self.payload = payload
+        self.nodes, self.files, self.dirty = {}, {}, set()
+        self._index_block(payload["config"][0]["parsed"], (), 0, frozenset())
+        self.merkle = MerkleIndex(payload)
+
+    def _index_block(self, block, path, file_index, seen):
+        self.files[path] = self.files.get(path, file_index)
+        for stmt in block:
+            if stmt["directive"] == "#":
+                continue
+            if stmt.get("includes"):
+                for index in stmt["includes"]:
+                    if index not in seen:  # include cycles
+                        self._index_block(
+                            self.payload["config"][index]["parsed"],
+                            path,
+                            index,
+                            seen | {index},
+                        )
+            stmt_path = path + (directive_key(stmt),)
+            self.nodes.setdefault(stmt_path, stmt)
+            self.files.setdefault(stmt_path, file_index)
+            if stmt.get("block") is not None:
+                self._index_block(stmt["block"], stmt_path, file_index, seen)
+
+    def _unindex_block(self, block, path):
+        for stmt in block:
+            if stmt["directive"] == "#":
+                continue
+            stmt_path = path + (directive_key(stmt),)
+            if self.nodes.get(stmt_path) is stmt:
+                del self.nodes[stmt_path], self.files[stmt_path]
+            if stmt.get("block") is not None:
+                self._unindex_block(stmt["block"], stmt_path)
+
+    def _children(self, path):
+        """The list new children of the block at `path` are appended to"""
+        if path == ():
+            return self.payload["config"][0]["parsed"]
+        return self.nodes[path]["block"]
+
+    def get(self, path):
+        """
+        :param path: Context path of a directive, see `context_path`
+        :type path: ```tuple```
+
+        :return: The directive, if present
+        :rtype: ```Optional[dict]```
+        """
+        return self.nodes.get(path)
+
+    def digest(self, path):
+        """
+        :param path: Context path of a directive, see `context_path`
+        :type path: ```tuple```
+
+        :return: Structural hash of the directive and its block, see `merkle.MerkleIndex`; kept up to date by
+          upserts, so comparing two is O(1)
+        :rtype: ```str```
+        """
+        return self.merkle(self.nodes[path])
+
+    def upsert(self, parent_path, stmt, merge=True):
+        """
+        Insert `stmt` into the block at `parent_path`, or replace the directive with the same key.
+        With `merge`, an existing block is updated child by child rather than replaced.
+
+        :param parent_path: Context path of the enclosing block, `()` for the main context
+        :type parent_path: ```tuple```
+
+        :param stmt: The directive, e.g., from `parse_cli_directives`
+        :type stmt: ```Union[dict, Directive]```
+
+        :param merge: Whether to upsert children of a block into an existing block
+        :type merge: ```bool```
+
+        :return: Context path of the upserted directive
+        :rtype: ```tuple```
+        """
+        if parent_path != () and self.nodes[parent_path].get("block") is None:
+            raise TypeError("{!r} is not a block".format(parent_path))
+        path = parent_path + (directive_key(stmt),)
+        existing = self.nodes.get(path)
+        if existing is None:
+            new = _without_lines(stmt)
+            self._children(parent_path).append(new)
+            self.merkle.link([new], 0 if parent_path == () else self.nodes[parent_path])
+            self.merkle.invalidate(new)
+            self.nodes[path] = new
+            self.files[path] = self.files[parent_path]
+            if new.get("block") is not None:
+                self._index_block(new["block"], path, self.files[path], frozenset())
+            self.dirty.add(self.files[path])
+        elif (
+            merge
+            and existing.get("block") is not None
+            and stmt.get("block") is not None
+        ):
+            if list(existing.get("args") or ()) != list(stmt.get("args") or ()):
+                existing["args"] = list(stmt["args"])
+                self.merkle.invalidate(existing)
+                self.dirty.add(self.files[path])
+            for child in stmt["block"]:
+                self.upsert(path, child, merge=merge)
+        elif self.merkle(existing) != Digests()(stmt):
+            if existing.get("block") is not None:
+                self._unindex_block(existing["block"], path)
+                self.merkle.unlink(existing["block"])
+            existing.clear()
+            existing.update(_without_lines(stmt))
+            if existing.get("block") is not None:
+                self._index_block(
+                    existing["block"], path, self.files[path], frozenset()
+                )
+                self.merkle.link(existing["block"], existing)
+            self.merkle.invalidate(existing)
+            self.dirty.add(self.files[path])
+        return path
+
+    def upsert_many(self, operations, merge=True):
+        """
+        :param operations: (parent_path, stmt) pairs
+        :type operations: ```Iterable[Tuple[tuple, dict]]```
+
+        :return: Context path of each upserted directive
+        :rtype: ```List[tuple]```
+        """
+        return [
+            self.upsert(parent_path, stmt, merge) for parent_path, stmt in operations
+        ]
+
+    def write(self):
+        """
+        Write out the files changed by upserts
+
+        :return: Filenames written
+        :rtype: ```List[str]```
+        """
+        written = []
+        for index in sorted(self.dirty):
+            config = self.payload["config"][index]
+            with atomic_writer(config["file"]) as f:
+                dump(config["parsed"], f)
+                f.write(os.linesep)
+            written.append(config["file"])
+        self.dirty.clear()
+        return written
+
+
+def _without_lines(stmt):
+    """Copy of `stmt` without line numbers—they'd refer to the CLI—and without empty blocks' `None`"""
+    if isinstance(stmt, Directive):
+        stmt = stmt.to_crossplane()
+    stmt = {k: deepcopy(v) for k, v in stmt.items() if k != "line"}
+    if stmt.get("block") is not None:
+        stmt["block"] = list(map(_without_lines, stmt["block"]))
+    elif "block" in stmt:
+        del stmt["block"]
+    return stmt
+
+
+def load(config_file, processes=None):
+    """
+    Files unchanged since a previous load are taken from the parse cache, see `loader.ParseCache`
+
+    :param config_file: nginx.conf, whose includes are followed
+    :type config_file: ```str```
+
+    :param processes: Size of the pool included files are parsed in, see `loader.parse`
+    :type processes: ```Optional[int]```
+
+    :return: Index over the parsed config
+    :rtype: ```ConfigIndex```
+    """
+    cache = loader.ParseCache.default()
+    payload = loader.parse(
+        config_file,
+        processes=processes,
+        catch_errors=False,
+        comments=True,
+        cache=cache,
+    )
+    if cache is not None:
+        cache.save()
+    return ConfigIndex(payload)
+
+
 def upsert(parent_context, context, config_file):
-    raise NotImplementedError()
+    """
+    Upsert directives into a config file and write back the files that changed
+
+    :param parent_context: Context path of the enclosing block, e.g., `("http",)`; see `context_path`
+    :type parent_context: ```Iterable[Union[str, tuple, dict]]```
+
+    :param context: One directive, or a list of them, e.g., from `parse_cli_directives`
+    :type context: ```Union[dict, Directive, List[Union[dict, Directive]]]```
+
+    :param config_file: nginx.conf, whose includes are followed
+    :type config_file: ```str```
+
+    :return: Filenames written
+    :rtype: ```List[str]```
+    """
+    index = load(config_file)
+    parent_path = context_path(*parent_context)
+    index.upsert_many(
+        (parent_path, stmt)
+        for stmt in ([context] if isinstance(context, (dict, Directive)) else context)
+    )
+    return index.write()
+
+
+__all__ = ["ConfigIndex", "context_path", "directive_key", "load", "upsert"]
@@ -67,7 +67,13 @@ if __name__ == "__main__":
         name=package_name,
         author=__author__,
         version=__version__,
-        install_requires=["crossplane", "boltons", "meta", "pyyaml!=6.0.0,!=5.4.0,!=5.4.1"],
+        install_requires=[
+            "crossplane",
+            "boltons",
+            "meta",
+            "pyyaml!=6.0.0,!=5.4.0,!=5.4.1",
+            "futures; python_version <= '2.7'",
+        ],
         test_suite=package_name + ".tests",
         packages=find_packages(),
         package_dir={package_name: package_name},